@@ -1,17 +1,36 @@
 from django.contrib import admin
-from .models import Customer, Meter, MeterReading, Tariff, Bill, Payment, Notification
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import (
+    Customer, Meter, MeterReading, Tariff, TariffBlock, Bill, Payment, Notification, BillingJob,
+    IdempotencyKey, BillingCycle, BillingShard,
+)
+from .search import matching_customers
 
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ("name", "house_number", "phone_number", "balance")
-    search_fields = ("name", "house_number")
+    list_select_related = ("ledger",)
+    search_fields = ("name", "house_number", "phone_number", "meter__serial_number")
+
+    def get_search_results(self, request, queryset, search_term):
+        # Indexed substring search (core.search) instead of icontains scans
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(pk__in=matching_customers(search_term)), False
 
 
 @admin.register(Meter)
 class MeterAdmin(admin.ModelAdmin):
     list_display = ("serial_number", "customer", "installation_date")
-    search_fields = ("serial_number",)
+    list_select_related = ("customer",)
+    search_fields = ("serial_number", "customer__name", "customer__house_number")
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(customer__in=matching_customers(search_term)), False
 
 
 @admin.register(MeterReading)
@@ -20,10 +39,16 @@ class MeterReadingAdmin(admin.ModelAdmin):
     list_filter = ("reading_date",)
 
 
+class TariffBlockInline(admin.TabularInline):
+    model = TariffBlock
+    extra = 0
+
+
 @admin.register(Tariff)
 class TariffAdmin(admin.ModelAdmin):
-    list_display = ("rate_per_unit", "effective_date")
+    list_display = ("rate_per_unit", "standing_charge", "effective_date")
     ordering = ("-effective_date",)
+    inlines = (TariffBlockInline,)
 
 
 @admin.register(Bill)
@@ -41,5 +66,50 @@ class PaymentAdmin(admin.ModelAdmin):
 
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
-    list_display = ("customer", "message", "created_at", "is_sent")
-    list_filter = ("is_sent",)
+    list_display = ("customer", "kind", "bill", "created_at", "is_sent", "sent_at", "attempts")
+    list_filter = ("is_sent", "kind")
+    list_select_related = ("customer",)
+
+
+@admin.register(BillingJob)
+class BillingJobAdmin(admin.ModelAdmin):
+    list_display = ("kind", "object_id", "status", "attempts", "run_after", "locked_by")
+    list_filter = ("status", "kind")
+    readonly_fields = ("last_error",)
+    actions = ("retry",)
+
+    @admin.action(description="Retry selected failed jobs")
+    def retry(self, request, queryset):
+        retried = 0
+        for job in queryset.filter(status=BillingJob.FAILED):
+            job.status, job.attempts, job.run_after = BillingJob.PENDING, 0, timezone.now()
+            try:
+                with transaction.atomic():
+                    job.save(update_fields=["status", "attempts", "run_after"])
+                retried += 1
+            except IntegrityError:  # a pending job for the same object exists
+                pass
+        self.message_user(request, f"Requeued {retried} job(s).")
+
+
+class BillingShardInline(admin.TabularInline):
+    model = BillingShard
+    extra = 0
+    fields = (
+        "number", "first_customer", "last_customer", "customers", "status", "bills",
+        "elapsed", "locked_by", "attempts",
+    )
+    readonly_fields = fields
+
+
+@admin.register(BillingCycle)
+class BillingCycleAdmin(admin.ModelAdmin):
+    list_display = ("period", "created_at", "finished_at")
+    inlines = (BillingShardInline,)
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ("key", "user", "path", "status_code", "created_at")
+    search_fields = ("key",)
+    date_hierarchy = "created_at"
@@ -0,0 +1,353 @@
+"""
+JSON equivalents of the list views.
+
+Every endpoint takes the same filters as its HTML list plus the keyset
+pagination parameters (``cursor``, ``per_page``, ``count``) and returns::
+
+    {"results": [...], "next": url or null, "previous": url or null,
+     "count": n or null, "count_is_exact": bool}
+
+The autocomplete endpoints answer ``?q=`` with ``{"results": [{"id", "text"}],
+"more": bool}``. ``api/meters/<id>/usage/`` returns a meter's consumption
+summed per day, week or month over a ``start``/``end`` window (see
+``core.usage``). The polled status endpoints under ``api/live/`` are async
+views with ETags (see ``core.live``).
+
+The batch endpoints take up to ``API_BATCH_LIMIT`` readings or payments in one
+POST and answer with a result per item, in request order::
+
+    {"created": n, "failed": n, "results": [
+        {"index": 0, "status": "created", "id": 17},
+        {"index": 1, "status": "error", "error": "unknown meter X"}, ...]}
+
+Devices authenticate with HTTP Basic auth; browser sessions need a CSRF
+token. A request sent with an ``Idempotency-Key`` header is processed once:
+a retry with the same key and body gets the stored response back, so a
+device that lost the first answer can safely send the batch again.
+"""
+import base64
+import binascii
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .filters import date_param, filter_bills, filter_payments
+from .ingestion import ingest_batch
+from .metrics import query_budget
+from .models import Bill, Customer, IdempotencyKey, Meter, Payment
+from .pagination import InvalidCursor, paginate_request
+from .payments import record_payments
+from .search import search_bills, search_customers, search_meters, search_readings
+from .usage import default_interval, usage_series
+
+
+def _page_response(request, queryset, keys, serialize, descending=True):
+    try:
+        page = paginate_request(request, queryset, keys, descending=descending, strict=True)
+    except InvalidCursor as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    def link(query):
+        return request.build_absolute_uri(f"{request.path}?{query}") if query else None
+
+    return JsonResponse({
+        "results": [serialize(item) for item in page],
+        "next": link(page.next_query),
+        "previous": link(page.previous_query),
+        "count": page.count,
+        "count_is_exact": page.count_is_exact,
+    })
+
+
+def _bill(bill):
+    return {
+        "id": bill.id,
+        "customer": {"id": bill.customer_id, "name": bill.customer.name},
+        "reading_id": bill.reading_id,
+        "issue_date": bill.issue_date,
+        "due_date": bill.due_date,
+        "charge": bill.charge,
+        "amount_due": bill.amount_due,
+        "is_paid": bill.is_paid,
+    }
+
+
+def _payment(payment):
+    return {
+        "id": payment.id,
+        "bill_id": payment.bill_id,
+        "customer": {"id": payment.bill.customer_id, "name": payment.bill.customer.name},
+        "amount": payment.amount,
+        "payment_date": payment.payment_date,
+        "reference_number": payment.reference_number,
+    }
+
+
+def _customer(customer):
+    return {
+        "id": customer.id,
+        "name": customer.name,
+        "house_number": customer.house_number,
+        "address": customer.address,
+        "phone_number": customer.phone_number,
+    }
+
+
+def _meter(meter):
+    return {
+        "id": meter.id,
+        "serial_number": meter.serial_number,
+        "installation_date": meter.installation_date,
+        "customer": {"id": meter.customer_id, "name": meter.customer.name},
+    }
+
+
+@login_required
+@query_budget(3)
+def bills_api(request):
+    bills = filter_bills(request.GET, Bill.objects.select_related("customer"))
+    return _page_response(request, bills, ("issue_date", "id"), _bill)
+
+
+@login_required
+@query_budget(3)
+def payments_api(request):
+    payments = filter_payments(request.GET, Payment.objects.select_related("bill__customer"))
+    return _page_response(request, payments, ("payment_date", "id"), _payment)
+
+
+@login_required
+@query_budget(3)
+def customers_api(request):
+    return _page_response(
+        request, Customer.objects.all(), ("name", "id"), _customer, descending=False
+    )
+
+
+@login_required
+@query_budget(3)
+def meters_api(request):
+    meters = Meter.objects.select_related("customer")
+    return _page_response(
+        request, meters, ("serial_number", "id"), _meter, descending=False
+    )
+
+
+@login_required
+@query_budget(4)
+def meter_usage_api(request, meter_id):
+    if not Meter.objects.filter(pk=meter_id).exists():
+        return JsonResponse({"error": f"unknown meter {meter_id}"}, status=404)
+    end = date_param(request.GET, "end") or timezone.localdate()
+    start = date_param(request.GET, "start") or end - timedelta(days=365)
+    interval = request.GET.get("interval") or default_interval(start, end)
+    try:
+        series = usage_series(meter_id, start, end, interval)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return JsonResponse({
+        "meter_id": meter_id,
+        "start": start,
+        "end": end,
+        "interval": interval,
+        "series": series,
+    })
+
+
+# -------------------------
+# Autocomplete
+# -------------------------
+def _autocomplete_response(request, search):
+    rows, more = search(request.GET.get("q", ""))
+    return JsonResponse({
+        "results": [{"id": row.pk, "text": str(row)} for row in rows],
+        "more": more,
+    })
+
+
+@login_required
+@query_budget(4)
+def customers_autocomplete(request):
+    return _autocomplete_response(request, search_customers)
+
+
+@login_required
+@query_budget(5)
+def meters_autocomplete(request):
+    return _autocomplete_response(request, search_meters)
+
+
+@login_required
+@query_budget(5)
+def readings_autocomplete(request):
+    return _autocomplete_response(request, search_readings)
+
+
+@login_required
+@query_budget(5)
+def bills_autocomplete(request):
+    return _autocomplete_response(request, search_bills)
+
+
+# -------------------------
+# Batch submission
+# -------------------------
+def _basic_auth_user(request):
+    """The user named by an HTTP Basic ``Authorization`` header, if valid."""
+    scheme, _, credentials = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+    if scheme.lower() != "basic":
+        return None
+    try:
+        username, _, password = base64.b64decode(credentials).decode().partition(":")
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return authenticate(request, username=username, password=password)
+
+
+def api_auth(view):
+    """
+    Accept HTTP Basic credentials (no CSRF token needed) or a logged-in
+    session (CSRF token required); anything else gets a JSON 401.
+    """
+    @csrf_exempt
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if "HTTP_AUTHORIZATION" in request.META:
+            user = _basic_auth_user(request)
+            if user is None:
+                return JsonResponse({"error": "invalid credentials"}, status=401)
+            request.user = user
+        elif request.user.is_authenticated:
+            rejected = CsrfViewMiddleware(lambda r: None).process_view(request, None, (), {})
+            if rejected:
+                return rejected
+        else:
+            return JsonResponse({"error": "authentication required"}, status=401)
+        return view(request, *args, **kwargs)
+
+    return wrapped
+
+
+def idempotent(view):
+    """
+    Replay the stored response for a repeated ``Idempotency-Key``. The key is
+    written in the same transaction as the work, so a request that failed
+    half-way leaves no key behind and can simply be retried.
+    """
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        key = request.headers.get("Idempotency-Key", "").strip()
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            return JsonResponse({"error": "Idempotency-Key is too long"}, status=400)
+
+        request_hash = hashlib.sha256(request.body).hexdigest()
+        stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if stored is None:
+            try:
+                with transaction.atomic():
+                    response = view(request, *args, **kwargs)
+                    if response.status_code >= 500:
+                        return response
+                    IdempotencyKey.objects.create(
+                        user=request.user,
+                        key=key,
+                        path=request.path,
+                        request_hash=request_hash,
+                        status_code=response.status_code,
+                        response=json.loads(response.content),
+                    )
+                return response
+            except IntegrityError:
+                # A concurrent request with the same key won, unless the work itself failed
+                stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+                if stored is None:
+                    raise
+
+        if stored.path != request.path or stored.request_hash != request_hash:
+            return JsonResponse(
+                {"error": "Idempotency-Key was already used for a different request"},
+                status=422,
+            )
+        response = JsonResponse(stored.response, status=stored.status_code)
+        response["Idempotent-Replayed"] = "true"
+        return response
+
+    return wrapped
+
+
+def _batch_items(request, name):
+    """The list under ``name`` in the JSON body, or an error response."""
+    try:
+        items = json.loads(request.body).get(name)
+    except (ValueError, AttributeError):
+        return None, JsonResponse({"error": "body must be a JSON object"}, status=400)
+    limit = getattr(settings, "API_BATCH_LIMIT", 1000)
+    if not isinstance(items, list) or not items:
+        return None, JsonResponse({"error": f'"{name}" must be a non-empty list'}, status=400)
+    if len(items) > limit:
+        return None, JsonResponse({"error": f"at most {limit} {name} per request"}, status=400)
+    if not all(isinstance(item, dict) for item in items):
+        return None, JsonResponse({"error": f'every "{name}" item must be an object'}, status=400)
+    return items, None
+
+
+def _batch_response(count, ids, errors):
+    """Per-item results in request order; ``ids``/``errors`` are keyed by index."""
+    errors = dict(errors)
+    results = []
+    for index in range(count):
+        if index in ids:
+            results.append({"index": index, "status": "created", "id": ids[index]})
+        else:
+            results.append({
+                "index": index, "status": "error", "error": errors.get(index, "not processed"),
+            })
+    return JsonResponse({"created": len(ids), "failed": count - len(ids), "results": results})
+
+
+@api_auth
+@require_POST
+@idempotent
+def readings_batch_api(request):
+    items, error = _batch_items(request, "readings")
+    if error:
+        return error
+    try:
+        result = ingest_batch([
+            (index, item.get("serial_number"), item.get("reading_date"), item.get("value"))
+            for index, item in enumerate(items)
+        ])
+    except ValidationError as exc:  # no tariff to bill the readings with
+        return JsonResponse({"error": " ".join(exc.messages)}, status=422)
+    return _batch_response(len(items), result.ids, result.errors)
+
+
+@api_auth
+@require_POST
+@idempotent
+def payments_batch_api(request):
+    items, error = _batch_items(request, "payments")
+    if error:
+        return error
+    result = record_payments([
+        (
+            index, item.get("bill_id"), item.get("amount"),
+            item.get("reference_number"), item.get("payment_date"),
+        )
+        for index, item in enumerate(items)
+    ])
+    return _batch_response(len(items), result.ids, result.errors)
@@ -0,0 +1,241 @@
+"""
+Benchmarks of the hot paths, run against whatever data is in the database
+(see ``generate_dataset`` for a synthetic one).
+
+Each benchmark is timed ``repeat`` times and reports the best, median and
+worst run, plus how many queries one run takes and how long they took. Benchmarks that write
+(ingestion, re-rating) run inside a transaction that is rolled back, so the
+dataset is the same for every run and after the suite. On-commit work such as
+the rollup refresh is therefore not included in their timings, and with
+``BILLING_ASYNC`` enabled the signal benchmarks only measure queueing.
+
+Results are plain dicts, written to JSON by ``manage.py run_benchmarks``;
+``compare_results`` lists the benchmarks that got slower than a previous run.
+"""
+import platform
+import statistics
+import subprocess
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.db import connection, reset_queries, transaction
+from django.db.models import Max
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from .ingestion import ingest_readings
+from .metrics import RequestMetrics
+from .models import Bill, Customer, Meter, MeterReading, Payment, Tariff, User
+from .search import search_customers
+from .tariffs import tariff_resolver
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register ``func(sample)`` as a benchmark; it returns a callable to time."""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def _rolled_back(func):
+    """Run ``func`` in a transaction that is always rolled back."""
+    def run():
+        try:
+            with transaction.atomic():
+                func()
+                transaction.set_rollback(True)
+        finally:
+            # A rolled-back tariff may still be in the resolver's cache
+            tariff_resolver.invalidate()
+    return run
+
+
+def _next_readings(sample):
+    """One new reading a month after the latest one for ``sample`` meters."""
+    latest = (
+        Meter.objects.filter(readings__isnull=False)
+        .annotate(last_date=Max("readings__reading_date"), last_value=Max("readings__value"))
+        .order_by("pk")
+        .values_list("pk", "serial_number", "last_date", "last_value")[:sample]
+    )
+    return [
+        (pk, serial, last_date + timedelta(days=30), last_value + Decimal("12.50"))
+        for pk, serial, last_date, last_value in latest
+    ]
+
+
+def _get(url_name, query=""):
+    """Call the view behind ``url_name`` directly, as a staff user, without middleware."""
+    url = reverse(url_name)
+    view = resolve(url).func
+    factory = RequestFactory(SERVER_NAME="localhost")
+    user = User(username="benchmark", is_staff=True)
+
+    def run():
+        request = factory.get(f"{url}?{query}" if query else url)
+        request.user = user
+        response = view(request)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url_name} returned {response.status_code}")
+    return run
+
+
+# -------------------------
+# Benchmarks
+# -------------------------
+@benchmark("ingest_signals")
+def ingest_signals(sample):
+    """Save readings one by one, billing each through the post_save receivers."""
+    readings = _next_readings(sample)
+
+    def run():
+        for meter_id, _, reading_date, value in readings:
+            MeterReading.objects.create(meter_id=meter_id, reading_date=reading_date, value=value)
+    return _rolled_back(run), len(readings)
+
+
+@benchmark("ingest_bulk")
+def ingest_bulk(sample):
+    """The same readings through ``ingest_readings``."""
+    rows = [
+        (line, serial, reading_date, value)
+        for line, (_, serial, reading_date, value) in enumerate(_next_readings(sample))
+    ]
+    return _rolled_back(lambda: ingest_readings(rows)), len(rows)
+
+
+@benchmark("rerate_tariff_change")
+def rerate_tariff_change(sample):
+    """A new tariff from the earliest reading date re-rates every unpaid bill."""
+    first = MeterReading.objects.order_by("reading_date").values_list(
+        "reading_date", flat=True
+    ).first()
+    latest = Tariff.objects.order_by("-effective_date").first()
+
+    def run():
+        Tariff.objects.create(
+            effective_date=first,
+            rate_per_unit=latest.rate_per_unit * Decimal("1.10"),
+            standing_charge=latest.standing_charge,
+        )
+    return _rolled_back(run), Bill.objects.filter(is_paid=False).count()
+
+
+@benchmark("dashboard")
+def dashboard(sample):
+    return _get("dashboard"), 1
+
+
+@benchmark("billing_list")
+def billing_list(sample):
+    return _get("billing_list"), 1
+
+
+@benchmark("billing_list_unpaid")
+def billing_list_unpaid(sample):
+    return _get("billing_list", "status=unpaid&count=1"), 1
+
+
+@benchmark("customer_search")
+def customer_search(sample):
+    """Autocomplete lookups on the end of a house number, as typed by a clerk."""
+    houses = Customer.objects.order_by("pk").values_list("house_number", flat=True)[:sample]
+    terms = [house[-5:] for house in houses]
+
+    def run():
+        for term in terms:
+            search_customers(term)
+    return run, len(terms)
+
+
+@benchmark("customer_balance")
+def customer_balance(sample):
+    """``Customer.balance`` for ``sample`` customers, each loaded on its own."""
+    pks = list(Customer.objects.order_by("pk").values_list("pk", flat=True)[:sample])
+
+    def run():
+        for pk in pks:
+            Customer.objects.get(pk=pk).balance
+    return run, len(pks)
+
+
+# -------------------------
+# Running and comparing
+# -------------------------
+def _environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, cwd=settings.BASE_DIR, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+    }
+
+
+def run_benchmarks(names=None, repeat=5, sample=200, progress=None):
+    """
+    Run the benchmarks called ``names`` (default: all) and return the results.
+    ``sample`` is how many readings or customers the per-row benchmarks use.
+    """
+    results = {
+        "created_at": timezone.now().isoformat(),
+        **_environment(),
+        "dataset": {
+            "customers": Customer.objects.count(),
+            "readings": MeterReading.objects.count(),
+            "bills": Bill.objects.count(),
+            "payments": Payment.objects.count(),
+        },
+        "repeat": repeat,
+        "benchmarks": {},
+    }
+    for name in names or BENCHMARKS:
+        run, items = BENCHMARKS[name](sample)
+        metrics = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            run()  # warm-up, and the queries of one run
+        timings = []
+        for _ in range(repeat):
+            reset_queries()  # DEBUG keeps a log of every query
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        median = statistics.median(timings)
+        results["benchmarks"][name] = {
+            "items": items,
+            "queries": metrics.queries,
+            "db_seconds": metrics.db_time,
+            "min": min(timings),
+            "median": median,
+            "max": max(timings),
+            "per_item": median / items if items else None,
+        }
+        if progress:
+            progress(name, results["benchmarks"][name])
+    return results
+
+
+def compare_results(previous, current, threshold=0.2):
+    """
+    ``(name, previous median, current median)`` for each benchmark whose
+    median got more than ``threshold`` slower.
+    """
+    slower = []
+    for name, result in current["benchmarks"].items():
+        before = previous.get("benchmarks", {}).get(name)
+        if before and result["median"] > before["median"] * (1 + threshold):
+            slower.append((name, before["median"], result["median"]))
+    return slower
@@ -0,0 +1,189 @@
+"""
+Monthly billing cycle.
+
+With ``BILLING_ON_READING`` off, readings are stored unbilled and the bills of
+a month are issued in one run of ``manage.py run_billing_cycle --period
+2026-10``. The customers with unbilled readings in the month are split into
+shards of consecutive customer ids holding about the same number of
+customers each; sharding by customer keeps every running balance in one
+shard. Worker processes claim shards one at a time (with ``claim_rows``, so no
+shard is worked twice at once) and bill them in batches with ``issue_bills``,
+each batch in its own transaction.
+
+The shard rows are the checkpoints. A batch only takes readings that have no
+bill yet, so an interrupted shard is simply run again, and running the
+command again for the same period skips the shards already done. Once every
+shard is done, a further run puts readings that arrived since in new shards.
+"""
+import logging
+import time
+import traceback
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .ingestion import issue_bills
+from .jobs import claim_rows, worker_name
+from .models import BillingCycle, BillingShard, MeterReading
+
+logger = logging.getLogger(__name__)
+
+SHARDS = 8
+BATCH_SIZE = 1000
+DUE_DAYS = 14
+BILLING_ORDER = ("meter__customer_id", "reading_date", "meter_id")
+
+
+def parse_period(value):
+    """The first day of a ``YYYY-MM`` period. Raises ValueError."""
+    try:
+        year, month = (int(part) for part in value.split("-"))
+        return date(year, month, 1)
+    except ValueError:
+        raise ValueError(f"invalid period {value!r}, expected YYYY-MM")
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def unbilled_readings(period):
+    """Readings dated in the month starting ``period`` that have no bill."""
+    return MeterReading.objects.filter(
+        reading_date__gte=period, reading_date__lt=_next_month(period), bill__isnull=True
+    )
+
+
+# -------------------------
+# Planning
+# -------------------------
+def plan_cycle(period, shards=SHARDS, stale_after=None):
+    """
+    The ``BillingCycle`` of ``period``, ready to run. Failed shards, and
+    shards claimed more than ``stale_after`` seconds ago by a worker that
+    never finished, go back to pending. When every shard is done, the
+    customers that still have unbilled readings are split into up to
+    ``shards`` new shards.
+    """
+    if stale_after is None:
+        stale_after = getattr(settings, "BILLING_JOB_TIMEOUT", 600)
+    with transaction.atomic():
+        cycle, _ = BillingCycle.objects.get_or_create(period=period)
+        cycle.shards.filter(status=BillingShard.FAILED).update(status=BillingShard.PENDING)
+        cycle.shards.filter(
+            status=BillingShard.RUNNING,
+            locked_at__lt=timezone.now() - timedelta(seconds=stale_after),
+        ).update(status=BillingShard.PENDING, locked_by="", locked_at=None)
+        if cycle.shards.exclude(status=BillingShard.DONE).exists():
+            return cycle
+
+        customer_ids = list(
+            unbilled_readings(period)
+            .order_by("meter__customer_id")
+            .values_list("meter__customer_id", flat=True)
+            .distinct()
+        )
+        if not customer_ids:
+            return cycle
+        count = min(shards, len(customer_ids))
+        size = -(-len(customer_ids) // count)
+        number = cycle.shards.aggregate(last=Max("number"))["last"] or 0
+        BillingShard.objects.bulk_create([
+            BillingShard(
+                cycle=cycle,
+                number=number + index + 1,
+                first_customer=customer_ids[start],
+                # Ranges are contiguous, so customers whose first reading
+                # arrives during the run are billed by the shard covering them
+                last_customer=(
+                    customer_ids[start + size] - 1
+                    if start + size < len(customer_ids) else customer_ids[-1]
+                ),
+                customers=len(customer_ids[start:start + size]),
+            )
+            for index, start in enumerate(range(0, len(customer_ids), size))
+        ])
+        cycle.finished_at = None
+        cycle.save(update_fields=["finished_at"])
+    return cycle
+
+
+def finish_cycle(cycle):
+    """Record the cycle as finished if all its shards are done."""
+    if not cycle.shards.exclude(status=BillingShard.DONE).exists():
+        BillingCycle.objects.filter(pk=cycle.pk, finished_at__isnull=True).update(
+            finished_at=timezone.now()
+        )
+    cycle.refresh_from_db(fields=["finished_at"])
+    return cycle.finished_at is not None
+
+
+# -------------------------
+# Running
+# -------------------------
+def run_shard(shard, batch_size=BATCH_SIZE, due_days=DUE_DAYS):
+    """Bill the unbilled readings of a claimed shard. Returns the number of bills."""
+    readings = unbilled_readings(shard.cycle.period).filter(
+        meter__customer_id__gte=shard.first_customer,
+        meter__customer_id__lte=shard.last_customer,
+    )
+    ids = list(readings.order_by(*BILLING_ORDER).values_list("pk", flat=True))
+    billed = 0
+    for index in range(0, len(ids), batch_size):
+        with transaction.atomic():
+            batch = list(
+                readings.filter(pk__in=ids[index:index + batch_size])
+                .annotate(customer_id=F("meter__customer_id"))
+                .order_by(*BILLING_ORDER)
+            )
+            bills = issue_bills(batch, due_days)
+            BillingShard.objects.filter(pk=shard.pk).update(
+                bills=F("bills") + len(bills), locked_at=timezone.now()
+            )
+        billed += len(bills)
+    return billed
+
+
+def claim_shard(cycle_id, worker):
+    """Mark the next pending shard of a cycle as running for ``worker`` and return it."""
+    pending = BillingShard.objects.filter(
+        cycle_id=cycle_id, status=BillingShard.PENDING
+    ).order_by("number")
+    ids = claim_rows(
+        pending, 1, status=BillingShard.RUNNING, locked_by=worker, locked_at=timezone.now()
+    )
+    return BillingShard.objects.select_related("cycle").filter(pk__in=ids).first()
+
+
+def work_cycle(cycle_id, batch_size=BATCH_SIZE, due_days=DUE_DAYS, stop=None):
+    """
+    Claim and run shards of a cycle until none is pending (or ``stop()`` is
+    true). Returns the number of shards this worker finished.
+    """
+    worker = worker_name()
+    done = 0
+    while not (stop and stop()):
+        shard = claim_shard(cycle_id, worker)
+        if shard is None:
+            break
+        started = time.perf_counter()
+        try:
+            run_shard(shard, batch_size=batch_size, due_days=due_days)
+        except Exception:
+            logger.warning("Billing shard %s failed", shard, exc_info=True)
+            BillingShard.objects.filter(pk=shard.pk).update(
+                status=BillingShard.FAILED, attempts=F("attempts") + 1,
+                elapsed=F("elapsed") + (time.perf_counter() - started),
+                last_error=traceback.format_exc(), locked_by="", locked_at=None,
+            )
+            continue
+        BillingShard.objects.filter(pk=shard.pk).update(
+            status=BillingShard.DONE, attempts=F("attempts") + 1,
+            elapsed=F("elapsed") + (time.perf_counter() - started),
+            last_error="", finished_at=timezone.now(),
+        )
+        done += 1
+    return done
@@ -0,0 +1,115 @@
+"""
+Versioned page caching.
+
+Customers and meters change rarely while their pages are read all day, so the
+customer and meter lists keep their rendered cards, and the customer detail
+and water management pages their query results, in the ``default`` cache
+(local memory, files or Redis; see ``CACHE_BACKEND``).
+
+Every cached value belongs to *scopes*: ``customers`` and ``meters`` (the
+lists), ``readings`` (the latest readings) and ``customer:<id>`` (one customer
+with their meter, bills and payments). Each scope has a version token in the
+cache and a value's key includes the tokens of its scopes, so invalidating a
+scope is a single write that makes every value built from it unreachable; the
+orphans expire after ``PAGE_CACHE_SECONDS``. Tokens are random rather than
+counters, so an evicted token cannot come back and revive old values.
+
+Signals invalidate the scopes of the customers, meters, bills, payments and
+readings saved or deleted; the bulk paths, which skip the signals, are covered
+through the rollup buckets they mark dirty. A scope is invalidated at once and
+again when the transaction commits, so a request that read the old rows before
+the commit cannot leave them cached under the new token.
+
+``version`` and ``invalidate`` also serve in-process caches of other modules
+(the tariff timeline) as a cross-process change signal.
+"""
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .metrics import registry
+
+CUSTOMERS = "customers"
+METERS = "meters"
+READINGS = "readings"
+
+_MISSING = object()
+_state = threading.local()
+
+
+def customer_scope(customer_id):
+    """Scope of one customer's detail page."""
+    return f"customer:{customer_id}"
+
+
+def _version_key(scope):
+    return f"version:{scope}"
+
+
+def _versions(scopes):
+    """The current version token of each of ``scopes``."""
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # add() keeps a token another process set in the meantime
+            token = uuid.uuid4().hex
+            found[key] = token if cache.add(key, token, None) else cache.get(key, token)
+    return [found[key] for key in keys]
+
+
+def version(scope):
+    """The current version token of ``scope``."""
+    return _versions([scope])[0]
+
+
+def cached(name, scopes, build, vary=""):
+    """
+    The value of ``build()``, cached as fragment ``name`` until one of
+    ``scopes`` is invalidated. ``vary`` tells apart values of the same scopes
+    (the query string of a list page, say).
+    """
+    digest = hashlib.md5("|".join([*_versions(scopes), vary]).encode()).hexdigest()
+    key = f"{name}:{digest}"
+    value = cache.get(key, _MISSING)
+    registry.record_cache(name, value is not _MISSING)
+    if value is _MISSING:
+        value = build()
+        cache.set(key, value, getattr(settings, "PAGE_CACHE_SECONDS", 600))
+    return value
+
+
+# -------------------------
+# Invalidation
+# -------------------------
+def invalidate(*scopes):
+    """Drop the cached values of ``scopes``, now and when the transaction commits."""
+    scopes = set(scopes)
+    if not scopes:
+        return
+    _bump(scopes)
+    if transaction.get_connection().in_atomic_block:
+        if not hasattr(_state, "scopes"):
+            _state.scopes = set()
+        _state.scopes |= scopes
+        transaction.on_commit(_flush)
+
+
+def invalidate_customers(customer_ids):
+    """Drop the cached detail pages of ``customer_ids``."""
+    invalidate(*(customer_scope(pk) for pk in set(customer_ids) if pk is not None))
+
+
+def _flush():
+    scopes = getattr(_state, "scopes", set())
+    if scopes:
+        _state.scopes = set()
+        _bump(scopes)
+
+
+def _bump(scopes):
+    cache.set_many({_version_key(scope): uuid.uuid4().hex for scope in scopes}, None)
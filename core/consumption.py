@@ -0,0 +1,128 @@
+"""
+Consumption engine.
+
+``units_consumed`` is the difference between a reading and the previous
+reading of the same meter by date (the first reading counts in full; meter
+roll-backs count as zero). ``recompute_consumption`` recomputes it with a
+``LAG()`` window over ``(meter, reading_date)`` in a single ``UPDATE ... FROM``
+statement, so backdated inserts and corrections also fix every later reading.
+Bills of readings whose consumption changed are re-rated.
+"""
+import sqlite3
+
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import Lag
+
+from .models import Bill, MeterReading
+from .rerating import rerate_bills
+from .rollups import readings_dirty
+
+
+def _supports_update_from():
+    if connection.vendor == "postgresql":
+        return True
+    # UPDATE ... FROM arrived in SQLite 3.33 and RETURNING in 3.35
+    return connection.vendor == "sqlite" and sqlite3.sqlite_version_info >= (3, 35)
+
+
+def recompute_consumption(meter_ids=None, start=None, end=None, rerate=True, counted=()):
+    """
+    Recompute ``units_consumed`` for the readings of ``meter_ids`` (default:
+    every meter) dated between ``start`` and ``end`` (inclusive, both
+    optional). Returns the ids of readings whose value changed.
+
+    The rollup buckets of changed readings are recomputed, except for the
+    ``counted`` readings whose change the caller adds to the rollups itself.
+    """
+    if meter_ids is not None:
+        meter_ids = list(meter_ids)
+        if not meter_ids:
+            return []
+    to_date = MeterReading._meta.get_field("reading_date").to_python
+    start = to_date(start) if start is not None else None
+    end = to_date(end) if end is not None else None
+
+    with transaction.atomic():
+        if _supports_update_from():
+            changed = _recompute_sql(meter_ids, start, end)
+        else:
+            changed = _recompute_orm(meter_ids, start, end)
+        if changed:
+            readings_dirty(changed, counted)
+        if rerate and changed:
+            rerate_bills(Bill.objects.filter(reading_id__in=changed))
+    return changed
+
+
+def _recompute_sql(meter_ids, start, end):
+    qn = connection.ops.quote_name
+    table = qn(MeterReading._meta.db_table)
+
+    partition_filter, params = "", []
+    if meter_ids is not None:
+        partition_filter = "WHERE meter_id IN (%s)" % ", ".join(["%s"] * len(meter_ids))
+        params.extend(meter_ids)
+
+    date_filter = ""
+    if start is not None:
+        date_filter += " AND lagged.reading_date >= %s"
+        params.append(start)
+    if end is not None:
+        date_filter += " AND lagged.reading_date <= %s"
+        params.append(end)
+
+    sql = f"""
+        WITH lagged AS (
+            SELECT id, reading_date,
+                   ROUND(CASE
+                       WHEN previous_value IS NULL THEN value
+                       WHEN value > previous_value THEN value - previous_value
+                       ELSE 0
+                   END, 2) AS units
+            FROM (
+                SELECT id, reading_date, value,
+                       LAG(value) OVER (
+                           PARTITION BY meter_id ORDER BY reading_date
+                       ) AS previous_value
+                FROM {table}
+                {partition_filter}
+            ) AS windowed
+        )
+        UPDATE {table}
+        SET units_consumed = lagged.units
+        FROM lagged
+        WHERE {table}.id = lagged.id{date_filter}
+          AND ({table}.units_consumed IS NULL OR {table}.units_consumed <> lagged.units)
+        RETURNING {table}.id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _recompute_orm(meter_ids, start, end):
+    """Portable fallback: window query, then one bulk UPDATE."""
+    readings = MeterReading.objects.annotate(
+        previous_value=Window(
+            Lag("value"), partition_by=F("meter_id"), order_by=F("reading_date").asc()
+        )
+    ).only("id", "reading_date", "value", "units_consumed")
+    if meter_ids is not None:
+        readings = readings.filter(meter_id__in=meter_ids)
+
+    updated = []
+    for reading in readings:
+        if (start is not None and reading.reading_date < start) or (
+            end is not None and reading.reading_date > end
+        ):
+            continue
+        if reading.previous_value is None:
+            units = reading.value
+        else:
+            units = max(reading.value - reading.previous_value, 0)
+        if reading.units_consumed != units:
+            reading.units_consumed = units
+            updated.append(reading)
+    MeterReading.objects.bulk_update(updated, ["units_consumed"], batch_size=1000)
+    return [reading.pk for reading in updated]
@@ -0,0 +1,143 @@
+"""
+Streaming exports of bills, payments and meter readings.
+
+Rows are read with ``values_list(...).iterator(chunk_size=...)`` (a
+server-side cursor on PostgreSQL) and written out as they arrive, so memory
+use does not grow with the size of the export. CSV is streamed: the header
+is sent straight away and the body follows in blocks of about 64 KB. XLSX
+needs the optional ``openpyxl`` package; a workbook is a zip file that can
+only be sent once complete, so it is built in write-only mode in a temporary
+file first. Rows are read from the replica when one is configured.
+"""
+import csv
+import io
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+try:
+    import openpyxl
+except ImportError:  # openpyxl is optional
+    openpyxl = None
+
+from django.utils import timezone
+
+from .filters import filter_bills, filter_payments, filter_readings
+from .routers import read_alias
+
+FORMATS = ("csv", "xlsx")
+FLUSH_SIZE = 64 * 1024
+
+
+@dataclass(frozen=True)
+class Column:
+    header: str
+    field: str
+    convert: Optional[Callable] = None
+
+
+@dataclass(frozen=True)
+class Export:
+    """A named export: the rows selected by ``queryset(params)``."""
+
+    name: str
+    queryset: Callable
+    columns: tuple
+
+    @property
+    def headers(self):
+        return [column.header for column in self.columns]
+
+    def rows(self, params, chunk_size=2000):
+        converters = [column.convert for column in self.columns]
+        rows = (
+            self.queryset(params)
+            .using(read_alias())
+            .values_list(*(column.field for column in self.columns))
+            .iterator(chunk_size=chunk_size)
+        )
+        if not any(converters):
+            return rows
+        return (
+            [convert(value) if convert else value for convert, value in zip(converters, row)]
+            for row in rows
+        )
+
+
+def _status(is_paid):
+    return "Paid" if is_paid else "Unpaid"
+
+
+EXPORTS = {
+    export.name: export
+    for export in (
+        Export("bills", filter_bills, (
+            Column("Bill", "id"),
+            Column("Customer", "customer__name"),
+            Column("House Number", "customer__house_number"),
+            Column("Reading Date", "reading__reading_date"),
+            Column("Issue Date", "issue_date"),
+            Column("Due Date", "due_date"),
+            Column("Charge", "charge"),
+            Column("Amount Due", "amount_due"),
+            Column("Status", "is_paid", _status),
+        )),
+        Export("payments", filter_payments, (
+            Column("Reference", "reference_number"),
+            Column("Bill", "bill_id"),
+            Column("Customer", "bill__customer__name"),
+            Column("House Number", "bill__customer__house_number"),
+            Column("Amount", "amount"),
+            Column("Date", "payment_date"),
+        )),
+        Export("readings", filter_readings, (
+            Column("Meter", "meter__serial_number"),
+            Column("Customer", "meter__customer__name"),
+            Column("House Number", "meter__customer__house_number"),
+            Column("Reading Date", "reading_date"),
+            Column("Value", "value"),
+            Column("Units Consumed", "units_consumed"),
+        )),
+    )
+}
+
+
+def xlsx_available():
+    return openpyxl is not None
+
+
+def iter_csv(export, params, chunk_size=2000):
+    """Yield the CSV export in blocks of text, header first."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export.headers)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for row in export.rows(params, chunk_size):
+        writer.writerow(row)
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def write_xlsx(export, params, fileobj, chunk_size=2000):
+    """Write the export as a single-sheet workbook to a binary ``fileobj``."""
+    if openpyxl is None:
+        raise RuntimeError("XLSX export requires openpyxl.")
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(export.name)
+    sheet.append(export.headers)
+    for row in export.rows(params, chunk_size):
+        sheet.append([_naive(value) for value in row])
+    workbook.save(fileobj)
+
+
+def _naive(value):
+    # Excel has no time zones
+    if getattr(value, "tzinfo", None) is not None:
+        return timezone.localtime(value).replace(tzinfo=None)
+    return value
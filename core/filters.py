@@ -0,0 +1,93 @@
+"""
+Query-string filters shared by the list views, the exports and their
+management commands, so every one of them selects the same rows.
+
+Each function takes a mapping of parameters (``request.GET`` or the options
+of a command) and returns a filtered, deterministically ordered queryset.
+Invalid dates are ignored rather than turned into server errors.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Bill, MeterReading, Payment
+from .search import matching_customers
+
+
+def date_param(params, name):
+    """A ``YYYY-MM-DD`` query parameter as a date, or None when missing or invalid."""
+    try:
+        return parse_date(params.get(name) or "")
+    except ValueError:
+        return None
+
+
+def _day_start(day):
+    moment = datetime.combine(day, time.min)
+    return timezone.make_aware(moment) if settings.USE_TZ else moment
+
+
+def filter_bills(params, queryset=None):
+    """Bills by ``status`` (paid/unpaid), customer ``search`` and issue date."""
+    bills = Bill.objects.all() if queryset is None else queryset
+
+    status = params.get("status")
+    if status == "paid":
+        bills = bills.filter(is_paid=True)
+    elif status == "unpaid":
+        bills = bills.filter(is_paid=False)
+
+    search = params.get("search")
+    if search:
+        bills = bills.filter(customer__in=matching_customers(search))
+
+    start_date, end_date = date_param(params, "start_date"), date_param(params, "end_date")
+    if start_date:
+        bills = bills.filter(issue_date__gte=start_date)
+    if end_date:
+        bills = bills.filter(issue_date__lte=end_date)
+    return bills.order_by("-issue_date", "-id")
+
+
+def filter_payments(params, queryset=None):
+    """Payments by customer or reference ``search`` and payment date."""
+    payments = Payment.objects.all() if queryset is None else queryset
+
+    search = params.get("search")
+    if search:
+        payments = payments.filter(
+            Q(reference_number__icontains=search) |
+            Q(bill__customer__in=matching_customers(search))
+        )
+
+    # Compare against datetimes rather than payment_date__date so the
+    # (payment_date, id) index stays usable
+    start_date, end_date = date_param(params, "start_date"), date_param(params, "end_date")
+    if start_date:
+        payments = payments.filter(payment_date__gte=_day_start(start_date))
+    if end_date:
+        payments = payments.filter(payment_date__lt=_day_start(end_date + timedelta(days=1)))
+    return payments.order_by("-payment_date", "-id")
+
+
+def filter_readings(params, queryset=None):
+    """Readings by meter serial ``meter``, customer ``search`` and reading date."""
+    readings = MeterReading.objects.all() if queryset is None else queryset
+
+    meter = params.get("meter")
+    if meter:
+        readings = readings.filter(meter__serial_number=meter)
+
+    search = params.get("search")
+    if search:
+        readings = readings.filter(meter__customer__in=matching_customers(search))
+
+    start_date, end_date = date_param(params, "start_date"), date_param(params, "end_date")
+    if start_date:
+        readings = readings.filter(reading_date__gte=start_date)
+    if end_date:
+        readings = readings.filter(reading_date__lte=end_date)
+    return readings.order_by("-reading_date", "-id")
@@ -1,15 +1,47 @@
 from django import forms
+from django.urls import reverse_lazy
 from .models import Meter, Customer, Bill, Payment, MeterReading
 
+
+class AutocompleteSelect(forms.Select):
+    """
+    A model select that renders only the chosen option, so the page does not
+    grow with the table. Other options are fetched from ``url`` (one of the
+    ``api/autocomplete/`` endpoints) as the user types.
+    """
+
+    def __init__(self, url, attrs=None):
+        super().__init__(attrs)
+        self.url = url
+
+    class Media:
+        js = ["core/js/autocomplete.js"]
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs["data-autocomplete-url"] = reverse_lazy(self.url)
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        field = self.choices.field
+        chosen = [pk for pk in value if str(pk).isdigit()]
+        options = [self.create_option(name, "", field.empty_label or "", not chosen, 0)]
+        for index, obj in enumerate(field.queryset.filter(pk__in=chosen), start=1):
+            label = field.label_from_instance(obj)
+            options.append(self.create_option(name, obj.pk, label, True, index))
+        return [(None, options, 0)]
+
+
 class CustomerForm(forms.ModelForm):
     class Meta:
         model = Customer
-        fields = ["name", "house_number", "address", "phone_number"]
+        fields = ["name", "house_number", "address", "phone_number", "zone"]
         widgets = {
             "name": forms.TextInput(attrs={"class": "form-control", "placeholder": "Full Name"}),
             "house_number": forms.TextInput(attrs={"class": "form-control", "placeholder": "House Number"}),
             "address": forms.Textarea(attrs={"class": "form-control", "placeholder": "Customer Address", "rows": 3}),
             "phone_number": forms.TextInput(attrs={"class": "form-control", "placeholder": "Phone Number"}),
+            "zone": forms.TextInput(attrs={"class": "form-control", "placeholder": "Supply Zone"}),
         }
 
 
@@ -19,7 +51,7 @@ class MeterForm(forms.ModelForm):
         model = Meter
         fields = ["customer", "serial_number", "installation_date"]
         widgets = {
-            "customer": forms.Select(attrs={"class": "form-select"}),
+            "customer": AutocompleteSelect("autocomplete_customers", attrs={"class": "form-select"}),
             "serial_number": forms.TextInput(attrs={"class": "form-control", "placeholder": "Meter Serial Number"}),
             "installation_date": forms.DateInput(attrs={"class": "form-control", "type": "date"}),
         }
@@ -30,8 +62,8 @@ class BillForm(forms.ModelForm):
         model = Bill
         fields = ["customer", "reading", "issue_date", "due_date"]
         widgets = {
-            "customer": forms.Select(attrs={"class": "form-select"}),
-            "reading": forms.Select(attrs={"class": "form-select"}),
+            "customer": AutocompleteSelect("autocomplete_customers", attrs={"class": "form-select"}),
+            "reading": AutocompleteSelect("autocomplete_readings", attrs={"class": "form-select"}),
             "issue_date": forms.DateInput(attrs={"type": "date", "class": "form-control"}),
             "due_date": forms.DateInput(attrs={"type": "date", "class": "form-control"}),
         }
@@ -40,6 +72,8 @@ class BillForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         self.fields["customer"].empty_label = "Select Customer"
         self.fields["reading"].empty_label = "Select Meter Reading"
+        # MeterReading.__str__ goes through the meter to the customer
+        self.fields["reading"].queryset = MeterReading.objects.select_related("meter__customer")
 
 
 
@@ -48,7 +82,7 @@ class PaymentForm(forms.ModelForm):
         model = Payment
         fields = ["bill", "amount", "payment_date", "reference_number"]
         widgets = {
-            "bill": forms.Select(attrs={"class": "form-select"}),
+            "bill": AutocompleteSelect("autocomplete_bills", attrs={"class": "form-select"}),
             "amount": forms.NumberInput(attrs={"class": "form-control", "step": "0.01", "placeholder": "Enter Amount Paid"}),
             "payment_date": forms.DateTimeInput(attrs={"type": "datetime-local", "class": "form-control"}),
             "reference_number": forms.TextInput(attrs={"class": "form-control", "placeholder": "Enter Payment Reference Number"}),
@@ -57,6 +91,8 @@ class PaymentForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields["bill"].empty_label = "Select Bill"
+        # Bill.__str__ shows the customer name
+        self.fields["bill"].queryset = Bill.objects.select_related("customer")
 
 
         
@@ -65,8 +101,8 @@ class MeterReadingForm(forms.ModelForm):
         model = MeterReading
         fields = ["meter", "reading_date", "value"]  # exclude units_consumed
         widgets = {
-            "meter": forms.Select(
-                attrs={"class": "form-select"}
+            "meter": AutocompleteSelect(
+                "autocomplete_meters", attrs={"class": "form-select"}
             ),
             "reading_date": forms.DateInput(
                 attrs={"type": "date", "class": "form-control", "placeholder": "Choose the date"}
@@ -84,4 +120,6 @@ class MeterReadingForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Change the default "------" option for the Select field
-        self.fields["meter"].empty_label = "Select the meter owner"
\ No newline at end of file
+        self.fields["meter"].empty_label = "Select the meter owner"
+        # Meter.__str__ shows the customer name
+        self.fields["meter"].queryset = Meter.objects.select_related("customer")
\ No newline at end of file
@@ -0,0 +1,311 @@
+"""
+Bulk ingestion of meter readings.
+
+Saving readings one by one fires ``auto_create_or_update_bill`` for every row
+(units lookup, tariff lookup, balance lookup and a status update).
+Route uploads go through ``ingest_readings`` instead: units and bills for a
+whole batch are worked out in a few set-based passes and written with
+``bulk_create`` inside a single transaction. The resulting bills are the same
+as the per-row path would produce.
+
+With ``BILLING_ON_READING`` off, readings are stored without bills and
+``issue_bills`` is called later by the monthly billing cycle.
+"""
+import csv
+import json
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .caching import READINGS, invalidate
+from .consumption import recompute_consumption
+from .ledger import ZERO, apply_deltas, balances_for
+from .models import Bill, Meter, MeterReading
+from .rollups import mark_dirty
+from .stats import apply_stat_deltas, bill_deltas, readings_key
+from .tariffs import rate_readings
+
+
+@dataclass
+class IngestResult:
+    """Outcome of an ingestion run."""
+
+    rows: int = 0
+    created: int = 0
+    errors: list = field(default_factory=list)  # (line number, message)
+    ids: dict = field(default_factory=dict)  # line number -> reading id
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.created += other.created
+        self.errors.extend(other.errors)
+        self.ids.update(other.ids)
+
+
+# -------------------------
+# Parsing
+# -------------------------
+def parse_readings(stream, fmt="csv"):
+    """
+    Yield ``(line_number, serial_number, reading_date, value)`` tuples from a
+    CSV (with a header row) or JSON-lines stream. Values are left as strings;
+    they are validated during ingestion.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for line_number, row in enumerate(reader, start=2):
+            yield line_number, row.get("serial_number"), row.get("reading_date"), row.get("value")
+    elif fmt == "jsonl":
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_number, None, None, None
+                continue
+            yield line_number, row.get("serial_number"), row.get("reading_date"), row.get("value")
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def _clean_row(serial_number, reading_date, value):
+    """Validate a raw row, returning cleaned values or raising ValueError."""
+    if not serial_number:
+        raise ValueError("missing serial_number")
+    try:
+        if not isinstance(reading_date, date):
+            reading_date = date.fromisoformat(str(reading_date))
+    except ValueError:
+        raise ValueError(f"invalid reading_date {reading_date!r}")
+    try:
+        value = Decimal(str(value)).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"invalid value {value!r}")
+    if value < 0:
+        raise ValueError("value must be non-negative")
+    return str(serial_number).strip(), reading_date, value
+
+
+# -------------------------
+# Ingestion
+# -------------------------
+def bill_on_reading():
+    """Whether every reading is billed when it is saved (or by the monthly cycle)."""
+    return getattr(settings, "BILLING_ON_READING", True)
+
+
+def ingest_readings(rows, due_days=7, batch_size=1000, bill=None):
+    """
+    Ingest an iterable of ``(line_number, serial_number, reading_date, value)``
+    rows in batches of ``batch_size``. Each batch is written in its own
+    transaction. ``bill`` (default: ``bill_on_reading()``) tells whether the
+    readings are billed straight away.
+    """
+    result = IngestResult()
+    started = time.perf_counter()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            result.merge(ingest_batch(batch, due_days=due_days, bill=bill))
+            batch = []
+    if batch:
+        result.merge(ingest_batch(batch, due_days=due_days, bill=bill))
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def ingest_batch(rows, due_days=7, bill=None):
+    """Validate, rate and write one batch of readings (and their bills, if ``bill``)."""
+    if bill is None:
+        bill = bill_on_reading()
+    result = IngestResult(rows=len(rows))
+    started = time.perf_counter()
+
+    cleaned = []
+    for line_number, serial_number, reading_date, value in rows:
+        try:
+            cleaned.append((line_number, *_clean_row(serial_number, reading_date, value)))
+        except ValueError as exc:
+            result.errors.append((line_number, str(exc)))
+
+    with transaction.atomic():
+        readings, backdated = _build_readings(cleaned, result)
+        if readings:
+            MeterReading.objects.bulk_create(readings)
+            if backdated:
+                _recompute_backdated(readings, backdated)
+            # One call for every counter, so they are locked in name order
+            counters = Counter(readings_key(reading.reading_date) for reading in readings)
+            if bill:
+                issue_bills(readings, due_days, counters)
+            else:
+                apply_stat_deltas(counters)
+            mark_dirty([(reading.customer_id, reading.reading_date) for reading in readings])
+            invalidate(READINGS)
+            result.created = len(readings)
+            result.ids = {reading.line_number: reading.pk for reading in readings}
+
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def _build_readings(cleaned, result):
+    """
+    Resolve meters, drop conflicting rows and compute ``units_consumed`` for
+    the remaining ones by comparing each reading with the previous one of its
+    meter (stored, or an earlier row of the same batch).
+
+    Returns the readings and ``{meter_id: earliest date}`` for meters that
+    received readings older than their latest stored one; those need the
+    consumption engine once the rows are written.
+    """
+    serials = {row[1] for row in cleaned}
+    meters = {
+        serial: (meter_id, customer_id)
+        for serial, meter_id, customer_id in Meter.objects.filter(
+            serial_number__in=serials
+        ).values_list("serial_number", "id", "customer_id")
+    }
+
+    meter_ids = {meter_id for meter_id, _ in meters.values()}
+    dates = {row[2] for row in cleaned}
+    existing = set(
+        MeterReading.objects.filter(
+            meter_id__in=meter_ids, reading_date__in=dates
+        ).values_list("meter_id", "reading_date")
+    )
+
+    latest = MeterReading.objects.filter(meter=OuterRef("pk")).order_by("-reading_date")
+    previous = {
+        meter_id: (last_date, last_value)
+        for meter_id, last_date, last_value in Meter.objects.filter(id__in=meter_ids)
+        .annotate(
+            last_date=Subquery(latest.values("reading_date")[:1]),
+            last_value=Subquery(latest.values("value")[:1]),
+        )
+        .values_list("id", "last_date", "last_value")
+        if last_date is not None
+    }
+
+    stored_latest = {meter_id: last[0] for meter_id, last in previous.items()}
+    backdated = {}
+    readings = []
+    for line_number, serial_number, reading_date, value in sorted(
+        cleaned, key=lambda row: (row[1], row[2])
+    ):
+        if serial_number not in meters:
+            result.errors.append((line_number, f"unknown meter {serial_number}"))
+            continue
+        meter_id, customer_id = meters[serial_number]
+        if (meter_id, reading_date) in existing:
+            result.errors.append(
+                (line_number, f"duplicate reading for {serial_number} on {reading_date}")
+            )
+            continue
+        existing.add((meter_id, reading_date))
+        if meter_id in stored_latest and reading_date < stored_latest[meter_id]:
+            backdated[meter_id] = min(reading_date, backdated.get(meter_id, reading_date))
+
+        last = previous.get(meter_id)
+        if last:
+            units_consumed = max(value - last[1], 0)
+        else:
+            units_consumed = value  # first reading
+        if last is None or reading_date >= last[0]:
+            previous[meter_id] = (reading_date, value)
+
+        reading = MeterReading(
+            meter_id=meter_id,
+            reading_date=reading_date,
+            value=value,
+            units_consumed=units_consumed,
+        )
+        reading.customer_id = customer_id
+        reading.line_number = line_number
+        readings.append(reading)
+    return readings, backdated
+
+
+def _recompute_backdated(readings, backdated):
+    """Let the consumption engine fix backdated readings and the ones after them."""
+    recompute_consumption(meter_ids=backdated, start=min(backdated.values()))
+    units = dict(
+        MeterReading.objects.filter(
+            pk__in=[r.pk for r in readings if r.meter_id in backdated]
+        ).values_list("pk", "units_consumed")
+    )
+    for reading in readings:
+        if reading.pk in units:
+            reading.units_consumed = units[reading.pk]
+
+
+def issue_bills(readings, due_days=7, counters=()):
+    """
+    Write the bills of saved ``readings`` (which carry a ``customer_id``
+    attribute and are in date order for each meter) and update the ledgers,
+    dashboard counters and rollups to match. ``counters`` are further
+    dashboard deltas to apply together with the bills'. Returns the bills.
+    """
+    bills = Bill.objects.bulk_create(_build_bills(readings, due_days))
+    _update_ledgers(bills)
+    _update_stats(bills, counters)
+    mark_dirty([(bill.customer_id, bill.issue_date) for bill in bills])
+    return bills
+
+
+def _build_bills(readings, due_days):
+    """
+    Build one unsaved Bill per reading, carrying each customer's running
+    balance forward the way ``Bill.create_from_reading`` does.
+    """
+    balances = balances_for({reading.customer_id for reading in readings})
+
+    due_date = timezone.now().date() + timedelta(days=due_days)
+    bills = []
+    charges = rate_readings((r.reading_date, r.units_consumed) for r in readings)
+    for reading, charge in zip(readings, charges):
+        amount_due = charge - balances[reading.customer_id]
+        balances[reading.customer_id] += amount_due
+        bills.append(
+            Bill(
+                customer_id=reading.customer_id,
+                reading=reading,
+                charge=charge,
+                amount_due=amount_due,
+                due_date=due_date,
+                is_paid=amount_due <= 0,
+            )
+        )
+    return bills
+
+
+def _update_ledgers(bills):
+    """bulk_create skips the ledger signals, so apply the deltas here."""
+    deltas = {}
+    for bill in bills:
+        billed, paid = deltas.get(bill.customer_id, (ZERO, ZERO))
+        deltas[bill.customer_id] = (billed + bill.amount_due, paid)
+    apply_deltas(deltas)
+
+
+def _update_stats(bills, counters=()):
+    """Same for the dashboard counters (plus the caller's ``counters``)."""
+    deltas = Counter(counters)
+    for bill in bills:
+        deltas.update(bill_deltas(bill.amount_due, bill.is_paid))
+    apply_stat_deltas(deltas)
@@ -0,0 +1,231 @@
+"""
+Database-backed queue for billing work.
+
+With ``BILLING_ASYNC`` enabled the signal receivers no longer generate bills,
+update bill status or re-rate inline; they ``enqueue`` a ``BillingJob`` and
+the request returns. ``manage.py billing_worker`` runs a pool of processes
+that claim and run jobs.
+
+Jobs are keyed by ``(kind, object_id)`` and a partial unique constraint
+allows one pending job per key, so a burst of events for the same reading or
+bill collapses into a single job. Handlers read the current state of the
+database when they run, which makes them idempotent: running a job twice, or
+after the object is gone, is harmless. Failed jobs are retried with
+exponential backoff up to ``max_attempts`` times; jobs left ``running`` by a
+crashed worker are put back after ``BILLING_JOB_TIMEOUT`` seconds.
+"""
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .consumption import recompute_consumption
+from .models import Bill, BillingJob, MeterReading
+from .rerating import rerate_bills
+from .tariffs import tariff_resolver
+
+logger = logging.getLogger(__name__)
+
+
+def billing_async():
+    return getattr(settings, "BILLING_ASYNC", False)
+
+
+# -------------------------
+# Enqueueing
+# -------------------------
+def enqueue(kind, object_id=0, payload=None):
+    """
+    Queue a job once the current transaction commits, so the worker sees the
+    data that triggered it. Duplicates of a pending job are merged into it.
+    """
+    transaction.on_commit(lambda: _enqueue(kind, object_id, payload or {}))
+
+
+def _enqueue(kind, object_id, payload):
+    try:
+        with transaction.atomic():
+            job, created = BillingJob.objects.get_or_create(
+                kind=kind, object_id=object_id, status=BillingJob.PENDING,
+                defaults={"payload": payload},
+            )
+    except IntegrityError:  # lost a race with another enqueue
+        job = BillingJob.objects.filter(
+            kind=kind, object_id=object_id, status=BillingJob.PENDING
+        ).first()
+        created = False
+    if job is not None and not created and kind in MERGERS:
+        merged = MERGERS[kind](job.payload, payload)
+        if merged != job.payload:
+            BillingJob.objects.filter(pk=job.pk, status=BillingJob.PENDING).update(payload=merged)
+
+
+def _merge_since(current, new):
+    """Re-rating from the earlier of two dates covers both (None = all bills)."""
+    dates = [current.get("since"), new.get("since")]
+    return {"since": None if None in dates else min(dates)}
+
+
+MERGERS = {BillingJob.RERATE: _merge_since}
+
+
+# -------------------------
+# Handlers
+# -------------------------
+# Rating handlers reload the tariffs first: the change that queued them may
+# have been made by a process whose invalidation this worker cannot see
+# (a per-process cache backend).
+def generate_bill(job):
+    reading = (
+        MeterReading.objects.select_related("meter__customer").filter(pk=job.object_id).first()
+    )
+    if reading is None:
+        return
+    tariff_resolver.refresh()
+    if Bill.objects.filter(reading=reading).exists():
+        recompute_consumption(meter_ids=[reading.meter_id])
+    else:
+        Bill.create_from_reading(reading)
+
+
+def update_status(job):
+    bill = Bill.objects.filter(pk=job.object_id).first()
+    if bill is not None:
+        bill.update_status()
+
+
+def recompute_meter(job):
+    recompute_consumption(meter_ids=[job.object_id])
+
+
+def rerate(job):
+    tariff_resolver.refresh()
+    bills = Bill.objects.filter(is_paid=False)
+    if job.payload.get("since"):
+        bills = bills.filter(reading__reading_date__gte=job.payload["since"])
+    rerate_bills(bills)
+
+
+HANDLERS = {
+    BillingJob.GENERATE_BILL: generate_bill,
+    BillingJob.UPDATE_STATUS: update_status,
+    BillingJob.RECOMPUTE_CONSUMPTION: recompute_meter,
+    BillingJob.RERATE: rerate,
+}
+
+
+# -------------------------
+# Processing
+# -------------------------
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_rows(queryset, limit, **claim):
+    """
+    Apply the ``claim`` field updates to up to ``limit`` rows of ``queryset``
+    (in its order) and return their ids. Uses SKIP LOCKED where the database
+    has it; elsewhere each claim is an UPDATE conditional on the row still
+    matching ``queryset``, so two workers can never take the same row.
+    """
+    model = queryset.model
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(
+                queryset.select_for_update(skip_locked=True).values_list("pk", flat=True)[:limit]
+            )
+            model.objects.filter(pk__in=ids).update(**claim)
+        return ids
+    return [
+        pk for pk in queryset.values_list("pk", flat=True)[:limit]
+        if queryset.filter(pk=pk).update(**claim)
+    ]
+
+
+def claim_jobs(worker, limit=10):
+    """Mark up to ``limit`` due jobs as running for ``worker`` and return them."""
+    now = timezone.now()
+    due = BillingJob.objects.filter(status=BillingJob.PENDING, run_after__lte=now).order_by(
+        "run_after", "id"
+    )
+    ids = claim_rows(due, limit, status=BillingJob.RUNNING, locked_by=worker, locked_at=now)
+    return list(BillingJob.objects.filter(pk__in=ids).order_by("run_after", "id"))
+
+
+def run_job(job):
+    """Run one claimed job, recording success or scheduling a retry."""
+    attempts = job.attempts + 1
+    try:
+        with transaction.atomic():
+            HANDLERS[job.kind](job)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("Billing job %s failed (attempt %s)", job.pk, attempts, exc_info=True)
+        if attempts >= job.max_attempts:
+            status, run_after = BillingJob.FAILED, job.run_after
+        else:
+            status = BillingJob.PENDING
+            run_after = timezone.now() + timedelta(seconds=2 ** attempts)
+        try:
+            with transaction.atomic():
+                BillingJob.objects.filter(pk=job.pk).update(
+                    status=status, attempts=attempts, run_after=run_after,
+                    last_error=error, locked_by="", locked_at=None,
+                )
+        except IntegrityError:
+            # A fresh pending job for the same object already exists and covers this one
+            BillingJob.objects.filter(pk=job.pk).update(
+                status=BillingJob.DONE, attempts=attempts, last_error=error,
+                finished_at=timezone.now(),
+            )
+        return False
+    BillingJob.objects.filter(pk=job.pk).update(
+        status=BillingJob.DONE, attempts=attempts, finished_at=timezone.now()
+    )
+    return True
+
+
+def requeue_stale(timeout=None):
+    """Put back jobs that have been running longer than ``timeout`` seconds."""
+    timeout = timeout or getattr(settings, "BILLING_JOB_TIMEOUT", 600)
+    stale = BillingJob.objects.filter(
+        status=BillingJob.RUNNING, locked_at__lt=timezone.now() - timedelta(seconds=timeout)
+    )
+    requeued = 0
+    for pk in stale.values_list("pk", flat=True):
+        try:
+            with transaction.atomic():
+                requeued += BillingJob.objects.filter(pk=pk, status=BillingJob.RUNNING).update(
+                    status=BillingJob.PENDING, locked_by="", locked_at=None
+                )
+        except IntegrityError:  # superseded by a newer pending job
+            BillingJob.objects.filter(pk=pk).update(status=BillingJob.DONE)
+    return requeued
+
+
+def work(worker=None, batch_size=10, once=False, poll_interval=1.0, stop=None):
+    """
+    Claim and run jobs until no job is pending (``once``, retries included)
+    or ``stop()`` returns true. Returns ``(succeeded, failed)``.
+    """
+    worker = worker or worker_name()
+    succeeded = failed = 0
+    while not (stop and stop()):
+        jobs = claim_jobs(worker, batch_size)
+        if not jobs:
+            if once and not BillingJob.objects.filter(status=BillingJob.PENDING).exists():
+                break
+            time.sleep(poll_interval)
+            continue
+        for job in jobs:
+            if run_job(job):
+                succeeded += 1
+            else:
+                failed += 1
+    return succeeded, failed
@@ -0,0 +1,134 @@
+"""
+Customer ledger maintenance.
+
+``CustomerLedger`` keeps each customer's total billed and total paid so that
+``Customer.balance`` is a single row read instead of two aggregates over all of
+the customer's bills and payments. Signals apply deltas as bills and payments
+change; ``rebuild_ledgers`` recomputes the totals from scratch and reports any
+drift.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .caching import invalidate_customers
+from .models import Bill, Customer, CustomerLedger, Payment
+
+ZERO = Decimal("0.00")
+
+
+def apply_delta(customer_id, billed=ZERO, paid=ZERO):
+    """Add ``billed``/``paid`` to a customer's ledger with a single UPDATE."""
+    if customer_id is None or (not billed and not paid):
+        return
+    CustomerLedger.objects.filter(customer_id=customer_id).update(
+        total_billed=F("total_billed") + billed,
+        total_paid=F("total_paid") + paid,
+        updated_at=timezone.now(),
+    )
+
+
+def apply_deltas(deltas):
+    """
+    Apply a ``{customer_id: (billed, paid)}`` mapping. The increments are
+    sent as one parameterized UPDATE run with ``executemany``: compiling an
+    ORM update per customer costs more than the database work, and a
+    ``bulk_update`` CASE expression over thousands of rows is slower still.
+    """
+    rows = [
+        (billed, paid, customer_id)
+        for customer_id, (billed, paid) in deltas.items()
+        if billed or paid
+    ]
+    if not rows:
+        return
+    table = connection.ops.quote_name(CustomerLedger._meta.db_table)
+    now = CustomerLedger._meta.get_field("updated_at").get_db_prep_value(
+        timezone.now(), connection
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE {table} SET total_billed = total_billed + %s, "
+            f"total_paid = total_paid + %s, updated_at = %s WHERE customer_id = %s",
+            [(billed, paid, now, customer_id) for billed, paid, customer_id in rows],
+        )
+
+
+def balances_for(customer_ids):
+    """Return ``{customer_id: balance}`` read from the ledger in one query."""
+    balances = {customer_id: ZERO for customer_id in customer_ids}
+    for ledger in CustomerLedger.objects.filter(customer_id__in=customer_ids):
+        balances[ledger.customer_id] = ledger.balance
+    return balances
+
+
+def rebuild_ledgers(customer_ids=None, dry_run=False, chunk_size=2000):
+    """
+    Recompute ledgers from bills and payments.
+
+    Returns a list of ``(customer_id, stored_balance, actual_balance)`` for
+    every ledger that had drifted (or was missing). Unless ``dry_run`` is set
+    the ledgers are corrected.
+    """
+    customers = Customer.objects.order_by("pk").values_list("pk", flat=True)
+    if customer_ids is not None:
+        customers = customers.filter(pk__in=customer_ids)
+
+    drift = []
+    chunk = []
+    for customer_id in customers.iterator(chunk_size=chunk_size):
+        chunk.append(customer_id)
+        if len(chunk) >= chunk_size:
+            drift.extend(_rebuild_chunk(chunk, dry_run))
+            chunk = []
+    if chunk:
+        drift.extend(_rebuild_chunk(chunk, dry_run))
+    return drift
+
+
+def _rebuild_chunk(customer_ids, dry_run):
+    totals = defaultdict(lambda: [ZERO, ZERO])
+    for customer_id, total in (
+        Bill.objects.filter(customer_id__in=customer_ids)
+        .values("customer_id")
+        .annotate(total=Sum("amount_due"))
+        .values_list("customer_id", "total")
+    ):
+        totals[customer_id][0] = round(total, 2)  # SQLite sums decimals as floats
+    for customer_id, total in (
+        Payment.objects.filter(bill__customer_id__in=customer_ids)
+        .values("bill__customer_id")
+        .annotate(total=Sum("amount"))
+        .values_list("bill__customer_id", "total")
+    ):
+        totals[customer_id][1] = round(total, 2)
+
+    stored = CustomerLedger.objects.in_bulk(customer_ids)
+    now = timezone.now()
+    drift, to_create, to_update = [], [], []
+    for customer_id in customer_ids:
+        billed, paid = totals[customer_id]
+        ledger = stored.get(customer_id)
+        if ledger is None:
+            drift.append((customer_id, None, round(billed - paid, 2)))
+            to_create.append(
+                CustomerLedger(
+                    customer_id=customer_id, total_billed=billed, total_paid=paid, updated_at=now
+                )
+            )
+        elif ledger.total_billed != billed or ledger.total_paid != paid:
+            drift.append((customer_id, ledger.balance, round(billed - paid, 2)))
+            ledger.total_billed, ledger.total_paid, ledger.updated_at = billed, paid, now
+            to_update.append(ledger)
+
+    if not dry_run:
+        with transaction.atomic():
+            CustomerLedger.objects.bulk_create(to_create)
+            CustomerLedger.objects.bulk_update(
+                to_update, ["total_billed", "total_paid", "updated_at"]
+            )
+            invalidate_customers(customer_id for customer_id, _, _ in drift)
+    return drift
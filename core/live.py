@@ -0,0 +1,152 @@
+"""
+Async JSON endpoints polled by the operations wall display and the mobile app.
+
+The views are coroutines using the async ORM, so under ASGI a poller waiting
+on the database does not hold a worker thread for the whole request (Django
+still runs each query in a thread of its own). Every response carries an
+``ETag`` of its body; a client that sends it back in ``If-None-Match`` gets
+an empty ``304 Not Modified`` while the data is unchanged. Responses are
+``Cache-Control: private, no-cache``, so browsers revalidate on every poll.
+"""
+import hashlib
+import json
+
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, DecimalField, Q, Sum
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+from .metrics import query_budget
+from .models import Bill, Customer, Meter
+from .routers import read_replica
+from .stats import ZERO, adashboard_stats
+
+RECENT_READINGS = 12
+MAX_READINGS = 100
+MONEY = DecimalField(max_digits=16, decimal_places=2)
+
+
+def conditional_json(request, data):
+    """``data`` as JSON with an ETag of the body, or a 304 if the client has it."""
+    body = json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+    response = HttpResponse(body, content_type="application/json")
+    etag = quote_etag(hashlib.sha256(body).hexdigest()[:32])
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+def _related(obj, name):
+    """A (select_related) one-to-one relation of ``obj``, or None if there is none."""
+    try:
+        return getattr(obj, name)
+    except ObjectDoesNotExist:
+        return None
+
+
+def _bill_status(bill):
+    return {
+        "id": bill.id,
+        "issue_date": bill.issue_date,
+        "due_date": bill.due_date,
+        "amount_due": bill.amount_due,
+        "is_paid": bill.is_paid,
+        "overdue": not bill.is_paid and bill.due_date < timezone.localdate(),
+    }
+
+
+def _reading(reading):
+    bill = _related(reading, "bill")
+    return {
+        "id": reading.id,
+        "reading_date": reading.reading_date,
+        "value": reading.value,
+        "units_consumed": reading.units_consumed,
+        "bill": bill and {"id": bill.id, "amount_due": bill.amount_due, "is_paid": bill.is_paid},
+    }
+
+
+# -------------------------
+# Endpoints
+# -------------------------
+@login_required
+@query_budget(3)
+@read_replica
+async def dashboard_live(request):
+    return conditional_json(request, await adashboard_stats())
+
+
+@login_required
+@query_budget(4)
+async def customer_live(request, customer_id):
+    customer = await (
+        Customer.objects.select_related("ledger", "meter")
+        .annotate(
+            unpaid_bills=Count("bills", filter=Q(bills__is_paid=False)),
+            unpaid_total=Coalesce(
+                Sum("bills__amount_due", filter=Q(bills__is_paid=False)), ZERO, output_field=MONEY
+            ),
+        )
+        .filter(pk=customer_id)
+        .afirst()
+    )
+    if customer is None:
+        return JsonResponse({"error": f"unknown customer {customer_id}"}, status=404)
+    ledger, meter = _related(customer, "ledger"), _related(customer, "meter")
+    latest = await Bill.objects.filter(customer=customer).order_by("-issue_date", "-id").afirst()
+    return conditional_json(request, {
+        "id": customer.id,
+        "name": customer.name,
+        "house_number": customer.house_number,
+        "zone": customer.zone,
+        "meter": meter and {"id": meter.id, "serial_number": meter.serial_number},
+        "balance": ledger.balance if ledger else None,
+        "unpaid_bills": customer.unpaid_bills,
+        "unpaid_total": customer.unpaid_total.quantize(ZERO),
+        "latest_bill": latest and _bill_status(latest),
+    })
+
+
+@login_required
+@query_budget(4)
+async def meter_readings_live(request, meter_id):
+    try:
+        limit = min(int(request.GET.get("limit", RECENT_READINGS)), MAX_READINGS)
+    except ValueError:
+        return JsonResponse({"error": "limit must be a number"}, status=400)
+    meter = await Meter.objects.filter(pk=meter_id).afirst()
+    if meter is None:
+        return JsonResponse({"error": f"unknown meter {meter_id}"}, status=404)
+    readings = meter.readings.select_related("bill").order_by("-reading_date")[:max(limit, 0)]
+    return conditional_json(request, {
+        "meter": {
+            "id": meter.id, "serial_number": meter.serial_number, "customer_id": meter.customer_id,
+        },
+        "readings": [_reading(reading) async for reading in readings],
+    })
+
+
+@login_required
+@query_budget(3)
+async def bill_live(request, bill_id):
+    bill = await (
+        Bill.objects.select_related("customer")
+        .annotate(paid=Coalesce(Sum("payments__amount"), ZERO, output_field=MONEY))
+        .filter(pk=bill_id)
+        .afirst()
+    )
+    if bill is None:
+        return JsonResponse({"error": f"unknown bill {bill_id}"}, status=404)
+    bill.paid = bill.paid.quantize(ZERO)  # SQLite sums decimals as floats
+    return conditional_json(request, {
+        **_bill_status(bill),
+        "customer": {"id": bill.customer_id, "name": bill.customer.name},
+        "charge": bill.charge,
+        "paid": bill.paid,
+        "outstanding": max(bill.amount_due - bill.paid, ZERO),
+    })
@@ -0,0 +1,60 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import rating
+
+BANDS = [
+    (Decimal("0.00"), Decimal("6.00"), Decimal("53.00")),     # lifeline
+    (Decimal("6.00"), Decimal("60.00"), Decimal("87.50")),    # normal
+    (Decimal("60.00"), None, Decimal("112.25")),              # commercial
+]
+STANDING_CHARGE = Decimal("150.00")
+
+
+class Command(BaseCommand):
+    help = "Measure billing-cycle rating throughput on synthetic consumption figures."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readings", type=int, default=1_000_000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--check",
+            type=int,
+            default=10_000,
+            help="Number of readings to cross-check against Decimal arithmetic.",
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        units = [Decimal(rng.randint(0, 15_000)).scaleb(-2) for _ in range(options["readings"])]
+
+        started = time.perf_counter()
+        charges = rating.rate_cycle(units, BANDS, STANDING_CHARGE)
+        elapsed = time.perf_counter() - started
+
+        sample = units[: options["check"]]
+        started = time.perf_counter()
+        scalar = [rating.charge_for(u, BANDS, STANDING_CHARGE) for u in sample]
+        scalar_elapsed = time.perf_counter() - started
+        if scalar != charges[: len(sample)]:
+            raise CommandError("Vectorized charges differ from scalar charges.")
+
+        rate = Decimal("87.50")
+        flat = rating.rate_cycle(sample, [(Decimal("0"), None, rate)])
+        if flat != [round(u * rate, 2) for u in sample]:
+            raise CommandError("Flat-rate charges differ from round(units * rate, 2).")
+
+        engine = "numpy" if rating.np is not None else "pure python"
+        self.stdout.write(
+            f"Rated {len(units):,} readings in {elapsed:.3f}s ({engine}): "
+            f"{len(units) / elapsed:,.0f} readings/sec"
+        )
+        if scalar_elapsed:
+            self.stdout.write(
+                f"Scalar path: {len(sample) / scalar_elapsed:,.0f} readings/sec "
+                f"on {len(sample):,} readings"
+            )
+        self.stdout.write(self.style.SUCCESS("Charges match Decimal rounding."))
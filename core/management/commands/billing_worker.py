@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.jobs import requeue_stale, work
+
+STALE_CHECK_SECONDS = 60
+
+
+def _run_worker(batch_size, once, poll_interval, stop_event):
+    import django
+
+    django.setup()  # no-op when forked, needed with the "spawn" start method
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl-C
+    try:
+        work(
+            batch_size=batch_size,
+            once=once,
+            poll_interval=poll_interval,
+            stop=stop_event.is_set,
+        )
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Process queued billing jobs (bill generation, status updates, re-rating) "
+        "with a pool of worker processes. Enable queueing with BILLING_ASYNC = True."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of worker processes (default: one per CPU).",
+        )
+        parser.add_argument("--batch-size", type=int, default=10, help="Jobs claimed at a time.")
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is drained instead of waiting for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s).")
+
+        # Children must not share the parent's database connection
+        connections.close_all()
+        stop_event = multiprocessing.Event()
+        workers = [
+            multiprocessing.Process(
+                target=_run_worker,
+                args=(
+                    options["batch_size"],
+                    options["once"],
+                    options["poll_interval"],
+                    stop_event,
+                ),
+                daemon=True,
+            )
+            for _ in range(max(1, options["processes"]))
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {len(workers)} billing worker(s).")
+
+        try:
+            last_check = time.monotonic()
+            while any(worker.is_alive() for worker in workers):
+                time.sleep(options["poll_interval"])
+                if not options["once"] and time.monotonic() - last_check > STALE_CHECK_SECONDS:
+                    requeue_stale()
+                    last_check = time.monotonic()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers after their current job...")
+            stop_event.set()
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS("Billing workers stopped."))
@@ -0,0 +1,61 @@
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.statements import import_statement, parse_statement, write_suspense
+
+
+class Command(BaseCommand):
+    help = (
+        "Import payments from a bank or mobile-money statement (reference, amount, "
+        "date, account), matching each line to a bill by bill reference or house "
+        "number. Unmatched lines are written to a suspense report."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Statement file, or '-' for stdin.")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="Input format (default: guessed from the file extension).",
+        )
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--suspense",
+            help="Suspense report path (default: <statement>.suspense.csv, or stderr for stdin).",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8-sig")
+        try:
+            result = import_statement(
+                parse_statement(stream, fmt), batch_size=options["batch_size"]
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if result.suspense:
+            suspense_path = options["suspense"]
+            if suspense_path is None and path != "-":
+                suspense_path = str(Path(path).with_suffix(".suspense.csv"))
+            if suspense_path:
+                with open(suspense_path, "w", newline="", encoding="utf-8") as report:
+                    write_suspense(report, result.suspense)
+                self.stderr.write(f"{len(result.suspense)} line(s) written to {suspense_path}")
+            else:
+                write_suspense(self.stderr, result.suspense)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {result.imported} of {result.rows} lines "
+                f"({result.duplicates} already recorded, {len(result.suspense)} in suspense) "
+                f"in {result.elapsed:.2f}s - {result.rows_per_second:.0f} lines/sec"
+            )
+        )
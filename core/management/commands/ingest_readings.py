@@ -0,0 +1,50 @@
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ingestion import ingest_readings, parse_readings
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-load meter readings (serial_number, reading_date, value) from a "
+        "CSV or JSON-lines file and generate their bills."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Input file, or '-' for stdin.")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="Input format (default: guessed from the file extension).",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--due-days", type=int, default=7)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        try:
+            result = ingest_readings(
+                parse_readings(stream, fmt),
+                due_days=options["due_days"],
+                batch_size=options["batch_size"],
+            )
+        except ValidationError as exc:
+            raise CommandError("; ".join(exc.messages))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for line_number, message in sorted(result.errors):
+            self.stderr.write(f"line {line_number}: {message}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Ingested {result.created} of {result.rows} rows "
+                f"({len(result.errors)} rejected) in {result.elapsed:.2f}s "
+                f"- {result.rows_per_second:.0f} rows/sec"
+            )
+        )
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the report rollups (per customer and per zone per month, "
+        "system-wide per day) and the per-meter usage series from readings, "
+        "bills and payments. Run it whenever they are suspected to have drifted."
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        counts = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {counts['customer_months']} customer-month, {counts['zone_months']} "
+            f"zone-month and {counts['days']} daily rollups and {counts['meter_months']} "
+            f"meter-month usage buckets in {time.perf_counter() - started:.2f}s."
+        ))
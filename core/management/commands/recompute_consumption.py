@@ -0,0 +1,53 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.consumption import recompute_consumption
+from core.models import Meter
+
+
+class Command(BaseCommand):
+    help = "Recompute units_consumed from the reading history and re-rate affected bills."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--meter", action="append", help="Serial number (repeatable).")
+        parser.add_argument("--start", type=date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument("--end", type=date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Meters per statement when recomputing every meter.",
+        )
+        parser.add_argument(
+            "--no-rerate", action="store_true", help="Do not re-rate bills of changed readings."
+        )
+
+    def handle(self, *args, **options):
+        meters = Meter.objects.order_by("pk").values_list("pk", flat=True)
+        if options["meter"]:
+            meters = meters.filter(serial_number__in=options["meter"])
+            if not meters.exists():
+                raise CommandError("No matching meters.")
+
+        changed = 0
+        chunk = []
+        for meter_id in meters.iterator(chunk_size=options["chunk_size"]):
+            chunk.append(meter_id)
+            if len(chunk) >= options["chunk_size"]:
+                changed += self._recompute(chunk, options)
+                chunk = []
+        if chunk:
+            changed += self._recompute(chunk, options)
+
+        self.stdout.write(self.style.SUCCESS(f"Updated units_consumed on {changed} readings."))
+
+    def _recompute(self, meter_ids, options):
+        changed = recompute_consumption(
+            meter_ids=meter_ids,
+            start=options["start"],
+            end=options["end"],
+            rerate=not options["no_rerate"],
+        )
+        self.stdout.write(f"  meters {meter_ids[0]}-{meter_ids[-1]}: {len(changed)} readings")
+        return len(changed)
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core.stats import recompute_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the dashboard counters from the source tables and report any drift. "
+        "Run it periodically (e.g. nightly from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report drift, do not correct the counters.",
+        )
+
+    def handle(self, *args, **options):
+        drift = recompute_stats(dry_run=options["dry_run"])
+        for name, stored, actual in drift:
+            stored = "missing" if stored is None else stored
+            self.stdout.write(f"{name}: stored {stored}, actual {actual}")
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("All dashboard counters are up to date."))
+        elif options["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"{len(drift)} counter(s) have drifted."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Corrected {len(drift)} counter(s)."))
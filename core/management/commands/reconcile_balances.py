@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core.ledger import rebuild_ledgers
+
+
+class Command(BaseCommand):
+    help = "Rebuild customer ledgers from bills and payments and report any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report drift, do not correct the ledgers.",
+        )
+
+    def handle(self, *args, **options):
+        drift = rebuild_ledgers(dry_run=options["dry_run"])
+        for customer_id, stored, actual in drift:
+            stored = "missing" if stored is None else stored
+            self.stdout.write(f"customer {customer_id}: ledger {stored}, actual {actual}")
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("All customer ledgers are in balance."))
+        elif options["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"{len(drift)} ledger(s) have drifted."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Corrected {len(drift)} ledger(s)."))
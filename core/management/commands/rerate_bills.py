@@ -0,0 +1,54 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Bill, Tariff
+from core.rerating import rerate_bills
+
+
+class Command(BaseCommand):
+    help = "Re-rate bills at a tariff and report the revenue delta."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tariff",
+            type=int,
+            help="Tariff id to rate at (default: the tariff in force on each reading date).",
+        )
+        parser.add_argument(
+            "--all", action="store_true", help="Re-rate paid bills as well as unpaid ones."
+        )
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Show the revenue delta without saving."
+        )
+
+    def handle(self, *args, **options):
+        tariff = None
+        if options["tariff"]:
+            try:
+                tariff = Tariff.objects.get(pk=options["tariff"])
+            except Tariff.DoesNotExist:
+                raise CommandError(f"Tariff {options['tariff']} does not exist.")
+        bills = Bill.objects.all() if options["all"] else Bill.objects.filter(is_paid=False)
+
+        def progress(done, total):
+            self.stdout.write(f"  {done}/{total} bills")
+
+        try:
+            result = rerate_bills(
+                bills,
+                tariff=tariff,
+                dry_run=options["dry_run"],
+                chunk_size=options["chunk_size"],
+                progress=progress,
+            )
+        except ValidationError as exc:
+            raise CommandError("; ".join(exc.messages))
+
+        verb = "Would change" if result.dry_run else "Changed"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {result.changed} of {result.bills} bills, "
+                f"revenue delta KSh {result.revenue_delta:+,.2f} ({result.elapsed:.2f}s)"
+            )
+        )
@@ -0,0 +1,77 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.benchmarks import BENCHMARKS, compare_results, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the hot paths (signal and bulk ingestion, tariff re-rating, dashboard, "
+        "billing list, customer balances) against the current database and write the "
+        "results to JSON. Load a dataset with generate_data first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "names", nargs="*", help=f"Benchmarks to run (default: all of {', '.join(BENCHMARKS)})."
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--sample", type=int, default=200,
+            help="Readings or customers used by the per-row benchmarks.",
+        )
+        parser.add_argument(
+            "--output",
+            help="Results file (default: benchmarks/<timestamp>.json).",
+        )
+        parser.add_argument("--compare", help="Previous results file to compare against.")
+        parser.add_argument(
+            "--threshold", type=float, default=0.2,
+            help="Report benchmarks whose median is this much slower (default: 0.2 = 20%%).",
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options["names"]) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(sorted(unknown))}")
+        previous = None
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as stream:
+                previous = json.load(stream)
+
+        def progress(name, result):
+            self.stdout.write(
+                f"{name:<24} median {result['median'] * 1000:9.1f} ms  "
+                f"min {result['min'] * 1000:9.1f} ms  {result['queries']:>6} queries  "
+                f"({result['items']} items)"
+            )
+
+        results = run_benchmarks(
+            options["names"] or None,
+            repeat=options["repeat"],
+            sample=options["sample"],
+            progress=progress,
+        )
+
+        output = Path(
+            options["output"]
+            or f"benchmarks/{timezone.now().strftime('%Y%m%d-%H%M%S')}.json"
+        )
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+        self.stdout.write(f"Results written to {output}")
+
+        if previous is not None:
+            slower = compare_results(previous, results, options["threshold"])
+            for name, before, after in slower:
+                self.stdout.write(self.style.WARNING(
+                    f"{name} is slower: {before * 1000:.1f} ms -> {after * 1000:.1f} ms"
+                ))
+            if not slower:
+                self.stdout.write(self.style.SUCCESS(
+                    f"No benchmark is more than {options['threshold']:.0%} slower than "
+                    f"{previous.get('commit') or options['compare']}."
+                ))
@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.billing_cycle import (
+    BATCH_SIZE, DUE_DAYS, SHARDS, finish_cycle, parse_period, plan_cycle, work_cycle,
+)
+
+POLL_SECONDS = 0.5
+
+
+def _run_worker(cycle_id, batch_size, due_days, stop_event):
+    import django
+
+    django.setup()  # no-op when forked, needed with the "spawn" start method
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl-C
+    try:
+        work_cycle(cycle_id, batch_size=batch_size, due_days=due_days, stop=stop_event.is_set)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Issue the bills of a month's unbilled readings, split into shards of customers "
+        "billed by a pool of worker processes. Resumes an interrupted run of the same "
+        "period. Used with BILLING_ON_READING = False."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--period", required=True, help="Month to bill, as YYYY-MM.")
+        parser.add_argument(
+            "--shards", type=int, default=SHARDS, help=f"Shards to plan (default: {SHARDS})."
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of worker processes (default: one per CPU; 1 runs in-process).",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=BATCH_SIZE, help="Readings billed per transaction."
+        )
+        parser.add_argument("--due-days", type=int, default=DUE_DAYS)
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=None,
+            help="Seconds after which a running shard of a crashed run is taken over "
+                 "(default: BILLING_JOB_TIMEOUT).",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            period = parse_period(options["period"])
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        cycle = plan_cycle(period, max(1, options["shards"]), options["stale_after"])
+        shards = cycle.shards.all()
+        pending = sum(shard.status == shard.PENDING for shard in shards)
+        self.stdout.write(f"{cycle}: {pending} of {len(shards)} shard(s) to run.")
+
+        started = time.perf_counter()
+        if pending:
+            self._work(cycle, pending, options)
+        elapsed = time.perf_counter() - started
+
+        self._report(cycle, elapsed)
+        if finish_cycle(cycle):
+            self.stdout.write(self.style.SUCCESS(f"{cycle} is complete."))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"{cycle} is not complete; run the command again to resume it."
+            ))
+
+    def _work(self, cycle, pending, options):
+        args = (cycle.pk, options["batch_size"], options["due_days"])
+        processes = min(max(1, options["processes"]), pending)
+        if processes == 1:
+            work_cycle(*args)
+            return
+
+        # Children must not share the parent's database connection
+        connections.close_all()
+        stop_event = multiprocessing.Event()
+        workers = [
+            multiprocessing.Process(target=_run_worker, args=(*args, stop_event), daemon=True)
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {len(workers)} billing worker(s).")
+        try:
+            while any(worker.is_alive() for worker in workers):
+                time.sleep(POLL_SECONDS)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers after their current shard...")
+            stop_event.set()
+        for worker in workers:
+            worker.join()
+
+    def _report(self, cycle, elapsed):
+        self.stdout.write(
+            f"{'Shard':>5}  {'Customers':>15}  {'Count':>7}  {'Status':<8}  "
+            f"{'Bills':>8}  {'Seconds':>8}  {'Bills/s':>8}  Worker"
+        )
+        total = 0
+        for shard in cycle.shards.all():
+            total += shard.bills
+            rate = f"{shard.bills / shard.elapsed:8.0f}" if shard.elapsed else f"{'-':>8}"
+            self.stdout.write(
+                f"{shard.number:>5}  {f'{shard.first_customer}-{shard.last_customer}':>15}  "
+                f"{shard.customers:>7}  {shard.status:<8}  {shard.bills:>8}  "
+                f"{shard.elapsed:>8.2f}  {rate}  {shard.locked_by or '-'}"
+            )
+        self.stdout.write(f"{total} bill(s) in the cycle; this run took {elapsed:.2f}s.")
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.notifications import dispatch, generate_reminders
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate due-date and overdue reminders for unpaid bills and send pending "
+        "notifications through NOTIFICATION_TRANSPORT."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--no-generate", action="store_true", help="Only send, do not create reminders."
+        )
+        parser.add_argument(
+            "--due-in-days", type=int, default=3, help="Remind this many days before the due date."
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--concurrency", type=int, default=8, help="Sending threads.")
+        parser.add_argument(
+            "--rate", type=float, help="Max messages per second (default NOTIFICATION_RATE)."
+        )
+        parser.add_argument("--limit", type=int, help="Stop after this many messages.")
+        parser.add_argument(
+            "--loop",
+            type=float,
+            metavar="SECONDS",
+            help="Keep running, checking for new notifications every SECONDS.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            if not options["no_generate"]:
+                created = generate_reminders(due_in_days=options["due_in_days"])
+                self.stdout.write(f"Queued {created} reminder(s).")
+
+            result = dispatch(
+                batch_size=options["batch_size"],
+                concurrency=options["concurrency"],
+                rate=options["rate"],
+                limit=options["limit"],
+            )
+            style = self.style.SUCCESS if not result.failed else self.style.WARNING
+            self.stdout.write(style(
+                f"Sent {result.sent} notification(s), {result.failed} failed, in "
+                f"{result.elapsed:.2f}s - {result.messages_per_second:.1f} messages/sec"
+            ))
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
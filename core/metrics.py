@@ -0,0 +1,271 @@
+"""
+Per-view request instrumentation.
+
+``MetricsMiddleware`` records, for every request routed to a named view, the
+number of queries, the time spent in the database, the time spent rendering
+templates and the total time. Totals are kept in process memory and served in
+the Prometheus text format by ``metrics_view`` (local addresses or staff
+only); each worker process reports its own numbers. Queries slower than
+``METRICS_SLOW_QUERY_MS`` are logged to the ``core.metrics`` logger, and the
+slowest ones per view are listed on the endpoint as comments. Page cache hits
+and misses (core.caching) are counted per cached fragment.
+
+Views declare how many queries they may run with ``@query_budget(n)``. A
+request over budget is logged; the test suite fails it.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import Template as DjangoTemplate
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOWEST_QUERIES = 5
+
+_current = ContextVar("request_metrics", default=None)
+
+
+def query_budget(limit, methods=("GET", "HEAD")):
+    """
+    Declare the most queries a view may run for a request with one of
+    ``methods``, counting the session and user lookups.
+    """
+    def decorator(view):
+        view.query_budget = (limit, tuple(methods))
+        return view
+    return decorator
+
+
+def budget_for(view, method="GET"):
+    """The budget ``view`` declares for ``method`` (looking through decorators), or None."""
+    while view is not None:
+        if hasattr(view, "query_budget"):
+            limit, methods = view.query_budget
+            return limit if method in methods else None
+        view = getattr(view, "__wrapped__", None)
+    return None
+
+
+# -------------------------
+# Per-request recording
+# -------------------------
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.slow = []  # (seconds, sql)
+
+    def __call__(self, execute, sql, params, many, context):
+        """``connection.execute_wrapper`` hook timing every query."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += elapsed
+            if elapsed * 1000 >= getattr(settings, "METRICS_SLOW_QUERY_MS", 100):
+                self.slow.append((elapsed, sql))
+
+
+def _timed_render(render):
+    @wraps(render)
+    def wrapped(self, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is None:
+            return render(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            metrics.render_time += time.perf_counter() - started
+    wrapped.timed = True
+    return wrapped
+
+
+def _install_render_timer():
+    # Django has no hook around template rendering; wrap the backend's render()
+    if not getattr(DjangoTemplate.render, "timed", False):
+        DjangoTemplate.render = _timed_render(DjangoTemplate.render)
+
+
+# -------------------------
+# Aggregated metrics
+# -------------------------
+class Registry:
+    """Totals per view, shared by the threads of one process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = defaultdict(int)  # (view, method, status) -> count
+        self.totals = defaultdict(lambda: defaultdict(float))  # view -> name -> total
+        self.buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+        self.slowest = defaultdict(list)  # view -> [(seconds, sql)]
+        self.cache = defaultdict(lambda: [0, 0])  # fragment -> [hits, misses]
+
+    def record(self, view, method, status, metrics, duration):
+        with self.lock:
+            self.requests[view, method, status] += 1
+            totals = self.totals[view]
+            totals["queries"] += metrics.queries
+            totals["db_seconds"] += metrics.db_time
+            totals["render_seconds"] += metrics.render_time
+            totals["duration_seconds"] += duration
+            totals["max_queries"] = max(totals["max_queries"], metrics.queries)
+            buckets = self.buckets[view]
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    buckets[index] += 1
+            if metrics.slow:
+                slowest = sorted(self.slowest[view] + metrics.slow, reverse=True)
+                self.slowest[view] = slowest[:SLOWEST_QUERIES]
+
+    def record_cache(self, name, hit):
+        with self.lock:
+            self.cache[name][0 if hit else 1] += 1
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            family("water_view_requests_total", "counter", "Requests per view.")
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'water_view_requests_total{{view="{view}",method="{method}",'
+                    f'status="{status}"}} {count}'
+                )
+            for name, kind, help_text in (
+                ("queries", "counter", "Database queries run."),
+                ("db_seconds", "counter", "Time spent in database queries."),
+                ("render_seconds", "counter", "Time spent rendering templates."),
+                ("max_queries", "gauge", "Most queries run by a single request."),
+            ):
+                metric = f"water_view_{name}" + ("_total" if kind == "counter" else "")
+                family(metric, kind, help_text)
+                for view, totals in sorted(self.totals.items()):
+                    lines.append(f'{metric}{{view="{view}"}} {totals[name]:g}')
+
+            family("water_view_duration_seconds", "histogram", "Request duration.")
+            for view, buckets in sorted(self.buckets.items()):
+                count = sum(n for (v, _, _), n in self.requests.items() if v == view)
+                for bound, observed in zip(DURATION_BUCKETS, buckets):
+                    lines.append(
+                        f'water_view_duration_seconds_bucket{{view="{view}",le="{bound}"}} '
+                        f"{observed}"
+                    )
+                lines.append(
+                    f'water_view_duration_seconds_bucket{{view="{view}",le="+Inf"}} {count}'
+                )
+                lines.append(
+                    f'water_view_duration_seconds_sum{{view="{view}"}} '
+                    f'{self.totals[view]["duration_seconds"]:g}'
+                )
+                lines.append(f'water_view_duration_seconds_count{{view="{view}"}} {count}')
+
+            family("water_cache_lookups_total", "counter", "Page cache lookups per fragment.")
+            for name, (hits, misses) in sorted(self.cache.items()):
+                lines.append(f'water_cache_lookups_total{{fragment="{name}",result="hit"}} {hits}')
+                lines.append(
+                    f'water_cache_lookups_total{{fragment="{name}",result="miss"}} {misses}'
+                )
+
+            for view, slowest in sorted(self.slowest.items()):
+                for seconds, sql in slowest:
+                    sql = " ".join(sql.split())[:300]
+                    lines.append(f"# slow query {view} {seconds * 1000:.1f}ms: {sql}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+# -------------------------
+# Middleware and endpoint
+# -------------------------
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        _install_render_timer()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with _wrap_connections(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._record(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        # Connections belong to threads: the async ORM queries from the
+        # request's sync thread, so the wrappers are installed there
+        stack = await sync_to_async(_wrap_connections)(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current.reset(token)
+        self._record(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    def _record(self, request, response, metrics, duration):
+        match = request.resolver_match
+        if match is None or not match.view_name or match.view_name == "metrics":
+            return
+        registry.record(match.view_name, request.method, response.status_code, metrics, duration)
+
+        for seconds, sql in metrics.slow:
+            logger.warning("Slow query in %s (%.1f ms): %s", match.view_name, seconds * 1000, sql)
+        budget = budget_for(match.func, request.method)
+        if budget is not None and metrics.queries > budget:
+            logger.warning(
+                "%s ran %d queries (budget %d)", match.view_name, metrics.queries, budget
+            )
+
+
+def _wrap_connections(metrics):
+    """An ExitStack hooking ``metrics`` into every database connection of this thread."""
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(metrics))
+    return stack
+
+
+def metrics_view(request):
+    allowed = getattr(settings, "METRICS_ALLOWED_IPS", ("127.0.0.1", "::1"))
+    if request.META.get("REMOTE_ADDR") not in allowed and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4")
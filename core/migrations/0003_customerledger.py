@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_ledgers(apps, schema_editor):
+    Customer = apps.get_model("core", "Customer")
+    CustomerLedger = apps.get_model("core", "CustomerLedger")
+    Bill = apps.get_model("core", "Bill")
+    Payment = apps.get_model("core", "Payment")
+
+    billed = dict(
+        Bill.objects.values("customer_id").annotate(total=Sum("amount_due"))
+        .values_list("customer_id", "total")
+    )
+    paid = dict(
+        Payment.objects.values("bill__customer_id").annotate(total=Sum("amount"))
+        .values_list("bill__customer_id", "total")
+    )
+    CustomerLedger.objects.bulk_create(
+        CustomerLedger(
+            customer_id=customer_id,
+            total_billed=billed.get(customer_id) or Decimal("0.00"),
+            total_paid=paid.get(customer_id) or Decimal("0.00"),
+        )
+        for customer_id in Customer.objects.values_list("pk", flat=True)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_alter_bill_options_alter_meterreading_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerLedger',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ledger', serialize=False, to='core.customer')),
+                ('total_billed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('total_paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(populate_ledgers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:13
+
+from bisect import bisect_right
+
+from django.db import migrations, models
+
+
+def backfill_charges(apps, schema_editor):
+    """
+    Rate existing bills at the tariff in force on their reading date (the
+    earliest tariff for older readings).
+
+    The charge is not derived from amount_due. Bills were rated at the latest
+    tariff when they were created, and the tariff signal re-rated unpaid ones
+    less a customer balance that already included the bill itself. Taking the
+    carried balance back out of amount_due therefore does not recover what was
+    charged. Bills without units, or with no tariff at all, keep amount_due.
+    """
+    Bill = apps.get_model("core", "Bill")
+    Tariff = apps.get_model("core", "Tariff")
+    tariffs = list(Tariff.objects.order_by("effective_date", "pk"))
+    dates = [tariff.effective_date for tariff in tariffs]
+
+    bills = []
+    for bill in Bill.objects.select_related("reading").iterator(chunk_size=2000):
+        reading = bill.reading
+        if tariffs and reading.units_consumed is not None:
+            tariff = tariffs[max(bisect_right(dates, reading.reading_date) - 1, 0)]
+            bill.charge = round(reading.units_consumed * tariff.rate_per_unit, 2)
+        else:
+            bill.charge = bill.amount_due
+        bills.append(bill)
+        if len(bills) >= 2000:
+            Bill.objects.bulk_update(bills, ["charge"])
+            bills = []
+    Bill.objects.bulk_update(bills, ["charge"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_customerledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='charge',
+            field=models.DecimalField(decimal_places=2, default=0.0, help_text='Consumption charge before the previous balance is carried forward.', max_digits=12),
+        ),
+        migrations.RunPython(backfill_charges, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:16
+
+import django.core.validators
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_bill_charge'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tariff',
+            name='standing_charge',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), help_text='Fixed charge added to every bill.', max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='tariff',
+            name='rate_per_unit',
+            field=models.DecimalField(decimal_places=2, help_text='Flat rate, used when the tariff has no blocks.', max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='TariffBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=50)),
+                ('lower_bound', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10, validators=[django.core.validators.MinValueValidator(0)])),
+                ('upper_bound', models.DecimalField(blank=True, decimal_places=2, help_text='Leave empty for an open-ended top block.', max_digits=10, null=True)),
+                ('rate_per_unit', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('tariff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='core.tariff')),
+            ],
+            options={
+                'ordering': ['lower_bound'],
+            },
+        ),
+    ]
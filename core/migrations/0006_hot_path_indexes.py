@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:19
+
+from django.db import migrations, models
+
+# billing_list searches customers with icontains, which PostgreSQL runs as
+# UPPER(col::text) LIKE UPPER('%term%'); only a trigram index can serve that.
+TRIGRAM_INDEXES = [
+    ("customer_name_trgm_idx", "name"),
+    ("customer_house_number_trgm_idx", "house_number"),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON core_customer '
+            f'USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_tariff_blocks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['issue_date', 'id'], name='bill_issue_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['is_paid', 'issue_date'], name='bill_paid_issue_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('is_paid', False)), fields=['due_date', 'amount_due'], name='bill_unpaid_due_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['name'], name='customer_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meterreading',
+            index=models.Index(fields=['reading_date'], name='reading_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['payment_date', 'id'], name='payment_date_id_idx'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:21
+
+import django.utils.timezone
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def populate_counters(apps, schema_editor):
+    Customer = apps.get_model("core", "Customer")
+    Meter = apps.get_model("core", "Meter")
+    MeterReading = apps.get_model("core", "MeterReading")
+    Bill = apps.get_model("core", "Bill")
+    Payment = apps.get_model("core", "Payment")
+    StatCounter = apps.get_model("core", "StatCounter")
+
+    bills = Bill.objects.aggregate(
+        billed=Sum("amount_due"),
+        due=Sum("amount_due", filter=Q(is_paid=False)),
+        unpaid=Count("pk", filter=Q(is_paid=False)),
+    )
+    values = {
+        "customers": Customer.objects.count(),
+        "meters": Meter.objects.count(),
+        "billed": bills["billed"] or 0,
+        "due": bills["due"] or 0,
+        "unpaid_bills": bills["unpaid"],
+        "collected": Payment.objects.aggregate(total=Sum("amount"))["total"] or 0,
+    }
+    for day, count in (
+        MeterReading.objects.values("reading_date").annotate(count=Count("pk"))
+        .values_list("reading_date", "count")
+    ):
+        values[f"readings:{day.isoformat()}"] = count
+    StatCounter.objects.bulk_create(
+        StatCounter(name=name, value=Decimal(value)) for name, value in values.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
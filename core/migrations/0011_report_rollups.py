@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:38
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('units', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('billed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('bills', models.PositiveIntegerField(default=0)),
+                ('collected', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('payments', models.PositiveIntegerField(default=0)),
+                ('day', models.DateField(unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='zone',
+            field=models.CharField(blank=True, default='', help_text='Supply zone', max_length=50),
+        ),
+        migrations.CreateModel(
+            name='ZoneMonthRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('units', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('billed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('bills', models.PositiveIntegerField(default=0)),
+                ('collected', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('payments', models.PositiveIntegerField(default=0)),
+                ('zone', models.CharField(blank=True, default='', max_length=50)),
+                ('month', models.DateField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month'], name='zone_month_idx')],
+                'constraints': [models.UniqueConstraint(fields=('zone', 'month'), name='zone_month_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CustomerMonthRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('units', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('billed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('bills', models.PositiveIntegerField(default=0)),
+                ('collected', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('payments', models.PositiveIntegerField(default=0)),
+                ('zone', models.CharField(blank=True, default='', max_length=50)),
+                ('month', models.DateField()),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='month_rollups', to='core.customer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month', 'customer'], name='customer_month_idx'), models.Index(fields=['zone', 'month'], name='customer_month_zone_idx')],
+                'constraints': [models.UniqueConstraint(fields=('customer', 'month'), name='customer_month_unique')],
+            },
+        ),
+    ]
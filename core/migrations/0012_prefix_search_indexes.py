@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:51
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_report_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='customer_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(django.db.models.functions.text.Lower('house_number'), name='customer_house_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meter',
+            index=models.Index(django.db.models.functions.text.Lower('serial_number'), name='meter_serial_lower_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:54
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def populate_usage(apps, schema_editor):
+    MeterReading = apps.get_model("core", "MeterReading")
+    MeterUsageMonth = apps.get_model("core", "MeterUsageMonth")
+
+    buckets = {}
+    for meter_id, reading_date, units in MeterReading.objects.values_list(
+        "meter_id", "reading_date", "units_consumed"
+    ).iterator():
+        bucket = buckets.setdefault(
+            (meter_id, reading_date.replace(day=1)),
+            MeterUsageMonth(
+                meter_id=meter_id, month=reading_date.replace(day=1), units=0, days={}
+            ),
+        )
+        bucket.days[str(reading_date.day)] = str(units or Decimal("0.00"))
+        bucket.units += units or 0
+        bucket.readings += 1
+    MeterUsageMonth.objects.bulk_create(buckets.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_prefix_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeterUsageMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('units', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('days', models.JSONField(default=dict)),
+                ('meter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_months', to='core.meter')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('meter', 'month'), name='meter_usage_month_unique')],
+            },
+        ),
+        migrations.RunPython(populate_usage, migrations.RunPython.noop),
+    ]
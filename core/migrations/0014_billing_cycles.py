@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_meter_usage_months'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingCycle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(help_text='First day of the billed month', unique=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-period'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BillingShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('first_customer', models.BigIntegerField()),
+                ('last_customer', models.BigIntegerField()),
+                ('customers', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('bills', models.PositiveIntegerField(default=0)),
+                ('elapsed', models.FloatField(default=0.0)),
+                ('last_error', models.TextField(blank=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('cycle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='core.billingcycle')),
+            ],
+            options={
+                'ordering': ['cycle', 'number'],
+                'constraints': [models.UniqueConstraint(fields=('cycle', 'number'), name='billing_shard_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,143 @@
+"""
+Substring search over customers and their meters (see core.search).
+
+SQLite (3.34+) gets an FTS5 table with the trigram tokenizer, one row per
+customer with its meter serial, kept in sync by triggers so bulk_create and
+queryset updates are covered too. PostgreSQL gets pg_trgm GIN indexes on the
+lower-cased columns, which the database maintains itself. They replace the
+UPPER() trigram indexes of 0006, built for the icontains search this
+supersedes, and are named apart from them.
+Other databases keep the prefix indexes only.
+"""
+import sqlite3
+
+from django.db import migrations
+
+SEARCH_TABLE = "core_customer_search"
+
+SQLITE_CREATE = [
+    f"""
+    CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+        name, house_number, phone_number, serial_number, tokenize = 'trigram'
+    )
+    """,
+    # Identifiers count for more than names when ranking (bm25 column weights)
+    f"""
+    INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank)
+    VALUES ('rank', 'bm25(1.0, 4.0, 2.0, 4.0)')
+    """,
+    f"""
+    INSERT INTO {SEARCH_TABLE} (rowid, name, house_number, phone_number, serial_number)
+    SELECT c.id, c.name, c.house_number,
+           COALESCE(c.phone_number, ''), COALESCE(m.serial_number, '')
+    FROM core_customer c LEFT JOIN core_meter m ON m.customer_id = c.id
+    """,
+    f"""
+    CREATE TRIGGER core_customer_search_insert AFTER INSERT ON core_customer BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = new.id;
+        INSERT INTO {SEARCH_TABLE} (rowid, name, house_number, phone_number, serial_number)
+        VALUES (new.id, new.name, new.house_number, COALESCE(new.phone_number, ''), '');
+    END
+    """,
+    f"""
+    CREATE TRIGGER core_customer_search_update
+    AFTER UPDATE OF name, house_number, phone_number ON core_customer BEGIN
+        UPDATE {SEARCH_TABLE}
+        SET name = new.name, house_number = new.house_number,
+            phone_number = COALESCE(new.phone_number, '')
+        WHERE rowid = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER core_customer_search_delete AFTER DELETE ON core_customer BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER core_meter_search_insert AFTER INSERT ON core_meter BEGIN
+        UPDATE {SEARCH_TABLE} SET serial_number = new.serial_number
+        WHERE rowid = new.customer_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER core_meter_search_update
+    AFTER UPDATE OF customer_id, serial_number ON core_meter BEGIN
+        UPDATE {SEARCH_TABLE} SET serial_number = '' WHERE rowid = old.customer_id;
+        UPDATE {SEARCH_TABLE} SET serial_number = new.serial_number
+        WHERE rowid = new.customer_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER core_meter_search_delete AFTER DELETE ON core_meter BEGIN
+        UPDATE {SEARCH_TABLE} SET serial_number = '' WHERE rowid = old.customer_id;
+    END
+    """,
+]
+
+SQLITE_DROP = [
+    f"DROP TRIGGER IF EXISTS {name}"
+    for name in (
+        "core_customer_search_insert", "core_customer_search_update",
+        "core_customer_search_delete", "core_meter_search_insert",
+        "core_meter_search_update", "core_meter_search_delete",
+    )
+] + [f"DROP TABLE IF EXISTS {SEARCH_TABLE}"]
+
+POSTGRESQL_INDEXES = {
+    "customer_name_lower_trgm_idx": ("core_customer", "name"),
+    "customer_house_lower_trgm_idx": ("core_customer", "house_number"),
+    "customer_phone_lower_trgm_idx": ("core_customer", "phone_number"),
+    "meter_serial_lower_trgm_idx": ("core_meter", "serial_number"),
+}
+
+# The indexes of 0006_hot_path_indexes, dropped here and restored on reversal
+POSTGRESQL_UPPER_INDEXES = {
+    "customer_name_trgm_idx": "name",
+    "customer_house_number_trgm_idx": "house_number",
+}
+
+
+def _statements(schema_editor, create):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        if sqlite3.sqlite_version_info < (3, 34):  # no trigram tokenizer
+            return []
+        return SQLITE_CREATE if create else SQLITE_DROP
+    if vendor == "postgresql":
+        if not create:
+            return [f"DROP INDEX IF EXISTS {name}" for name in POSTGRESQL_INDEXES] + [
+                f"CREATE INDEX IF NOT EXISTS {name} ON core_customer "
+                f'USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+                for name, column in POSTGRESQL_UPPER_INDEXES.items()
+            ]
+        return (
+            ["CREATE EXTENSION IF NOT EXISTS pg_trgm"]
+            + [f"DROP INDEX IF EXISTS {name}" for name in POSTGRESQL_UPPER_INDEXES]
+            + [
+                f"CREATE INDEX IF NOT EXISTS {name} ON {table} "
+                f"USING gin (lower({column}) gin_trgm_ops)"
+                for name, (table, column) in POSTGRESQL_INDEXES.items()
+            ]
+        )
+    return []
+
+
+def create_search(apps, schema_editor):
+    for sql in _statements(schema_editor, create=True):
+        schema_editor.execute(sql)
+
+
+def drop_search(apps, schema_editor):
+    for sql in _statements(schema_editor, create=False):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_billing_cycles'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search, drop_search),
+    ]
@@ -4,7 +4,7 @@ from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
-from django.db.models.functions import Coalesce
+from django.db.models.functions import Coalesce, Lower
 from decimal import Decimal
 
 # -------------------------
@@ -25,9 +25,16 @@ class Customer(models.Model):
     house_number = models.CharField(max_length=50, unique=True)
     address = models.TextField()
     phone_number = models.CharField(max_length=20, blank=True, null=True)
+    zone = models.CharField(max_length=50, blank=True, default="", help_text="Supply zone")
 
     class Meta:
         ordering = ["name"]
+        indexes = [
+            models.Index(fields=["name"], name="customer_name_idx"),
+            # Case-insensitive prefix search (core.search)
+            models.Index(Lower("name"), name="customer_name_lower_idx"),
+            models.Index(Lower("house_number"), name="customer_house_lower_idx"),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.house_number})"
@@ -35,6 +42,18 @@ class Customer(models.Model):
     @property
     def balance(self):
         """Outstanding balance (positive = owes, negative = overpaid)."""
+        try:
+            return self.ledger.balance
+        except CustomerLedger.DoesNotExist:
+            return self.compute_balance()
+
+    def current_balance(self):
+        """Balance read from the database, ignoring a ledger cached on this instance."""
+        ledger = CustomerLedger.objects.filter(customer_id=self.pk).first()
+        return ledger.balance if ledger else self.compute_balance()
+
+    def compute_balance(self):
+        """Outstanding balance aggregated from bills and payments."""
         total_billed = self.bills.aggregate(
             total=Coalesce(Sum("amount_due"), Decimal("0.00"))
         )["total"]
@@ -44,6 +63,101 @@ class Customer(models.Model):
         return round(total_billed - total_paid, 2)
 
 
+# -------------------------
+# Customer Ledger Model
+# -------------------------
+class CustomerLedger(models.Model):
+    """Running bill and payment totals behind Customer.balance."""
+
+    customer = models.OneToOneField(
+        Customer, on_delete=models.CASCADE, primary_key=True, related_name="ledger"
+    )
+    total_billed = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    total_paid = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Ledger for customer {self.customer_id}: {self.balance}"
+
+    @property
+    def balance(self):
+        return round(self.total_billed - self.total_paid, 2)
+
+
+# -------------------------
+# Stat Counter Model
+# -------------------------
+class StatCounter(models.Model):
+    """A named running total behind the dashboard (see core.stats)."""
+
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+# -------------------------
+# Rollup Models
+# -------------------------
+class Rollup(models.Model):
+    """Consumption, billing and collection totals of one bucket (see core.rollups)."""
+
+    units = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    readings = models.PositiveIntegerField(default=0)
+    billed = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+    bills = models.PositiveIntegerField(default=0)
+    collected = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+    payments = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class CustomerMonthRollup(Rollup):
+    customer = models.ForeignKey(
+        Customer, on_delete=models.CASCADE, related_name="month_rollups"
+    )
+    zone = models.CharField(max_length=50, blank=True, default="")  # copied from the customer
+    month = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["customer", "month"], name="customer_month_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["month", "customer"], name="customer_month_idx"),
+            models.Index(fields=["zone", "month"], name="customer_month_zone_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id} {self.month:%Y-%m}"
+
+
+class ZoneMonthRollup(Rollup):
+    zone = models.CharField(max_length=50, blank=True, default="")
+    month = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["zone", "month"], name="zone_month_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["month"], name="zone_month_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.zone or '-'} {self.month:%Y-%m}"
+
+
+class DailyRollup(Rollup):
+    day = models.DateField(unique=True)
+
+    def __str__(self):
+        return str(self.day)
+
+
 # -------------------------
 # Meter Model
 # -------------------------
@@ -56,6 +170,9 @@ class Meter(models.Model):
 
     class Meta:
         ordering = ["serial_number"]
+        indexes = [
+            models.Index(Lower("serial_number"), name="meter_serial_lower_idx"),
+        ]
 
     def __str__(self):
         return f"Meter {self.serial_number} - {self.customer.name}"
@@ -66,7 +183,14 @@ class Meter(models.Model):
 # -------------------------
 class Tariff(models.Model):
     effective_date = models.DateField(default=timezone.now)
-    rate_per_unit = models.DecimalField(max_digits=10, decimal_places=2)
+    rate_per_unit = models.DecimalField(
+        max_digits=10, decimal_places=2,
+        help_text="Flat rate, used when the tariff has no blocks.",
+    )
+    standing_charge = models.DecimalField(
+        max_digits=10, decimal_places=2, default=Decimal("0.00"),
+        help_text="Fixed charge added to every bill.",
+    )
 
     class Meta:
         ordering = ["-effective_date"]
@@ -74,11 +198,89 @@ class Tariff(models.Model):
     def __str__(self):
         return f"Tariff {self.rate_per_unit} (from {self.effective_date})"
 
+    def bands(self):
+        """``(lower_bound, upper_bound, rate_per_unit)`` for each block."""
+        blocks = [
+            (block.lower_bound, block.upper_bound, block.rate_per_unit)
+            for block in self.blocks.all()
+        ]
+        return blocks or [(Decimal("0.00"), None, self.rate_per_unit)]
+
+    def charge_for(self, units):
+        """Consumption charge for ``units``, rounded to cents."""
+        from .rating import charge_for
+
+        return charge_for(units, self.bands(), self.standing_charge)
+
+    def charges_for(self, units):
+        """Consumption charges for a sequence of ``units``, rated in one pass."""
+        from .rating import rate_cycle
+
+        return rate_cycle(units, self.bands(), self.standing_charge)
+
+
+# -------------------------
+# Tariff Block Model
+# -------------------------
+class TariffBlock(models.Model):
+    """A consumption band of a tariff (e.g. lifeline, normal, commercial)."""
+
+    tariff = models.ForeignKey(
+        Tariff, on_delete=models.CASCADE, related_name="blocks"
+    )
+    name = models.CharField(max_length=50, blank=True)
+    lower_bound = models.DecimalField(
+        max_digits=10, decimal_places=2, default=Decimal("0.00"),
+        validators=[MinValueValidator(0)],
+    )
+    upper_bound = models.DecimalField(
+        max_digits=10, decimal_places=2, blank=True, null=True,
+        help_text="Leave empty for an open-ended top block.",
+    )
+    rate_per_unit = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        ordering = ["lower_bound"]
+
+    def __str__(self):
+        upper = self.upper_bound if self.upper_bound is not None else "+"
+        return f"{self.name or 'Block'} {self.lower_bound}-{upper} @ {self.rate_per_unit}"
+
+    def clean(self):
+        if self.upper_bound is not None and self.upper_bound <= self.lower_bound:
+            raise ValidationError({"upper_bound": "Upper bound must be above the lower bound."})
+
+
+# -------------------------
+# Rollup sources
+# -------------------------
+class RollupSource:
+    """
+    Rows counted by the report rollups and the dashboard counters. The
+    receivers of one save or delete queue several deltas and dirty buckets;
+    they are applied once, after the last receiver has run (see
+    core.rollups.deferred_refresh and core.stats.batched_stat_deltas).
+    """
+
+    def save(self, *args, **kwargs):
+        from .rollups import deferred_refresh
+        from .stats import batched_stat_deltas
+
+        with deferred_refresh(), batched_stat_deltas():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        from .rollups import deferred_refresh
+        from .stats import batched_stat_deltas
+
+        with deferred_refresh(), batched_stat_deltas():
+            return super().delete(*args, **kwargs)
+
 
 # -------------------------
 # MeterReading Model
 # -------------------------
-class MeterReading(models.Model):
+class MeterReading(RollupSource, models.Model):
     meter = models.ForeignKey(
         Meter, on_delete=models.CASCADE, related_name="readings"
     )
@@ -93,24 +295,64 @@ class MeterReading(models.Model):
     class Meta:
         unique_together = ("meter", "reading_date")
         ordering = ["reading_date"]
+        indexes = [
+            models.Index(fields=["reading_date"], name="reading_date_idx"),
+        ]
 
     def __str__(self):
         return f"Reading {self.value} on {self.reading_date} ({self.meter})"
 
     def compute_units(self):
-        """Compute units consumed since previous reading."""
-        previous = self.meter.readings.exclude(pk=self.pk).order_by("-reading_date").first()
-        if previous:
-            self.units_consumed = max(self.value - previous.value, 0)
-        else:
-            self.units_consumed = self.value  # first reading
-        self.save(update_fields=["units_consumed"])
+        """
+        Compute units consumed since the previous reading. Later readings of
+        the same meter are recomputed too (and their bills re-rated), so
+        backdated readings leave no stale consumption behind.
+        """
+        from .consumption import recompute_consumption
+        from .rollups import add_to_rollups
+
+        # Just saved or loaded, so this is what the rollups counted
+        counted = self.units_consumed or Decimal("0.00")
+        recompute_consumption(
+            meter_ids=[self.meter_id], start=self.reading_date, counted=[self.pk]
+        )
+        self.units_consumed = (
+            MeterReading.objects.values_list("units_consumed", flat=True).get(pk=self.pk)
+        )
+        add_to_rollups(
+            self.meter.customer_id, self.reading_date, meter_id=self.meter_id,
+            units=(self.units_consumed or Decimal("0.00")) - counted,
+        )
+
+
+# -------------------------
+# Meter Usage Model
+# -------------------------
+class MeterUsageMonth(models.Model):
+    """
+    One month of a meter's consumption, bucketed by day (see core.usage):
+    ``days`` maps the day of the month to the units consumed that day.
+    """
+
+    meter = models.ForeignKey(Meter, on_delete=models.CASCADE, related_name="usage_months")
+    month = models.DateField()
+    units = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    readings = models.PositiveIntegerField(default=0)
+    days = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["meter", "month"], name="meter_usage_month_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.meter_id} {self.month:%Y-%m}"
 
 
 # -------------------------
 # Bill Model
 # -------------------------
-class Bill(models.Model):
+class Bill(RollupSource, models.Model):
     customer = models.ForeignKey(
         Customer, on_delete=models.CASCADE, related_name="bills"
     )
@@ -119,29 +361,43 @@ class Bill(models.Model):
     )
     issue_date = models.DateField(default=timezone.now)
     due_date = models.DateField()
+    charge = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0.00,
+        help_text="Consumption charge before the previous balance is carried forward.",
+    )
     amount_due = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
     is_paid = models.BooleanField(default=False)
 
     class Meta:
         ordering = ["issue_date"]
+        indexes = [
+            # billing_list: newest first, optionally filtered by status
+            models.Index(fields=["issue_date", "id"], name="bill_issue_date_id_idx"),
+            models.Index(fields=["is_paid", "issue_date"], name="bill_paid_issue_date_idx"),
+            # Outstanding bills by due date (dashboard totals, reminders)
+            models.Index(
+                fields=["due_date", "amount_due"],
+                condition=models.Q(is_paid=False),
+                name="bill_unpaid_due_date_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"Bill {self.id} - {self.customer.name} - {self.amount_due}"
 
     @classmethod
     def create_from_reading(cls, reading: MeterReading, due_days: int = 7):
-        reading.compute_units()
+        from .tariffs import tariff_for
 
-        latest_tariff = Tariff.objects.order_by("-effective_date").first()
-        if not latest_tariff:
-            raise ValidationError("No tariff defined.")
+        reading.compute_units()
 
-        # Base amount
-        amount_due = round(reading.units_consumed * latest_tariff.rate_per_unit, 2)
+        # Base amount at the tariff in force on the reading date
+        tariff = tariff_for(reading.reading_date)
+        charge = tariff.charge_for(reading.units_consumed)
 
         # Adjust for previous balance
-        previous_balance = reading.meter.customer.balance
-        amount_due -= previous_balance
+        previous_balance = reading.meter.customer.current_balance()
+        amount_due = charge - previous_balance
 
         # Set due date
         due_date = timezone.now().date() + timezone.timedelta(days=due_days)
@@ -149,6 +405,7 @@ class Bill(models.Model):
         bill = cls.objects.create(
             customer=reading.meter.customer,
             reading=reading,
+            charge=charge,
             amount_due=amount_due,
             due_date=due_date,
         )
@@ -164,20 +421,22 @@ class Bill(models.Model):
         self.save(update_fields=["is_paid"])
 
     def compute_amount_due(self):
-        """Calculate amount due for this reading including previous balance."""
-        latest_tariff = Tariff.objects.order_by("-effective_date").first()
-        if not latest_tariff:
-            raise ValidationError("No tariff defined.")
+        """
+        Calculate amount due for this reading including previous balance.
+        Also refreshes ``charge`` with the consumption charge.
+        """
+        from .tariffs import tariff_for
 
-        base_amount = self.reading.units_consumed * latest_tariff.rate_per_unit
-        previous_balance = self.customer.balance
-        return round(base_amount - previous_balance, 2)
+        tariff = tariff_for(self.reading.reading_date)
+        self.charge = tariff.charge_for(self.reading.units_consumed)
+        previous_balance = self.customer.current_balance()
+        return round(self.charge - previous_balance, 2)
 
 
 # -------------------------
 # Payment Model
 # -------------------------
-class Payment(models.Model):
+class Payment(RollupSource, models.Model):
     bill = models.ForeignKey(
         Bill, on_delete=models.CASCADE, related_name="payments"
     )
@@ -189,6 +448,9 @@ class Payment(models.Model):
 
     class Meta:
         ordering = ["-payment_date"]
+        indexes = [
+            models.Index(fields=["payment_date", "id"], name="payment_date_id_idx"),
+        ]
 
     def __str__(self):
         return f"Payment {self.amount} for {self.bill} on {self.payment_date}"
@@ -198,15 +460,190 @@ class Payment(models.Model):
 # Notification Model
 # -------------------------
 class Notification(models.Model):
+    GENERAL = "general"
+    DUE_SOON = "due_soon"
+    OVERDUE = "overdue"
+    KIND_CHOICES = [
+        (GENERAL, "General"),
+        (DUE_SOON, "Due date reminder"),
+        (OVERDUE, "Overdue reminder"),
+    ]
+
     customer = models.ForeignKey(
         Customer, on_delete=models.CASCADE, related_name="notifications"
     )
+    bill = models.ForeignKey(
+        Bill, on_delete=models.CASCADE, related_name="notifications", blank=True, null=True
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=GENERAL)
     message = models.TextField()
     created_at = models.DateTimeField(default=timezone.now)
     is_sent = models.BooleanField(default=False)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # The dispatcher's queue: unsent notifications, oldest first
+            models.Index(
+                fields=["created_at", "id"],
+                condition=models.Q(is_sent=False),
+                name="notification_pending_idx",
+            ),
+        ]
+        constraints = [
+            # One reminder of each kind per bill, so generation can be re-run
+            models.UniqueConstraint(
+                fields=["bill", "kind"],
+                condition=models.Q(bill__isnull=False),
+                name="notification_bill_kind_unique",
+            ),
+        ]
 
     def __str__(self):
         return f"Notification for {self.customer.name} - {'Sent' if self.is_sent else 'Pending'}"
+
+
+# -------------------------
+# Billing Job Model
+# -------------------------
+class BillingJob(models.Model):
+    """A unit of deferred billing work, processed by ``manage.py billing_worker``."""
+
+    GENERATE_BILL = "generate_bill"
+    UPDATE_STATUS = "update_status"
+    RECOMPUTE_CONSUMPTION = "recompute_consumption"
+    RERATE = "rerate"
+    KIND_CHOICES = [
+        (GENERATE_BILL, "Generate bill for reading"),
+        (UPDATE_STATUS, "Update bill status"),
+        (RECOMPUTE_CONSUMPTION, "Recompute meter consumption"),
+        (RERATE, "Re-rate unpaid bills"),
+    ]
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField(default=0)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["run_after", "id"]
+        indexes = [
+            models.Index(fields=["status", "run_after", "id"], name="billing_job_queue_idx"),
+        ]
+        constraints = [
+            # At most one pending job per target: repeated events collapse into it
+            models.UniqueConstraint(
+                fields=["kind", "object_id"],
+                condition=models.Q(status="pending"),
+                name="billing_job_pending_unique",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.object_id} ({self.status})"
+
+
+# -------------------------
+# Billing Cycle Models
+# -------------------------
+class BillingCycle(models.Model):
+    """A monthly billing run (``manage.py run_billing_cycle``), split into shards."""
+
+    period = models.DateField(unique=True, help_text="First day of the billed month")
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["-period"]
+
+    def __str__(self):
+        return f"Billing cycle {self.period:%Y-%m}"
+
+
+class BillingShard(models.Model):
+    """
+    The customers ``first_customer`` to ``last_customer`` (ids, inclusive) of
+    a billing cycle: claimed by one worker at a time, and the checkpoint a
+    resumed run starts from.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    cycle = models.ForeignKey(BillingCycle, on_delete=models.CASCADE, related_name="shards")
+    number = models.PositiveIntegerField()
+    first_customer = models.BigIntegerField()
+    last_customer = models.BigIntegerField()
+    customers = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    bills = models.PositiveIntegerField(default=0)
+    elapsed = models.FloatField(default=0.0)
+    last_error = models.TextField(blank=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["cycle", "number"]
+        constraints = [
+            models.UniqueConstraint(fields=["cycle", "number"], name="billing_shard_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.cycle} shard {self.number} ({self.status})"
+
+
+# -------------------------
+# Idempotency Key Model
+# -------------------------
+class IdempotencyKey(models.Model):
+    """The stored response to an API request sent with an ``Idempotency-Key`` header."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="idempotency_keys")
+    key = models.CharField(max_length=255)
+    path = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(default=200)
+    response = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "key"], name="idempotency_key_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.path})"
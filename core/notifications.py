@@ -0,0 +1,273 @@
+"""
+Reminder generation and notification dispatch.
+
+``generate_reminders`` creates due-date and overdue reminders for unpaid
+bills in bulk; a partial unique constraint on ``(bill, kind)`` makes it safe
+to run repeatedly. ``dispatch`` claims pending notifications in batches (SKIP
+LOCKED where available, see ``core.jobs.claim_rows``), sends each batch
+concurrently through the configured transport under a rate limit, and marks
+the results with one bulk UPDATE per outcome. A batch is only claimed once
+the previous one is done, so a slow gateway slows claiming down rather than
+piling up messages in memory.
+
+The transport is configured in settings::
+
+    NOTIFICATION_TRANSPORT = {
+        "BACKEND": "core.notifications.SMSGatewayTransport",
+        "OPTIONS": {"url": "https://sms.example.com/send", "token": "..."},
+    }
+
+and defaults to ``ConsoleTransport``.
+"""
+import json
+import sys
+import threading
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .jobs import claim_rows, worker_name
+from .models import Bill, Notification
+
+MAX_ATTEMPTS = 5
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+DUE_SOON_MESSAGE = (
+    "Dear {name}, your water bill #{bill} of KSh {amount:,.2f} is due on {due:%d %b %Y}."
+)
+OVERDUE_MESSAGE = (
+    "Dear {name}, your water bill #{bill} of KSh {amount:,.2f} was due on {due:%d %b %Y}. "
+    "Please pay to avoid disconnection."
+)
+
+
+# -------------------------
+# Reminder generation
+# -------------------------
+def generate_reminders(today=None, due_in_days=3, batch_size=1000):
+    """
+    Queue a reminder for every unpaid bill due within ``due_in_days`` and an
+    overdue notice for every unpaid bill past its due date. Returns the
+    number of notifications written.
+    """
+    today = today or timezone.localdate()
+    unpaid = Bill.objects.filter(is_paid=False, amount_due__gt=0)
+    batches = [
+        (
+            Notification.DUE_SOON,
+            DUE_SOON_MESSAGE,
+            unpaid.filter(due_date__gte=today, due_date__lte=today + timedelta(days=due_in_days)),
+        ),
+        (Notification.OVERDUE, OVERDUE_MESSAGE, unpaid.filter(due_date__lt=today)),
+    ]
+
+    created = 0
+    for kind, template, bills in batches:
+        bills = bills.exclude(notifications__kind=kind).values_list(
+            "pk", "customer_id", "customer__name", "amount_due", "due_date"
+        )
+        pending = []
+        for pk, customer_id, name, amount, due in bills.iterator(chunk_size=batch_size):
+            pending.append(Notification(
+                customer_id=customer_id,
+                bill_id=pk,
+                kind=kind,
+                message=template.format(name=name, bill=pk, amount=amount, due=due),
+            ))
+            if len(pending) >= batch_size:
+                created += len(Notification.objects.bulk_create(pending, ignore_conflicts=True))
+                pending = []
+        created += len(Notification.objects.bulk_create(pending, ignore_conflicts=True))
+    return created
+
+
+# -------------------------
+# Transports
+# -------------------------
+class Transport(ABC):
+    """Sends one notification; raises on failure. Must be thread-safe."""
+
+    @abstractmethod
+    def send(self, notification):
+        """Deliver ``notification``, raising if it was not sent."""
+
+
+class ConsoleTransport(Transport):
+    """Writes messages to stdout (development stand-in)."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+
+    def send(self, notification):
+        with self.lock:
+            self.stream.write(
+                f"[{notification.kind}] to {notification.customer.phone_number or '-'}: "
+                f"{notification.message}\n"
+            )
+
+
+class FileTransport(Transport):
+    """Appends messages as JSON lines to ``path`` (stand-in for a gateway)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def send(self, notification):
+        line = json.dumps({
+            "id": notification.pk,
+            "kind": notification.kind,
+            "to": notification.customer.phone_number,
+            "message": notification.message,
+        })
+        with self.lock, open(self.path, "a", encoding="utf-8") as stream:
+            stream.write(line + "\n")
+
+
+class SMSGatewayTransport(Transport):
+    """POSTs ``{"to", "message"}`` as JSON to an HTTP SMS gateway."""
+
+    def __init__(self, url, token="", sender="", timeout=10):
+        self.url, self.token, self.sender, self.timeout = url, token, sender, timeout
+
+    def send(self, notification):
+        phone_number = notification.customer.phone_number
+        if not phone_number:
+            raise ValueError(f"customer {notification.customer_id} has no phone number")
+        body = {"to": phone_number, "message": notification.message}
+        if self.sender:
+            body["from"] = self.sender
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(body).encode(),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {self.token}"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status >= 300:
+                raise RuntimeError(f"gateway answered {response.status}")
+
+
+def get_transport():
+    config = getattr(settings, "NOTIFICATION_TRANSPORT", {})
+    backend = import_string(config.get("BACKEND", "core.notifications.ConsoleTransport"))
+    return backend(**config.get("OPTIONS", {}))
+
+
+class RateLimiter:
+    """Token bucket shared by the sending threads; ``rate`` is per second."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# -------------------------
+# Dispatch
+# -------------------------
+@dataclass
+class DispatchResult:
+    """Outcome of a dispatch run."""
+
+    sent: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def messages_per_second(self):
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+
+def claim_notifications(worker, limit):
+    """Claim up to ``limit`` unsent notifications for ``worker``."""
+    now = timezone.now()
+    pending = Notification.objects.filter(
+        Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - CLAIM_TIMEOUT),
+        is_sent=False,
+        attempts__lt=MAX_ATTEMPTS,
+    ).order_by("created_at", "id")
+    ids = claim_rows(pending, limit, claimed_by=worker, claimed_at=now)
+    return list(Notification.objects.select_related("customer").filter(pk__in=ids))
+
+
+def dispatch(transport=None, batch_size=100, concurrency=8, rate=None, limit=None):
+    """
+    Send pending notifications until none are left (or ``limit`` have been
+    attempted). ``rate`` caps messages per second across all threads
+    (default ``NOTIFICATION_RATE``, 0 for unlimited).
+    """
+    transport = transport or get_transport()
+    if rate is None:
+        rate = getattr(settings, "NOTIFICATION_RATE", 0)
+    limiter = RateLimiter(rate)
+    worker = worker_name()
+    result = DispatchResult()
+    started = time.perf_counter()
+
+    def send(notification):
+        limiter.acquire()
+        try:
+            transport.send(notification)
+        except Exception as exc:
+            return notification.pk, f"{type(exc).__name__}: {exc}"
+        return notification.pk, None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while limit is None or result.sent + result.failed < limit:
+            size = batch_size
+            if limit is not None:
+                size = min(batch_size, limit - result.sent - result.failed)
+            batch = claim_notifications(worker, size)
+            if not batch:
+                break
+            outcomes = list(pool.map(send, batch))
+            sent = [pk for pk, error in outcomes if error is None]
+            failed = [(pk, error) for pk, error in outcomes if error is not None]
+            _record(sent, failed)
+            result.sent += len(sent)
+            result.failed += len(failed)
+
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def _record(sent, failed):
+    """Mark a batch: one UPDATE for the sent ones, one per distinct error."""
+    now = timezone.now()
+    Notification.objects.filter(pk__in=sent).update(
+        is_sent=True, sent_at=now, claimed_by="", claimed_at=None
+    )
+    by_error = {}
+    for pk, error in failed:
+        by_error.setdefault(error, []).append(pk)
+    # Failures keep claimed_at, so they are retried once the claim expires
+    for error, pks in by_error.items():
+        Notification.objects.filter(pk__in=pks).update(
+            attempts=F("attempts") + 1, last_error=error, claimed_by="", claimed_at=now
+        )
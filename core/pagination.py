@@ -0,0 +1,179 @@
+"""
+Keyset (cursor) pagination.
+
+OFFSET paging makes the database walk and discard every row before the page,
+and ``Paginator`` adds a COUNT over the whole result, so deep pages of large
+lists get slower and slower. Keyset pagination instead remembers the sort key
+of the last row shown, ``(issue_date, id)`` say, and asks for the rows after
+it. With an index on those columns every page costs the same as the first.
+
+Cursors are opaque URL-safe strings carrying the direction and the key values
+of the row to continue from. A count is only computed on request, and is
+capped (or estimated from planner statistics on PostgreSQL) so it stays cheap.
+"""
+import base64
+import json
+from dataclasses import dataclass, field
+from urllib.parse import urlencode
+
+from django.db import connection
+from django.db.models import Q
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+COUNT_CAP = 10000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+@dataclass
+class KeysetPage:
+    """One page of results plus the cursors of its neighbours."""
+
+    items: list
+    next_cursor: str = None
+    previous_cursor: str = None
+    count: int = None
+    count_is_exact: bool = True
+    params: dict = field(default_factory=dict)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def _query(self, cursor):
+        params = self.params.copy()
+        params["cursor"] = cursor
+        return params.urlencode() if hasattr(params, "urlencode") else urlencode(params)
+
+    @property
+    def next_query(self):
+        return self._query(self.next_cursor) if self.has_next else ""
+
+    @property
+    def previous_query(self):
+        return self._query(self.previous_cursor) if self.has_previous else ""
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, [_dump(value) for value in values]])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, fields):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if direction not in ("next", "previous") or len(values) != len(fields):
+            raise ValueError
+        return direction, [f.to_python(value) for f, value in zip(fields, values)]
+    except Exception:
+        raise InvalidCursor(f"Invalid cursor {cursor!r}")
+
+
+def _dump(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def _after(keys, values, descending):
+    """Rows strictly after ``values`` in ``keys`` order, index friendly."""
+    op = "lt" if descending else "gt"
+    bound = "lte" if descending else "gte"
+    condition = Q(**{f"{keys[-1]}__{op}": values[-1]})
+    for key, value in reversed(list(zip(keys[:-1], values[:-1]))):
+        condition = Q(**{f"{key}__{op}": value}) | (Q(**{key: value}) & condition)
+    # The leading bound lets the planner turn the OR into an index range
+    return Q(**{f"{keys[0]}__{bound}": values[0]}) & condition
+
+
+def keyset_paginate(queryset, keys, cursor=None, per_page=DEFAULT_PER_PAGE, descending=True):
+    """
+    Return a ``KeysetPage`` of ``queryset`` ordered by ``keys`` (which must
+    end in a unique column, normally ``id``). ``cursor`` comes from a
+    previous page's ``next_cursor``/``previous_cursor``.
+    """
+    model = queryset.model
+    fields = [model._meta.get_field(key) for key in keys]
+    per_page = max(1, min(int(per_page), MAX_PER_PAGE))
+
+    backwards = False
+    if cursor:
+        direction, values = decode_cursor(cursor, fields)
+        backwards = direction == "previous"
+        queryset = queryset.filter(_after(keys, values, descending != backwards))
+
+    ordering = [f"-{key}" if descending != backwards else key for key in keys]
+    rows = list(queryset.order_by(*ordering)[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def key_of(row):
+        return [getattr(row, f.attname) for f in fields]
+
+    page = KeysetPage(items=rows)
+    if rows:
+        # Coming back from a later page means there is always a next one
+        if has_more or backwards:
+            page.next_cursor = encode_cursor("next", key_of(rows[-1]))
+        if (has_more and backwards) or (cursor and not backwards):
+            page.previous_cursor = encode_cursor("previous", key_of(rows[0]))
+    return page
+
+
+def approximate_count(queryset, cap=COUNT_CAP):
+    """
+    Return ``(count, exact)`` without counting more than ``cap`` rows. An
+    unfiltered table on PostgreSQL is estimated from ``pg_class.reltuples``.
+    """
+    if connection.vendor == "postgresql" and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0] > cap:
+            return row[0], False
+    count = queryset.order_by()[:cap + 1].count()
+    return (cap, False) if count > cap else (count, True)
+
+
+def paginate_request(request, queryset, keys, descending=True, strict=False):
+    """
+    Keyset-paginate ``queryset`` from the request's ``cursor``, ``per_page``
+    and ``count`` parameters. An invalid cursor falls back to the first page,
+    or raises ``InvalidCursor`` if ``strict`` is set.
+    """
+    params = request.GET.copy()
+    params.pop("cursor", None)
+    params.pop("page", None)
+    try:
+        per_page = int(request.GET.get("per_page", DEFAULT_PER_PAGE))
+    except ValueError:
+        per_page = DEFAULT_PER_PAGE
+    try:
+        page = keyset_paginate(
+            queryset, keys, request.GET.get("cursor"), per_page, descending=descending
+        )
+    except InvalidCursor:
+        if strict:
+            raise
+        page = keyset_paginate(queryset, keys, None, per_page, descending=descending)
+    page.params = params
+    if request.GET.get("count"):
+        page.count, page.count_is_exact = approximate_count(queryset)
+    return page
@@ -0,0 +1,161 @@
+"""
+Bulk recording of payments.
+
+Saving payments one by one fires the status, ledger and dashboard receivers
+for every row. ``record_payments`` validates a whole batch with one query for
+the bills and one for already used reference numbers, writes the payments
+with ``bulk_create`` and then applies the ledger and counter deltas and the
+bill status changes in bulk, leaving the same state the per-row path would.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import DecimalField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .ledger import ZERO, apply_deltas
+from .models import Bill, Payment
+from .rollups import mark_dirty
+from .stats import COLLECTED, apply_stat_deltas, bill_deltas
+
+
+@dataclass
+class PaymentResult:
+    """Outcome of recording a batch of payments."""
+
+    rows: int = 0
+    ids: dict = field(default_factory=dict)  # line number -> payment id
+    errors: list = field(default_factory=list)  # (line number, message)
+    duplicates: set = field(default_factory=set)  # lines whose reference was already used
+
+    @property
+    def created(self):
+        return len(self.ids)
+
+
+def clean_payment(bill_id, amount, reference_number, payment_date):
+    """Validate a raw payment, returning cleaned values or raising ValueError."""
+    try:
+        bill_id = int(bill_id)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid bill_id {bill_id!r}")
+    try:
+        amount = Decimal(str(amount)).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"invalid amount {amount!r}")
+    if amount < Decimal("0.01"):
+        raise ValueError("amount must be at least 0.01")
+    reference_number = str(reference_number or "").strip()
+    if not reference_number:
+        raise ValueError("missing reference_number")
+    if len(reference_number) > 100:
+        raise ValueError("reference_number is longer than 100 characters")
+    if payment_date in (None, ""):
+        payment_date = timezone.now()
+    else:
+        try:
+            parsed = parse_datetime(str(payment_date))
+            if parsed is None and parse_date(str(payment_date)):
+                parsed = datetime.combine(parse_date(str(payment_date)), time())
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValueError(f"invalid payment_date {payment_date!r}")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        payment_date = parsed
+    return bill_id, amount, reference_number, payment_date
+
+
+def record_payments(rows):
+    """
+    Record ``(line_number, bill_id, amount, reference_number, payment_date)``
+    rows in one transaction. Invalid rows, unknown bills and reference numbers
+    that are already used (or repeated in the batch) are reported per line.
+    """
+    result = PaymentResult(rows=len(rows))
+
+    cleaned = []
+    for line_number, *values in rows:
+        try:
+            cleaned.append((line_number, *clean_payment(*values)))
+        except ValueError as exc:
+            result.errors.append((line_number, str(exc)))
+
+    with transaction.atomic():
+        bills = dict(
+            Bill.objects.filter(pk__in={row[1] for row in cleaned}).values_list(
+                "pk", "customer_id"
+            )
+        )
+        used = set(
+            Payment.objects.filter(
+                reference_number__in={row[3] for row in cleaned}
+            ).values_list("reference_number", flat=True)
+        )
+
+        payments, lines = [], []
+        for line_number, bill_id, amount, reference_number, payment_date in cleaned:
+            if bill_id not in bills:
+                result.errors.append((line_number, f"unknown bill {bill_id}"))
+                continue
+            if reference_number in used:
+                result.errors.append((line_number, f"duplicate reference {reference_number}"))
+                result.duplicates.add(line_number)
+                continue
+            used.add(reference_number)
+            payments.append(Payment(
+                bill_id=bill_id,
+                amount=amount,
+                reference_number=reference_number,
+                payment_date=payment_date,
+            ))
+            lines.append(line_number)
+
+        if payments:
+            Payment.objects.bulk_create(payments)
+            _apply_payments(payments, bills)
+            mark_dirty((bills[payment.bill_id], payment.payment_date) for payment in payments)
+        result.ids = {line: payment.pk for line, payment in zip(lines, payments)}
+
+    result.errors.sort()
+    return result
+
+
+def _apply_payments(payments, bills):
+    """What the payment receivers would have done: ledgers, counters, statuses."""
+    paid = Counter()
+    for payment in payments:
+        paid[bills[payment.bill_id]] += payment.amount
+    apply_deltas({customer_id: (ZERO, amount) for customer_id, amount in paid.items()})
+
+    deltas = Counter({COLLECTED: sum(paid.values(), ZERO)})
+    totals = (
+        Payment.objects.filter(bill=OuterRef("pk"))
+        .order_by()
+        .values("bill")
+        .annotate(total=Sum("amount"))
+        .values("total")
+    )
+    changed = {True: [], False: []}
+    for pk, amount_due, is_paid, total_paid in (
+        Bill.objects.filter(pk__in={payment.bill_id for payment in payments})
+        .annotate(total_paid=Coalesce(
+            Subquery(totals, output_field=DecimalField(max_digits=16, decimal_places=2)), ZERO
+        ))
+        .values_list("pk", "amount_due", "is_paid", "total_paid")
+    ):
+        now_paid = total_paid >= amount_due
+        if now_paid != is_paid:
+            changed[now_paid].append(pk)
+            deltas.update(bill_deltas(amount_due, is_paid, sign=-1))
+            deltas.update(bill_deltas(amount_due, now_paid))
+    for is_paid, pks in changed.items():
+        if pks:
+            Bill.objects.filter(pk__in=pks).update(is_paid=is_paid)
+    apply_stat_deltas(deltas)
@@ -0,0 +1,111 @@
+"""
+Re-rating of bills after a tariff change.
+
+Every bill stores its consumption ``charge`` separately from the balance that
+was carried into ``amount_due``. Re-rating recomputes the charge at the tariff
+in force on the reading date and moves ``amount_due`` by the same difference,
+so carried balances are left alone. Bills are processed in primary-key chunks:
+one SELECT (with the payments total as a subquery) and one bulk UPDATE per
+chunk, plus the ledger and dashboard counter deltas.
+"""
+import time
+from collections import Counter
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .ledger import ZERO, apply_deltas
+from .models import Bill, Payment
+from .rollups import bills_dirty
+from .stats import apply_stat_deltas, bill_deltas
+from .tariffs import rate_readings
+
+
+@dataclass
+class RerateResult:
+    """Summary of a re-rating run."""
+
+    bills: int = 0
+    changed: int = 0
+    revenue_delta: Decimal = ZERO
+    elapsed: float = 0.0
+    dry_run: bool = False
+
+
+def rerate_bills(bills=None, tariff=None, dry_run=False, chunk_size=2000, progress=None):
+    """
+    Re-rate ``bills`` (default: all unpaid bills). Each bill is rated at the
+    tariff in force on its reading date, or at ``tariff`` if one is given.
+
+    ``progress`` is called as ``progress(done, total)`` after each chunk. With
+    ``dry_run`` nothing is written; the result still reports how many bills
+    would change and the revenue delta.
+    """
+    if bills is None:
+        bills = Bill.objects.filter(is_paid=False)
+
+    result = RerateResult(dry_run=dry_run)
+    started = time.perf_counter()
+
+    pks = list(bills.order_by("pk").values_list("pk", flat=True))
+    for start in range(0, len(pks), chunk_size):
+        chunk = pks[start:start + chunk_size]
+        with transaction.atomic():
+            changed, delta = _rerate_chunk(chunk, tariff, dry_run)
+        result.bills += len(chunk)
+        result.changed += changed
+        result.revenue_delta += delta
+        if progress:
+            progress(result.bills, len(pks))
+
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def _rerate_chunk(pks, tariff, dry_run):
+    paid = (
+        Payment.objects.filter(bill=OuterRef("pk"))
+        .values("bill")
+        .annotate(total=Sum("amount"))
+        .values("total")
+    )
+    rows = list(
+        Bill.objects.filter(pk__in=pks)
+        .annotate(
+            reading_date=F("reading__reading_date"),
+            units=F("reading__units_consumed"),
+            paid=Coalesce(Subquery(paid), ZERO, output_field=DecimalField()),
+        )
+        .values_list(
+            "pk", "customer_id", "reading_date", "units", "charge", "amount_due", "is_paid", "paid"
+        )
+    )
+    charges = rate_readings(
+        [(reading_date, units) for _, _, reading_date, units, *_ in rows], tariff=tariff
+    )
+
+    updated, deltas, stats, revenue_delta = [], {}, Counter(), ZERO
+    for row, new_charge in zip(rows, charges):
+        pk, customer_id, _, _, charge, amount_due, is_paid, paid = row
+        delta = new_charge - charge
+        new_amount = amount_due + delta
+        new_is_paid = paid >= new_amount
+        if not delta and new_is_paid == is_paid:
+            continue
+        revenue_delta += delta
+        if delta:
+            billed, _ = deltas.get(customer_id, (ZERO, ZERO))
+            deltas[customer_id] = (billed + delta, ZERO)
+        stats.update(bill_deltas(new_amount, new_is_paid))
+        stats.update(bill_deltas(amount_due, is_paid, sign=-1))
+        updated.append(Bill(pk=pk, charge=new_charge, amount_due=new_amount, is_paid=new_is_paid))
+
+    if not dry_run and updated:
+        Bill.objects.bulk_update(updated, ["charge", "amount_due", "is_paid"])
+        apply_deltas(deltas)
+        apply_stat_deltas(stats)
+        bills_dirty([bill.pk for bill in updated])
+    return len(updated), revenue_delta
@@ -0,0 +1,500 @@
+"""
+Materialized consumption, billing and collection rollups for the reports.
+
+Three tables hold the totals of ``Rollup`` buckets: per customer per month,
+per zone per month and system-wide per day. Readings count by reading date,
+bills by issue date and payments by payment date.
+
+Saving or deleting a single row adds its deltas to the buckets it counts in
+(``add_to_rollups``), like the ledger and the dashboard counters. Paths that
+rewrite many rows at once (bulk ingestion, the consumption engine, re-rating,
+zone moves) mark the ``(customer, day)`` buckets they touched with
+``mark_dirty`` instead. When the transaction commits the deltas are applied
+and the dirty buckets are then recomputed from the source tables with a few
+grouped, index-backed queries; a recomputed bucket simply overwrites any
+delta, which keeps this correct for whatever path changed the data.
+``rebuild_rollups`` recomputes everything from scratch. The per-meter usage
+buckets of ``core.usage`` follow the same deltas and keys, and the cached
+pages of the customers concerned (core.caching) are invalidated.
+"""
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .caching import READINGS, invalidate, invalidate_customers
+from .models import (
+    Bill, Customer, CustomerMonthRollup, DailyRollup, MeterReading, Payment, ZoneMonthRollup,
+)
+from .usage import apply_usage_deltas, rebuild_usage, refresh_usage
+
+FIELDS = ("units", "readings", "billed", "bills", "collected", "payments")
+COUNTS = ("readings", "bills", "payments")
+CHUNK_SIZE = 500
+
+_state = threading.local()
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _as_date(value):
+    """Local date of a date or (aware) datetime."""
+    if isinstance(value, datetime):
+        return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+    return value
+
+
+def _day_bounds(first, last):
+    """Aware datetimes bounding the local days ``first`` to ``last``."""
+    return (
+        timezone.make_aware(datetime.combine(first, time.min)),
+        timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min)),
+    )
+
+
+# -------------------------
+# Dirty tracking
+# -------------------------
+def _pending():
+    if not hasattr(_state, "keys"):
+        _state.keys, _state.zones = set(), set()
+        _state.deltas, _state.usage = defaultdict(Counter), defaultdict(Counter)
+    return _state
+
+
+def _schedule():
+    if not getattr(_state, "depth", 0):
+        transaction.on_commit(_flush)
+
+
+def mark_dirty(keys, zones=()):
+    """
+    Queue ``(customer_id, day)`` buckets (and ``(zone, month)`` buckets of
+    zones a customer left) for recomputation when the transaction commits.
+    Keys from a rolled-back transaction are recomputed with the next commit,
+    which does no harm. Inside ``deferred_refresh`` they wait for the block
+    to exit.
+    """
+    state = _pending()
+    state.keys.update((customer_id, _as_date(day)) for customer_id, day in keys if day)
+    state.zones.update(zones)
+    _schedule()
+
+
+def add_to_rollups(customer_id, day, meter_id=None, **deltas):
+    """
+    Queue ``deltas`` (by ``FIELDS`` name) for the buckets of a single row
+    counted on ``day``, applied when the transaction commits. With
+    ``meter_id`` the reading's day in the meter's usage bucket follows too.
+    """
+    if customer_id is None or not day:
+        return
+    state = _pending()
+    key = (customer_id, _as_date(day))
+    state.deltas[key].update(deltas)
+    if meter_id is not None:
+        usage = {name: deltas[name] for name in ("units", "readings") if name in deltas}
+        state.usage[(customer_id, meter_id, key[1])].update(usage)
+    _schedule()
+
+
+@contextmanager
+def deferred_refresh():
+    """
+    Apply the deltas and recompute the buckets queued inside the block once,
+    when it exits. In autocommit every ``on_commit`` runs at once, so without
+    this each of the receivers of a single save would flush on its own.
+    """
+    _state.depth = getattr(_state, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+        if not _state.depth:
+            transaction.on_commit(_flush)
+
+
+def _flush():
+    state = _pending()
+    keys, zones, deltas, usage = state.keys, state.zones, state.deltas, state.usage
+    if not (keys or zones or deltas or usage):
+        return
+    state.keys, state.zones = set(), set()
+    state.deltas, state.usage = defaultdict(Counter), defaultdict(Counter)
+    invalidate_customers({customer_id for customer_id, _ in keys} | {pk for pk, _ in deltas})
+    with transaction.atomic():
+        apply_deltas(deltas, usage, dirty=keys)
+        if keys or zones:
+            refresh_rollups(keys, zones)
+
+
+def readings_dirty(reading_ids, counted=()):
+    """
+    Mark the buckets of the given readings (after a bulk update), except the
+    ``counted`` ones whose change the caller adds with ``add_to_rollups``.
+    """
+    invalidate(READINGS)
+    reading_ids = [pk for pk in reading_ids if pk not in counted]
+    if reading_ids:
+        mark_dirty(
+            MeterReading.objects.filter(pk__in=reading_ids).values_list(
+                "meter__customer_id", "reading_date"
+            )
+        )
+
+
+def bills_dirty(bill_ids):
+    """Mark the buckets of the given bills (after a bulk update)."""
+    mark_dirty(Bill.objects.filter(pk__in=bill_ids).values_list("customer_id", "issue_date"))
+
+
+# -------------------------
+# Deltas
+# -------------------------
+def apply_deltas(deltas, usage=None, dirty=()):
+    """
+    Add ``{(customer_id, day): Counter}`` deltas to the customer, zone and day
+    buckets, and ``{(customer_id, meter_id, day): Counter}`` to the usage
+    buckets. Buckets of ``dirty`` keys are skipped: they are about to be
+    recomputed. So are deleted customers, whose rows went with them (their
+    zone buckets are recomputed, see core.signals).
+    """
+    dirty_months = {(customer_id, month_start(day)) for customer_id, day in dirty}
+    dirty_days = {day for _, day in dirty}
+    months, days = defaultdict(Counter), defaultdict(Counter)
+    for (customer_id, day), values in deltas.items():
+        if day not in dirty_days:
+            days[day].update(values)
+        if (customer_id, month_start(day)) not in dirty_months:
+            months[customer_id, month_start(day)].update(values)
+    usage = {
+        key: values
+        for key, values in (usage or {}).items()
+        if (key[0], month_start(key[2])) not in dirty_months
+    }
+    customer_ids = {customer_id for customer_id, _ in months} | {key[0] for key in usage}
+    zones = (
+        dict(Customer.objects.filter(pk__in=customer_ids).order_by().values_list("pk", "zone"))
+        if customer_ids
+        else {}
+    )
+
+    zone_months = defaultdict(Counter)
+    customer_months = {}
+    for (customer_id, month), values in months.items():
+        if customer_id in zones:
+            customer_months[customer_id, month, zones[customer_id]] = values
+            zone_months[zones[customer_id], month].update(values)
+    _add(CustomerMonthRollup, customer_months, ("customer_id", "month"), extra=("zone",))
+    _add(ZoneMonthRollup, zone_months, ("zone", "month"))
+    _add(DailyRollup, {(day,): values for day, values in days.items()}, ("day",))
+    apply_usage_deltas({
+        (meter_id, day): values
+        for (customer_id, meter_id, day), values in usage.items()
+        if customer_id in zones
+    })
+
+
+def _add(model, deltas, unique, extra=()):
+    """
+    Add ``{(*unique values, *extra values): Counter}`` deltas to the bucket
+    rows of ``model``. Growing buckets are upserted with one parameterized
+    ``INSERT ... ON CONFLICT DO UPDATE`` run with ``executemany`` (``extra``
+    columns are only written on insert). Shrinking buckets exist already:
+    they get one UPDATE, and those left empty are deleted.
+    """
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in (*unique, *extra)]
+    growing, shrinking = [], []
+    for key, values in deltas.items():
+        if not any(values.values()):
+            continue
+        key = [field.get_db_prep_value(value, connection) for field, value in zip(fields, key)]
+        amounts = [values.get(name, 0) for name in FIELDS]
+        if any(values.get(name, 0) < 0 for name in COUNTS):
+            shrinking.append((amounts, key[:len(unique)]))
+        else:
+            growing.append(key + amounts)
+
+    where = " AND ".join(f"{qn(column)} = %s" for column in unique)
+    with connection.cursor() as cursor:
+        if growing:
+            columns = ", ".join(qn(column) for column in (*unique, *extra, *FIELDS))
+            placeholders = ", ".join(["%s"] * (len(fields) + len(FIELDS)))
+            updates = ", ".join(f"{qn(name)} = {table}.{qn(name)} + excluded.{qn(name)}"
+                                for name in FIELDS)
+            cursor.executemany(
+                f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) "
+                f"ON CONFLICT ({', '.join(qn(column) for column in unique)}) "
+                f"DO UPDATE SET {updates}",
+                growing,
+            )
+        if shrinking:
+            updates = ", ".join(f"{qn(name)} = {qn(name)} + %s" for name in FIELDS)
+            cursor.executemany(
+                f"UPDATE {table} SET {updates} WHERE {where}",
+                [amounts + key for amounts, key in shrinking],
+            )
+            empty = " AND ".join(f"{qn(name)} = 0" for name in COUNTS)
+            cursor.executemany(
+                f"DELETE FROM {table} WHERE {where} AND {empty}",
+                [key for _, key in shrinking],
+            )
+
+
+# -------------------------
+# Recomputation
+# -------------------------
+def _totals(rows, key_count):
+    """Fold ``(*key, field, value)`` rows into ``{key: Counter}``."""
+    totals = defaultdict(Counter)
+    for *key, name, value in rows:
+        totals[tuple(key) if key_count > 1 else key[0]][name] += value or 0
+    return totals
+
+
+def _source_rows(customer_ids=None, first=None, last=None, by="month"):
+    """
+    Yield ``(key..., field, value)`` from readings, bills and payments,
+    grouped by customer and month (``by="month"``) or by day (``by="day"``).
+    """
+    readings = MeterReading.objects.all()
+    bills = Bill.objects.all()
+    payments = Payment.objects.all()
+    if customer_ids is not None:
+        readings = readings.filter(meter__customer_id__in=customer_ids)
+        bills = bills.filter(customer_id__in=customer_ids)
+        payments = payments.filter(bill__customer_id__in=customer_ids)
+    if first is not None:
+        start, end = _day_bounds(first, last)
+        readings = readings.filter(reading_date__gte=first, reading_date__lte=last)
+        bills = bills.filter(issue_date__gte=first, issue_date__lte=last)
+        payments = payments.filter(payment_date__gte=start, payment_date__lt=end)
+
+    if by == "month":
+        groups = (
+            (readings, ("meter__customer_id", TruncMonth("reading_date")), "units_consumed"),
+            (bills, ("customer_id", TruncMonth("issue_date")), "amount_due"),
+            (payments, ("bill__customer_id", TruncMonth("payment_date")), "amount"),
+        )
+    else:
+        groups = (
+            (readings, ("reading_date",), "units_consumed"),
+            (bills, ("issue_date",), "amount_due"),
+            (payments, (TruncDate("payment_date"),), "amount"),
+        )
+    names = (("units", "readings"), ("billed", "bills"), ("collected", "payments"))
+    for (queryset, keys, amount), (total_name, count_name) in zip(groups, names):
+        keys = {f"k{i}": F(key) if isinstance(key, str) else key for i, key in enumerate(keys)}
+        rows = (
+            queryset.order_by()
+            .values(**keys)
+            .annotate(total=Sum(amount), count=Count("pk"))
+        )
+        for row in rows:
+            key = tuple(_as_date(row[name]) for name in keys)
+            yield (*key, total_name, row["total"])
+            yield (*key, count_name, row["count"])
+
+
+def refresh_rollups(keys, zones=()):
+    """Recompute the buckets behind ``(customer_id, day)`` keys."""
+    months = defaultdict(set)
+    for customer_id, day in keys:
+        months[customer_id].add(month_start(day))
+    days = {day for _, day in keys}
+
+    with transaction.atomic():
+        dirty_zones = {(zone, month) for zone, month in zones}
+        customer_ids = sorted(months)
+        for start in range(0, len(customer_ids), CHUNK_SIZE):
+            chunk = {pk: months[pk] for pk in customer_ids[start:start + CHUNK_SIZE]}
+            dirty_zones |= _refresh_customer_months(chunk)
+            refresh_usage(chunk)
+        _refresh_zone_months(dirty_zones)
+        _refresh_days(days)
+
+
+def _refresh_customer_months(months):
+    """Recompute ``{customer_id: {month, ...}}``; returns the zone buckets touched."""
+    wanted = {(pk, month) for pk, ms in months.items() for month in ms}
+    first = min(month for ms in months.values() for month in ms)
+    last = _next_month(max(month for ms in months.values() for month in ms)) - timedelta(days=1)
+    totals = _totals(_source_rows(list(months), first, last, by="month"), 2)
+    zones = dict(Customer.objects.filter(pk__in=months).values_list("pk", "zone"))
+
+    touched = {
+        (zone, month)
+        for zone, month in CustomerMonthRollup.objects.filter(
+            customer_id__in=months, month__gte=first, month__lte=last
+        ).values_list("zone", "month")
+    }
+    rows, empty = [], defaultdict(list)
+    for customer_id, month in wanted:
+        if customer_id not in zones:
+            continue
+        values = totals.get((customer_id, month))
+        if values:
+            rows.append(CustomerMonthRollup(
+                customer_id=customer_id, zone=zones[customer_id], month=month,
+                **{name: values[name] for name in FIELDS},
+            ))
+        else:
+            empty[month].append(customer_id)
+        touched.add((zones[customer_id], month))
+    _upsert(CustomerMonthRollup, rows, ["customer", "month"], ["zone", *FIELDS])
+    for month, customer_ids in empty.items():
+        CustomerMonthRollup.objects.filter(customer_id__in=customer_ids, month=month).delete()
+    return touched
+
+
+def _refresh_zone_months(buckets):
+    """Recompute ``(zone, month)`` buckets from the customer rollups."""
+    if not buckets:
+        return
+    zones = {zone for zone, _ in buckets}
+    months = {month for _, month in buckets}
+    totals = {
+        (row["zone"], row["month"]): row
+        for row in CustomerMonthRollup.objects.filter(zone__in=zones, month__in=months)
+        .values("zone", "month")
+        .annotate(**{name: Sum(name) for name in FIELDS})
+    }
+    rows = [
+        ZoneMonthRollup(
+            zone=zone, month=month, **{name: totals[zone, month][name] for name in FIELDS}
+        )
+        for zone, month in buckets
+        if (zone, month) in totals
+    ]
+    _upsert(ZoneMonthRollup, rows, ["zone", "month"], FIELDS)
+    for zone, month in buckets - set(totals):
+        ZoneMonthRollup.objects.filter(zone=zone, month=month).delete()
+
+
+def _refresh_days(days):
+    if not days:
+        return
+    totals = _totals(_source_rows(first=min(days), last=max(days), by="day"), 1)
+    rows = [
+        DailyRollup(day=day, **{name: totals[day][name] for name in FIELDS})
+        for day in days
+        if day in totals
+    ]
+    _upsert(DailyRollup, rows, ["day"], FIELDS)
+    DailyRollup.objects.filter(day__in=days - set(totals)).delete()
+
+
+def _upsert(model, rows, unique_fields, update_fields):
+    model.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=list(update_fields),
+        batch_size=1000,
+    )
+
+
+def rebuild_rollups():
+    """Recompute every rollup from the source tables. Returns rows per table."""
+    with transaction.atomic():
+        CustomerMonthRollup.objects.all().delete()
+        ZoneMonthRollup.objects.all().delete()
+        DailyRollup.objects.all().delete()
+
+        customer_ids = list(Customer.objects.order_by("pk").values_list("pk", flat=True))
+        for start in range(0, len(customer_ids), CHUNK_SIZE):
+            chunk = customer_ids[start:start + CHUNK_SIZE]
+            zones = dict(Customer.objects.filter(pk__in=chunk).values_list("pk", "zone"))
+            totals = _totals(_source_rows(chunk, by="month"), 2)
+            _upsert(CustomerMonthRollup, [
+                CustomerMonthRollup(
+                    customer_id=customer_id, zone=zones[customer_id], month=month,
+                    **{name: values[name] for name in FIELDS},
+                )
+                for (customer_id, month), values in totals.items()
+            ], ["customer", "month"], ["zone", *FIELDS])
+
+        ZoneMonthRollup.objects.bulk_create([
+            ZoneMonthRollup(**row)
+            for row in CustomerMonthRollup.objects.values("zone", "month")
+            .annotate(**{name: Sum(name) for name in FIELDS})
+            .order_by()
+        ], batch_size=1000)
+
+        totals = _totals(_source_rows(by="day"), 1)
+        DailyRollup.objects.bulk_create([
+            DailyRollup(day=day, **{name: values[name] for name in FIELDS})
+            for day, values in totals.items()
+        ], batch_size=1000)
+        meter_months = rebuild_usage()
+
+    return {
+        "customer_months": CustomerMonthRollup.objects.count(),
+        "zone_months": ZoneMonthRollup.objects.count(),
+        "days": DailyRollup.objects.count(),
+        "meter_months": meter_months,
+    }
+
+
+# -------------------------
+# Reading the rollups
+# -------------------------
+DAILY_TREND_DAYS = 62
+
+
+def report_data(start=None, end=None, top=5):
+    """
+    Everything the reports page shows for the days ``start`` to ``end``
+    (both optional), read from the rollup tables only. Zone and customer
+    figures are kept per month, so they cover the whole months overlapping
+    the range.
+    """
+    days = DailyRollup.objects.all()
+    zone_months = ZoneMonthRollup.objects.all()
+    customer_months = CustomerMonthRollup.objects.all()
+    if start:
+        days = days.filter(day__gte=start)
+        zone_months = zone_months.filter(month__gte=month_start(start))
+        customer_months = customer_months.filter(month__gte=month_start(start))
+    if end:
+        days = days.filter(day__lte=end)
+        zone_months = zone_months.filter(month__lte=end)
+        customer_months = customer_months.filter(month__lte=end)
+
+    sums = {name: Sum(name) for name in FIELDS}
+    totals = days.aggregate(**sums)
+    if start and end and (end - start).days <= DAILY_TREND_DAYS:
+        trend = [
+            {"period": row["day"].isoformat(), **row}
+            for row in days.order_by("day").values("day", *FIELDS)
+        ]
+    else:
+        trend = [
+            {"period": row["month"].strftime("%Y-%m"), **row}
+            for row in zone_months.values("month").annotate(**sums).order_by("month")
+        ]
+    zones = list(zone_months.values("zone").annotate(**sums).order_by("zone"))
+    top_customers = list(
+        customer_months.values("customer_id", "customer__name", "customer__house_number")
+        .annotate(**sums)
+        .order_by("-billed")[:top]
+    )
+    return {
+        "totals": {name: value or 0 for name, value in totals.items()},
+        "trend": trend,
+        "zones": zones,
+        "top_customers": top_customers,
+    }
@@ -0,0 +1,76 @@
+"""
+Read-replica routing.
+
+Everything goes to the primary ("default") unless told otherwise. Read-heavy
+pages that can live with a little replication lag (the dashboard, the reports
+and the exports) read from the ``replica`` alias when one is configured:
+views opt in with ``@read_replica``, and querysets that outlive the view (a
+streamed export) with ``.using(read_alias())``. Reads inside a transaction
+stay on the primary so they see its writes, and billing code never opts in,
+so bills are never computed from stale balances. Without a replica nothing
+changes.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = "replica"
+
+_use_replica = ContextVar("use_replica", default=False)
+
+
+def read_alias():
+    """The alias report reads go to: the replica if there is one, else the primary."""
+    return REPLICA if REPLICA in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_replica():
+    """Route the reads of the enclosed block to the replica."""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def read_replica(view):
+    """Run ``view`` (sync or async) with its reads routed to the replica."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            with use_replica():
+                return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with use_replica():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if (
+            _use_replica.get()
+            and read_alias() == REPLICA
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA} or None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # The replica receives the schema through replication
+        return False if db == REPLICA else None
@@ -0,0 +1,210 @@
+"""
+Prefix search behind the autocomplete endpoints.
+
+``LIKE 'abc%'`` (Django's ``startswith``/``istartswith``) makes SQLite scan
+the whole table, because the pattern carries an ``ESCAPE`` clause and is
+case-insensitive. The same match written as a range over the lower-cased
+column, ``lower(name) >= 'abc' AND lower(name) < 'abc' || U+10FFFF``, is
+served by the ``Lower()`` indexes on customer names, house numbers and meter
+serials, on SQLite and PostgreSQL alike. Ordering by the same expression lets
+the database stop after ``limit`` rows.
+
+Each searched field gets its own query (an ``OR`` across tables defeats the
+indexes); the results are merged in field order.
+
+Customer and meter search also match inside values ("wanj" finds "Ann
+Wanjiru", "0123" a meter serial), ranked by relevance. On SQLite that is an
+FTS5 table with the trigram tokenizer, one row per customer with its meter
+serial, kept up to date by triggers (migration 0015; a later migration that
+rebuilds ``core_customer`` or ``core_meter`` must recreate them). On
+PostgreSQL, ``lower(column) LIKE '%term%'`` is served by pg_trgm GIN indexes
+and ranked by trigram similarity. Trigrams need three characters, so shorter
+terms, and other databases, fall back to the prefix search. A longer term with
+a shorter word in it ("Customer 1") is matched as a whole instead.
+"""
+import sqlite3
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Lower
+
+from .models import Bill, Customer, Meter, MeterReading
+
+AUTOCOMPLETE_LIMIT = 20
+PREFIX_END = "\U0010ffff"  # sorts after every other character
+SEARCH_TABLE = "core_customer_search"
+MIN_TRIGRAM = 3
+
+
+def prefix_filter(queryset, field, term):
+    """Rows of ``queryset`` whose ``field`` starts with ``term``, ignoring case."""
+    term = term.lower()
+    alias = f"{field.replace('__', '_')}_lower"
+    return queryset.alias(**{alias: Lower(field)}).filter(
+        **{f"{alias}__gte": term, f"{alias}__lt": term + PREFIX_END}
+    )
+
+
+def prefix_search(queryset, fields, term, limit=AUTOCOMPLETE_LIMIT, then=()):
+    """
+    Up to ``limit`` rows whose ``fields`` start with ``term``, in field order,
+    each field's matches sorted by that field and then by ``then``. Returns
+    ``(rows, more)``, where ``more`` tells whether rows were left out.
+    Without a term the first rows by ``then`` (or the first field) are returned.
+    """
+    term = term.strip()
+    if not term:
+        order = then or (Lower(fields[0]),)
+        rows = list(queryset.order_by(*order, "pk")[:limit + 1])
+        return rows[:limit], len(rows) > limit
+
+    found = {}
+    for field in fields:
+        matches = prefix_filter(queryset, field, term).order_by(Lower(field), *then, "pk")
+        for row in matches[:limit + 1 - len(found)]:
+            found.setdefault(row.pk, row)
+        if len(found) > limit:
+            break
+    rows = list(found.values())
+    return rows[:limit], len(rows) > limit
+
+
+# -------------------------
+# Substring search
+# -------------------------
+def _words(term):
+    """The words of ``term`` long enough for trigram matching."""
+    return [word for word in term.split() if len(word) >= MIN_TRIGRAM]
+
+
+def _fts_query(words):
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+def _like_pattern(term):
+    escaped = term.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _match_sql(term, ranked=True):
+    """
+    SQL selecting the ids of customers matching ``term`` (best match first if
+    ``ranked``) and its parameters; None where substring search is unavailable.
+    """
+    words = _words(term)
+    if not words:
+        return None
+    if connection.vendor == "sqlite" and sqlite3.sqlite_version_info >= (3, 34):
+        # Every word must match; the bm25 column weights are set by the migration.
+        # A word too short for a trigram can only be matched as part of the
+        # whole term, as one phrase (a substring of a single column).
+        if len(words) < len(term.split()):
+            words = [" ".join(term.split())]
+        sql = f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s"
+        return (f"{sql} ORDER BY rank" if ranked else sql), [_fts_query(words)]
+    if connection.vendor == "postgresql":
+        term = " ".join(term.split()).lower()
+        pattern = _like_pattern(term)
+        sql = (
+            "SELECT id FROM core_customer WHERE lower(name) LIKE %s "
+            "OR lower(house_number) LIKE %s OR lower(phone_number) LIKE %s "
+            "UNION SELECT customer_id FROM core_meter WHERE lower(serial_number) LIKE %s"
+        )
+        if not ranked:
+            return sql, [pattern] * 4
+        return (
+            "SELECT c.id FROM core_customer c LEFT JOIN core_meter m ON m.customer_id = c.id "
+            f"WHERE c.id IN ({sql}) "
+            "ORDER BY GREATEST(similarity(lower(c.name), %s), "
+            "similarity(lower(c.house_number), %s), "
+            "similarity(lower(coalesce(c.phone_number, '')), %s), "
+            "similarity(lower(coalesce(m.serial_number, '')), %s)) DESC, c.id",
+            [pattern] * 4 + [term] * 4,
+        )
+    return None
+
+
+def matching_customers(term):
+    """
+    Customers whose name, house number, phone number or meter serial contains
+    ``term`` (every word of it, on SQLite), for filtering other querysets.
+    Terms shorter than three characters match the start of those fields.
+    """
+    term = term.strip()
+    match = _match_sql(term, ranked=False)
+    if match is not None:
+        return Customer.objects.filter(pk__in=RawSQL(*match))
+    if _words(term):
+        # Neither FTS5 nor pg_trgm: scan
+        return Customer.objects.filter(
+            Q(name__icontains=term) | Q(house_number__icontains=term)
+            | Q(phone_number__icontains=term) | Q(meter__serial_number__icontains=term)
+        )
+    customers = Customer.objects.all()
+    return customers.filter(
+        Q(pk__in=prefix_filter(customers, "name", term).values("pk"))
+        | Q(pk__in=prefix_filter(customers, "house_number", term).values("pk"))
+        | Q(pk__in=prefix_filter(Meter.objects.all(), "serial_number", term).values("customer"))
+    )
+
+
+def ranked_customer_ids(term, limit):
+    """Ids of up to ``limit`` customers matching ``term``, best match first, or None."""
+    match = _match_sql(term.strip())
+    if match is None:
+        return None
+    sql, params = match
+    with connection.cursor() as cursor:
+        cursor.execute(f"{sql} LIMIT %s", [*params, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _ranked(queryset, ids, key, limit):
+    """The rows of ``queryset`` whose ``key`` is in ``ids``, in that order; as ``prefix_search``."""
+    rows = {getattr(row, key): row for row in queryset.filter(**{f"{key}__in": ids})}
+    ranked = [rows[pk] for pk in ids if pk in rows]
+    return ranked[:limit], len(ids) > limit
+
+
+# -------------------------
+# Searches per model
+# -------------------------
+def search_customers(term, limit=AUTOCOMPLETE_LIMIT):
+    """Customers by name, house number, phone or meter serial, best match first."""
+    ids = ranked_customer_ids(term, limit + 1)
+    if ids is not None:
+        return _ranked(Customer.objects.all(), ids, "pk", limit)
+    return prefix_search(Customer.objects.all(), ("house_number", "name"), term, limit)
+
+
+def search_meters(term, limit=AUTOCOMPLETE_LIMIT):
+    """Meters by serial or by their customer's name, house number or phone."""
+    meters = Meter.objects.select_related("customer")
+    ids = ranked_customer_ids(term, limit + 1)
+    if ids is not None:
+        return _ranked(meters, ids, "customer_id", limit)
+    return prefix_search(
+        meters, ("serial_number", "customer__house_number", "customer__name"), term, limit
+    )
+
+
+def search_readings(term, limit=AUTOCOMPLETE_LIMIT):
+    """Readings of matching meters, newest first."""
+    return prefix_search(
+        MeterReading.objects.select_related("meter__customer"),
+        ("meter__serial_number", "meter__customer__house_number", "meter__customer__name"),
+        term, limit, then=("-reading_date",),
+    )
+
+
+def search_bills(term, limit=AUTOCOMPLETE_LIMIT):
+    """Bills of matching customers, newest first; a bill number matches that bill."""
+    bills = Bill.objects.select_related("customer")
+    number = term.strip().lstrip("#")
+    exact = list(bills.filter(pk=int(number))) if number.isdigit() else []
+    rows, more = prefix_search(
+        bills, ("customer__house_number", "customer__name"), term, limit - len(exact),
+        then=("-issue_date",),
+    )
+    return exact + [bill for bill in rows if bill not in exact], more
@@ -1,46 +1,387 @@
-from django.db.models.signals import post_save, post_delete
+from collections import Counter
+from decimal import Decimal
+
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
-from .models import MeterReading, Bill, Payment, Tariff
+from .models import (
+    Customer, CustomerLedger, Meter, MeterReading, Bill, BillingJob, Payment, Tariff,
+    TariffBlock,
+)
+# caching and stats both name their customer and meter keys CUSTOMERS and METERS
+from . import caching, stats
+from .caching import customer_scope, invalidate
+from .consumption import recompute_consumption
+from .ingestion import bill_on_reading
+from .jobs import billing_async, enqueue
+from .ledger import ZERO, apply_delta
+from .rerating import rerate_bills
+from .rollups import add_to_rollups, mark_dirty
+from .stats import COLLECTED, apply_stat_deltas, bill_deltas, readings_key
+from .tariffs import tariff_resolver
 
 # 1️⃣ Auto-create or update Bill when a MeterReading is saved
 @receiver(post_save, sender=MeterReading)
 def auto_create_or_update_bill(sender, instance, created, **kwargs):
-    if created or not hasattr(instance, "bill"):
+    if not bill_on_reading():
+        # Bills are issued by the monthly billing cycle; keep consumption current
+        recompute_consumption(
+            meter_ids=[instance.meter_id], start=instance.reading_date if created else None
+        )
+    elif billing_async():
+        enqueue(BillingJob.GENERATE_BILL, instance.pk)
+    elif created or not hasattr(instance, "bill"):
         Bill.create_from_reading(instance)
     else:
-        # Recompute units and update existing bill if reading changes
-        instance.compute_units()
-        bill = instance.bill
-        bill.amount_due = bill.compute_amount_due()
-        bill.update_status()
-        bill.save()
+        # The reading may have moved, so recompute the whole meter; bills of
+        # readings whose consumption changed (this one included) are re-rated
+        recompute_consumption(meter_ids=[instance.meter_id])
 
 
 # 2️⃣ Auto-update Bill status when a Payment is made or updated
 @receiver(post_save, sender=Payment)
 def auto_update_bill_status(sender, instance, **kwargs):
-    instance.bill.update_status()
+    if billing_async():
+        enqueue(BillingJob.UPDATE_STATUS, instance.bill_id)
+    else:
+        instance.bill.update_status()
 
 
 # 3️⃣ Auto-update Bill status when a Payment is deleted
 @receiver(post_delete, sender=Payment)
 def auto_update_bill_status_on_delete(sender, instance, **kwargs):
-    instance.bill.update_status()
+    if billing_async():
+        enqueue(BillingJob.UPDATE_STATUS, instance.bill_id)
+    else:
+        instance.bill.update_status()
 
 
 # 4️⃣ Auto-delete related Bill when a MeterReading is deleted
 @receiver(post_delete, sender=MeterReading)
 def auto_delete_related_bill(sender, instance, **kwargs):
-    try:
-        instance.bill.delete()
-    except Bill.DoesNotExist:
-        pass
+    # Normally already removed by the cascade; a queryset delete (unlike
+    # instance.bill.delete()) cannot fire the delete signals a second time
+    Bill.objects.filter(reading_id=instance.pk).delete()
+    # The next reading now follows an earlier one
+    if billing_async():
+        enqueue(BillingJob.RECOMPUTE_CONSUMPTION, instance.meter_id)
+    else:
+        recompute_consumption(meter_ids=[instance.meter_id], start=instance.reading_date)
 
 
-# 5️⃣ Auto-update all unpaid bills if a new Tariff is added
+# 5️⃣ Auto-update unpaid bills if the Tariff timeline or its blocks change
 @receiver(post_save, sender=Tariff)
-def auto_update_unpaid_bills_on_tariff_change(sender, instance, **kwargs):
-    for bill in Bill.objects.filter(is_paid=False):
-        bill.amount_due = bill.compute_amount_due()
-        bill.update_status()
-        bill.save()
+@receiver(post_delete, sender=Tariff)
+@receiver(post_save, sender=TariffBlock)
+@receiver(post_delete, sender=TariffBlock)
+def auto_update_unpaid_bills_on_tariff_change(sender, instance, raw=False, **kwargs):
+    tariff_resolver.invalidate()
+    if raw:
+        return
+    tariff = instance.tariff if sender is TariffBlock else instance
+    # Only readings from the tariff's effective date onwards are affected,
+    # unless an existing tariff was moved
+    since = None
+    if sender is TariffBlock or kwargs.get("created", True):
+        since = tariff.effective_date
+    if billing_async():
+        enqueue(BillingJob.RERATE, payload={"since": since and str(since)})
+        return
+    bills = Bill.objects.filter(is_paid=False)
+    if since:
+        bills = bills.filter(reading__reading_date__gte=since)
+    rerate_bills(bills)
+
+
+# 6️⃣ Keep the customer ledger in step with bills and payments
+@receiver(post_save, sender=Customer)
+def create_customer_ledger(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        CustomerLedger.objects.get_or_create(customer=instance)
+
+
+def _touches(update_fields, *fields):
+    return update_fields is None or any(field in update_fields for field in fields)
+
+
+@receiver(pre_save, sender=Bill)
+@receiver(pre_save, sender=Payment)
+def remember_ledger_values(sender, instance, update_fields=None, **kwargs):
+    """Stash the stored values so post_save can apply a delta."""
+    instance._ledger_previous = None
+    if instance.pk is None or instance._state.adding:
+        return
+    if not _touches(update_fields, "amount_due", "amount", "customer", "bill"):
+        return
+    if sender is Bill:
+        instance._ledger_previous = (
+            Bill.objects.filter(pk=instance.pk).values_list("customer_id", "amount_due").first()
+        )
+    else:
+        instance._ledger_previous = (
+            Payment.objects.filter(pk=instance.pk)
+            .values_list("bill__customer_id", "amount")
+            .first()
+        )
+
+
+@receiver(post_save, sender=Bill)
+def update_ledger_for_bill(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _touches(update_fields, "amount_due", "customer"):
+        return
+    amount = Decimal(str(instance.amount_due))
+    previous = getattr(instance, "_ledger_previous", None)
+    if previous and previous[0] == instance.customer_id:
+        apply_delta(instance.customer_id, billed=amount - previous[1])
+        return
+    if previous:
+        apply_delta(previous[0], billed=-previous[1])
+    apply_delta(instance.customer_id, billed=amount)
+
+
+@receiver(post_delete, sender=Bill)
+def update_ledger_on_bill_delete(sender, instance, **kwargs):
+    apply_delta(instance.customer_id, billed=-Decimal(str(instance.amount_due)))
+
+
+@receiver(post_save, sender=Payment)
+def update_ledger_for_payment(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _touches(update_fields, "amount", "bill"):
+        return
+    amount = Decimal(str(instance.amount))
+    customer_id = instance.bill.customer_id
+    previous = getattr(instance, "_ledger_previous", None)
+    if previous and previous[0] == customer_id:
+        apply_delta(customer_id, paid=amount - previous[1])
+        return
+    if previous:
+        apply_delta(previous[0], paid=-previous[1])
+    apply_delta(customer_id, paid=amount)
+
+
+@receiver(post_delete, sender=Payment)
+def update_ledger_on_payment_delete(sender, instance, **kwargs):
+    customer_id = (
+        Bill.objects.filter(pk=instance.bill_id).values_list("customer_id", flat=True).first()
+    )
+    apply_delta(customer_id, paid=-Decimal(str(instance.amount)))
+
+
+# 7️⃣ Keep the dashboard counters in step
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Meter)
+def count_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        apply_stat_deltas({stats.CUSTOMERS if sender is Customer else stats.METERS: 1})
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Meter)
+def count_deleted(sender, instance, **kwargs):
+    apply_stat_deltas({stats.CUSTOMERS if sender is Customer else stats.METERS: -1})
+
+
+@receiver(pre_save, sender=MeterReading)
+@receiver(pre_save, sender=Bill)
+@receiver(pre_save, sender=Payment)
+def remember_stat_values(sender, instance, **kwargs):
+    """Stash the stored values so post_save can apply a delta."""
+    instance._stats_previous = None
+    if instance.pk is None or instance._state.adding:
+        return
+    # The rollups also read the row's customer and date (and a reading's meter
+    # and units): what the stored row counted, and in which buckets
+    fields = {
+        MeterReading: ("reading_date", "meter__customer_id", "units_consumed", "meter_id"),
+        Bill: ("amount_due", "is_paid", "customer_id", "issue_date"),
+        Payment: ("amount", "bill__customer_id", "payment_date"),
+    }[sender]
+    instance._stats_previous = (
+        sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+    )
+
+
+@receiver(post_save, sender=MeterReading)
+def count_reading(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = Counter({readings_key(instance.reading_date): 1})
+    previous = getattr(instance, "_stats_previous", None)
+    if previous:
+        deltas[readings_key(previous[0])] -= 1
+    apply_stat_deltas(deltas)
+
+
+@receiver(post_delete, sender=MeterReading)
+def uncount_reading(sender, instance, **kwargs):
+    apply_stat_deltas({readings_key(instance.reading_date): -1})
+
+
+@receiver(post_save, sender=Bill)
+def count_bill(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = bill_deltas(instance.amount_due, instance.is_paid)
+    previous = getattr(instance, "_stats_previous", None)
+    if previous:
+        deltas.update(bill_deltas(*previous[:2], sign=-1))
+    apply_stat_deltas(deltas)
+
+
+@receiver(post_delete, sender=Bill)
+def uncount_bill(sender, instance, **kwargs):
+    apply_stat_deltas(bill_deltas(instance.amount_due, instance.is_paid, sign=-1))
+
+
+@receiver(post_save, sender=Payment)
+def count_payment(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    amount = Decimal(str(instance.amount))
+    previous = getattr(instance, "_stats_previous", None)
+    apply_stat_deltas({COLLECTED: amount - previous[0] if previous else amount})
+
+
+@receiver(post_delete, sender=Payment)
+def uncount_payment(sender, instance, **kwargs):
+    apply_stat_deltas({COLLECTED: -Decimal(str(instance.amount))})
+
+
+# 8️⃣ Add each row to the report rollups (see core.rollups)
+@receiver(pre_save, sender=MeterReading)
+def remember_counted_units(sender, instance, **kwargs):
+    # compute_units may change units_consumed before post_save runs; the
+    # rollups count what this save wrote, and compute_units adds the change
+    instance._rollup_units = instance.units_consumed
+
+
+@receiver(post_save, sender=MeterReading)
+@receiver(post_delete, sender=MeterReading)
+def count_reading_rollups(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _touches(update_fields, "reading_date", "meter", "units_consumed"):
+        return
+    customer_id = instance.meter.customer_id
+    if "created" not in kwargs:  # deleted
+        add_to_rollups(
+            customer_id, instance.reading_date, meter_id=instance.meter_id,
+            readings=-1, units=-(instance.units_consumed or ZERO),
+        )
+        return
+    previous = getattr(instance, "_stats_previous", None)
+    if previous:
+        reading_date, previous_customer_id, units, meter_id = previous
+        add_to_rollups(
+            previous_customer_id, reading_date, meter_id=meter_id,
+            readings=-1, units=-(units or ZERO),
+        )
+    add_to_rollups(
+        customer_id, instance.reading_date, meter_id=instance.meter_id,
+        readings=1, units=instance._rollup_units or ZERO,
+    )
+
+
+@receiver(post_save, sender=Bill)
+@receiver(post_delete, sender=Bill)
+def count_bill_rollups(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _touches(update_fields, "amount_due", "customer", "issue_date"):
+        return
+    amount_due = Decimal(str(instance.amount_due))
+    if "created" not in kwargs:  # deleted
+        add_to_rollups(instance.customer_id, instance.issue_date, bills=-1, billed=-amount_due)
+        return
+    previous = getattr(instance, "_stats_previous", None)
+    if previous:
+        add_to_rollups(previous[2], previous[3], bills=-1, billed=-previous[0])
+    add_to_rollups(instance.customer_id, instance.issue_date, bills=1, billed=amount_due)
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def count_payment_rollups(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _touches(update_fields, "amount", "bill", "payment_date"):
+        return
+    customer_id = instance.bill.customer_id
+    amount = Decimal(str(instance.amount))
+    if "created" not in kwargs:  # deleted
+        add_to_rollups(customer_id, instance.payment_date, payments=-1, collected=-amount)
+        return
+    previous = getattr(instance, "_stats_previous", None)
+    if previous:
+        add_to_rollups(previous[1], previous[2], payments=-1, collected=-previous[0])
+    add_to_rollups(customer_id, instance.payment_date, payments=1, collected=amount)
+
+
+@receiver(pre_save, sender=Customer)
+def remember_zone(sender, instance, **kwargs):
+    # The name and house number tell the page cache whether the lists changed
+    previous = (
+        Customer.objects.filter(pk=instance.pk).values_list("zone", "name", "house_number").first()
+        if instance.pk and not instance._state.adding
+        else None
+    )
+    instance._previous_zone = previous and previous[0]
+    instance._previous_listing = previous and previous[1:]
+
+
+@receiver(post_save, sender=Customer)
+def move_zone_rollups(sender, instance, created, raw=False, **kwargs):
+    previous = getattr(instance, "_previous_zone", None)
+    if created or raw or previous is None or previous == instance.zone:
+        return
+    months = list(instance.month_rollups.values_list("month", flat=True))
+    mark_dirty(
+        [(instance.pk, month) for month in months],
+        zones=[(previous, month) for month in months],
+    )
+
+
+@receiver(pre_delete, sender=Customer)
+def release_zone_rollups(sender, instance, **kwargs):
+    mark_dirty([], zones=instance.month_rollups.values_list("zone", "month"))
+
+
+# 9️⃣ Drop the cached pages showing a changed row (see core.caching)
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def uncache_customer(sender, instance, **kwargs):
+    scopes = [customer_scope(instance.pk)]
+    listing = (instance.name, instance.house_number)
+    # Created and deleted customers (no "created" argument) change the lists
+    if kwargs.get("created", True) or instance._previous_listing != listing:
+        # The meter cards show the customer's name too
+        scopes += [caching.CUSTOMERS, caching.METERS]
+    invalidate(*scopes)
+
+
+@receiver(pre_save, sender=Meter)
+def remember_meter_customer(sender, instance, **kwargs):
+    instance._previous_customer_id = (
+        Meter.objects.filter(pk=instance.pk).values_list("customer_id", flat=True).first()
+        if instance.pk and not instance._state.adding
+        else None
+    )
+
+
+@receiver(post_save, sender=Meter)
+@receiver(post_delete, sender=Meter)
+def uncache_meter(sender, instance, **kwargs):
+    customer_ids = {instance.customer_id, getattr(instance, "_previous_customer_id", None)}
+    invalidate(caching.METERS, *(customer_scope(pk) for pk in customer_ids if pk))
+
+
+@receiver(post_save, sender=Bill)
+@receiver(post_delete, sender=Bill)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def uncache_customer_billing(sender, instance, **kwargs):
+    customer_id = instance.customer_id if sender is Bill else instance.bill.customer_id
+    previous = getattr(instance, "_stats_previous", None)
+    if previous:
+        # A bill or payment moved to another customer leaves the previous one
+        previous = previous[2] if sender is Bill else previous[1]
+    invalidate(*(customer_scope(pk) for pk in {customer_id, previous} if pk))
+
+
+@receiver(post_save, sender=MeterReading)
+@receiver(post_delete, sender=MeterReading)
+def uncache_readings(sender, instance, **kwargs):
+    invalidate(caching.READINGS)
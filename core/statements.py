@@ -0,0 +1,255 @@
+"""
+Bank and mobile-money statement import.
+
+A statement is streamed in batches. Each line is matched to a bill through
+in-memory indexes built once per run: an account that looks like a bill
+reference (``BILL-123``, ``#123``) names the bill directly, and a house number
+pays the customer's oldest unpaid bill (or, when everything is paid, the
+latest one, leaving a credit). Lines whose transaction reference was already
+recorded are skipped, so re-importing a statement is harmless. Matched lines
+are written by ``core.payments.record_payments``, which inserts them in bulk
+and updates each touched bill once per batch. Lines that cannot be matched or
+are invalid go to the suspense report.
+"""
+import csv
+import json
+import re
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import DecimalField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .ledger import ZERO
+from .models import Bill, Customer, Payment
+from .payments import clean_payment, record_payments
+
+BILL_REFERENCE = re.compile(r"^(?:BILL[\s#-]*|#)(\d+)$", re.IGNORECASE)
+
+# Accepted header names for each statement field, in order of preference
+COLUMNS = {
+    "reference": ("reference", "reference_number", "transaction_id", "receipt_no"),
+    "amount": ("amount", "paid_in", "credit"),
+    "date": ("date", "payment_date", "transaction_date", "completion_time"),
+    "account": ("account", "account_number", "bill_reference", "house_number"),
+}
+
+
+@dataclass
+class StatementResult:
+    """Outcome of a statement import."""
+
+    rows: int = 0
+    imported: int = 0
+    duplicates: int = 0
+    suspense: list = field(default_factory=list)  # (line number, reason, raw row)
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+# -------------------------
+# Parsing
+# -------------------------
+def _column_map(names):
+    """Map each statement field to the first matching header in ``names``."""
+    lowered = {name.strip().lower(): name for name in names if name}
+    mapping = {}
+    for key, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in lowered:
+                mapping[key] = lowered[alias]
+                break
+    return mapping
+
+
+def parse_statement(stream, fmt="csv"):
+    """
+    Yield ``(line_number, fields, raw)`` from a CSV (with a header row) or
+    JSON-lines statement, where ``fields`` has the ``COLUMNS`` keys and
+    ``raw`` is the line as read, for the suspense report.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        mapping = _column_map(reader.fieldnames or [])
+        missing = set(COLUMNS) - set(mapping) - {"date"}
+        if missing:
+            raise ValueError(f"statement has no {', '.join(sorted(missing))} column")
+        for line_number, row in enumerate(reader, start=2):
+            yield line_number, {key: row.get(name) for key, name in mapping.items()}, row
+    elif fmt == "jsonl":
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            if not isinstance(row, dict):
+                yield line_number, {}, {"line": line}
+                continue
+            mapping = _column_map(row)
+            yield line_number, {key: row.get(name) for key, name in mapping.items()}, row
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def _amount(value):
+    """Statement amounts may carry thousands separators."""
+    try:
+        return Decimal(str(value).replace(",", "").strip())
+    except (InvalidOperation, ValueError):
+        return None
+
+
+# -------------------------
+# Matching
+# -------------------------
+class BillMatcher:
+    """
+    Hash indexes over house numbers and unpaid bills, built with two queries
+    per run. The amounts of valid lines are allocated as they are matched, so
+    several payments from one customer in a statement settle their bills
+    oldest first.
+    """
+
+    def __init__(self):
+        latest = Bill.objects.filter(customer=OuterRef("pk")).order_by("-issue_date", "-pk")
+        self.customers = {
+            house_number.strip().upper(): (customer_id, latest_bill)
+            for house_number, customer_id, latest_bill in Customer.objects.annotate(
+                latest_bill=Subquery(latest.values("pk")[:1])
+            ).values_list("house_number", "pk", "latest_bill").iterator(chunk_size=5000)
+        }
+
+        paid = (
+            Payment.objects.filter(bill=OuterRef("pk"))
+            .order_by()
+            .values("bill")
+            .annotate(total=Sum("amount"))
+            .values("total")
+        )
+        self.remaining = {}  # unpaid bill id -> amount still owed
+        self.unpaid = defaultdict(deque)  # customer id -> unpaid bill ids, oldest first
+        for pk, customer_id, amount_due, total_paid in (
+            Bill.objects.filter(is_paid=False)
+            .annotate(total_paid=Coalesce(
+                Subquery(paid, output_field=DecimalField(max_digits=16, decimal_places=2)), ZERO
+            ))
+            .order_by("due_date", "pk")
+            .values_list("pk", "customer_id", "amount_due", "total_paid")
+            .iterator(chunk_size=5000)
+        ):
+            self.remaining[pk] = amount_due - total_paid
+            self.unpaid[customer_id].append(pk)
+
+    def match(self, account):
+        """The bill id ``account`` pays, or None when nothing matches."""
+        account = str(account or "").strip()
+        reference = BILL_REFERENCE.match(account)
+        if reference:
+            bill_id = int(reference.group(1))
+        else:
+            customer = self.customers.get(account.upper())
+            if customer is None:
+                return None
+            customer_id, bill_id = customer
+            queue = self.unpaid.get(customer_id)
+            while queue and self.remaining[queue[0]] <= 0:
+                queue.popleft()
+            if queue:
+                bill_id = queue[0]
+        return bill_id
+
+    def allocate(self, bill_id, amount):
+        """Count ``amount`` as paid towards ``bill_id`` for the lines that follow."""
+        if bill_id in self.remaining:
+            self.remaining[bill_id] -= amount
+
+
+# -------------------------
+# Import
+# -------------------------
+def import_statement(lines, batch_size=2000):
+    """Import ``(line_number, fields, raw)`` statement lines in batches."""
+    result = StatementResult()
+    started = time.perf_counter()
+    matcher = BillMatcher()
+    seen = set()
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            _import_batch(batch, matcher, seen, result)
+            batch = []
+    if batch:
+        _import_batch(batch, matcher, seen, result)
+    result.suspense.sort(key=lambda entry: entry[0])
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def _import_batch(batch, matcher, seen, result):
+    result.rows += len(batch)
+    references = {str(fields.get("reference") or "").strip() for _, fields, _ in batch}
+    # Dedupe before matching, so replayed lines don't allocate amounts again
+    seen.update(
+        Payment.objects.filter(reference_number__in=references - seen).values_list(
+            "reference_number", flat=True
+        )
+    )
+
+    rows, raws = [], {}
+    for line_number, fields, raw in batch:
+        reference = str(fields.get("reference") or "").strip()
+        if reference and reference in seen:
+            result.duplicates += 1
+            continue
+        if not fields.get("account"):
+            result.suspense.append((line_number, "missing account", raw))
+            continue
+        bill_id = matcher.match(fields["account"])
+        if bill_id is None:
+            result.suspense.append(
+                (line_number, f"no bill or house number matches {fields['account']!r}", raw)
+            )
+            continue
+        # A line that is going to be rejected must not settle a bill for the next ones
+        amount = _amount(fields.get("amount"))
+        try:
+            payment = clean_payment(
+                bill_id,
+                amount if amount is not None else fields.get("amount"),
+                reference,
+                fields.get("date"),
+            )
+        except ValueError as exc:
+            result.suspense.append((line_number, str(exc), raw))
+            continue
+        matcher.allocate(bill_id, payment[1])
+        seen.add(reference)
+        rows.append((line_number, *payment))
+        raws[line_number] = raw
+
+    recorded = record_payments(rows)
+    result.imported += recorded.created
+    result.duplicates += len(recorded.duplicates)
+    for line_number, message in recorded.errors:
+        if line_number not in recorded.duplicates:
+            result.suspense.append((line_number, message, raws[line_number]))
+
+
+def write_suspense(stream, suspense):
+    """Write suspense entries as CSV: line, reason, then the original columns."""
+    columns = []
+    for _, _, raw in suspense:
+        columns.extend(name for name in raw if name is not None and name not in columns)
+    writer = csv.writer(stream)
+    writer.writerow(["line", "reason", *columns])
+    for line_number, reason, raw in suspense:
+        writer.writerow([line_number, reason, *(raw.get(name, "") for name in columns)])
@@ -0,0 +1,66 @@
+// Search-as-you-type for <select data-autocomplete-url> (see forms.AutocompleteSelect).
+// The page renders only the chosen option; matches are fetched from the
+// autocomplete endpoint and replace the other options.
+(function () {
+  "use strict";
+
+  const DELAY_MS = 250;
+
+  function option(value, text, selected) {
+    return new Option(text, value, selected, selected);
+  }
+
+  function attach(select) {
+    const search = document.createElement("input");
+    search.type = "search";
+    search.className = "form-control mb-1";
+    search.placeholder = "Type to search…";
+    search.autocomplete = "off";
+    select.parentNode.insertBefore(search, select);
+
+    let timer = null;
+    let request = 0;
+
+    function load() {
+      const current = request += 1;
+      const url = new URL(select.dataset.autocompleteUrl, window.location.origin);
+      url.searchParams.set("q", search.value);
+      fetch(url, {credentials: "same-origin", headers: {Accept: "application/json"}})
+        .then(response => (response.ok ? response.json() : Promise.reject(response)))
+        .then(data => {
+          if (current !== request) {
+            return; // a newer search is on its way
+          }
+          const chosen = select.selectedOptions[0];
+          const keep = [...select.options].filter(o => o.value === "" || o === chosen);
+          select.replaceChildren(...keep);
+          for (const row of data.results) {
+            if (!chosen || String(row.id) !== chosen.value) {
+              select.add(option(row.id, row.text, false));
+            }
+          }
+          if (data.more) {
+            const hint = option("", "Keep typing to narrow the results…", false);
+            hint.disabled = true;
+            select.add(hint);
+          }
+        })
+        .catch(() => {});
+    }
+
+    search.addEventListener("input", () => {
+      clearTimeout(timer);
+      timer = setTimeout(load, DELAY_MS);
+    });
+    select.addEventListener("focus", () => {
+      if (select.options.length <= 2) {
+        load();
+      }
+    }, {once: true});
+    search.addEventListener("focus", load, {once: true});
+  }
+
+  document.addEventListener("DOMContentLoaded", () => {
+    document.querySelectorAll("select[data-autocomplete-url]").forEach(attach);
+  });
+})();
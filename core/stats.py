@@ -0,0 +1,212 @@
+"""
+Dashboard statistics.
+
+The dashboard figures are kept as named running totals in ``StatCounter``
+rows, so rendering it is one primary-key lookup however large the tables get.
+Signals (and the bulk paths that bypass them) apply deltas with ``F()``
+updates; ``recompute_stats`` rebuilds every counter from the source tables and
+reports any drift, and is meant to be run periodically.
+
+``bill_summary`` computes the totals of an arbitrary (filtered) set of bills
+in a single aggregate query instead.
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Bill, Customer, Meter, MeterReading, Payment, StatCounter
+
+ZERO = Decimal("0.00")
+
+CUSTOMERS = "customers"
+METERS = "meters"
+BILLED = "billed"
+DUE = "due"
+UNPAID_BILLS = "unpaid_bills"
+COLLECTED = "collected"
+READINGS_PREFIX = "readings:"
+
+_batch = threading.local()
+
+
+def readings_key(day):
+    """Counter name for the number of readings taken on ``day``."""
+    day = MeterReading._meta.get_field("reading_date").to_python(day)
+    return f"{READINGS_PREFIX}{day.isoformat()}"
+
+
+def bill_deltas(amount_due, is_paid, sign=1):
+    """What a bill contributes to the counters (``sign=-1`` to take it away)."""
+    amount = Decimal(str(amount_due)) * sign
+    deltas = Counter({BILLED: amount})
+    if not is_paid:
+        deltas[DUE] = amount
+        deltas[UNPAID_BILLS] = sign
+    return deltas
+
+
+def apply_stat_deltas(deltas):
+    """
+    Add a ``{name: delta}`` mapping to the counters, creating missing ones.
+    The counters are updated in name order, so that concurrent transactions
+    lock their rows in the same order. Inside ``batched_stat_deltas`` the
+    deltas wait for the block to exit.
+    """
+    if getattr(_batch, "depth", 0):
+        _batch.deltas.update(deltas)
+        return
+    now = timezone.now()
+    for name in sorted(deltas):
+        delta = deltas[name]
+        if not delta:
+            continue
+        counter = StatCounter.objects.filter(name=name)
+        if not counter.update(value=F("value") + delta, updated_at=now):
+            StatCounter.objects.bulk_create([StatCounter(name=name)], ignore_conflicts=True)
+            counter.update(value=F("value") + delta, updated_at=now)
+
+
+@contextmanager
+def batched_stat_deltas():
+    """
+    Apply the deltas of every ``apply_stat_deltas`` call inside the block in
+    one call when it exits. The receivers of a single save (and the saves
+    they trigger) then lock the counters in name order too, instead of one
+    receiver at a time.
+    """
+    if not getattr(_batch, "depth", 0):
+        _batch.deltas = Counter()
+    _batch.depth = getattr(_batch, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        _batch.depth -= 1
+    if not _batch.depth:
+        apply_stat_deltas(_batch.deltas)
+
+
+def _dashboard_counters(day):
+    today = readings_key(day or timezone.localdate())
+    names = [CUSTOMERS, METERS, BILLED, DUE, UNPAID_BILLS, COLLECTED, today]
+    return today, StatCounter.objects.filter(name__in=names).values_list("name", "value")
+
+
+def dashboard_stats(day=None):
+    """The dashboard figures for ``day`` (default: today), in one query."""
+    today, counters = _dashboard_counters(day)
+    return _dashboard_figures(today, dict(counters))
+
+
+async def adashboard_stats(day=None):
+    """``dashboard_stats`` for async views."""
+    today, counters = _dashboard_counters(day)
+    return _dashboard_figures(today, {name: value async for name, value in counters})
+
+
+def _dashboard_figures(today, values):
+    return {
+        "total_customers": int(values.get(CUSTOMERS, 0)),
+        "total_meters": int(values.get(METERS, 0)),
+        "unpaid_bills": int(values.get(UNPAID_BILLS, 0)),
+        "total_billed": values.get(BILLED, ZERO),
+        "total_due": values.get(DUE, ZERO),
+        "total_collected": values.get(COLLECTED, ZERO),
+        "readings_today": int(values.get(today, 0)),
+    }
+
+
+def actual_stats():
+    """Every counter computed from the source tables."""
+    bills = Bill.objects.aggregate(
+        billed=Sum("amount_due"),
+        due=Sum("amount_due", filter=Q(is_paid=False)),
+        unpaid=Count("pk", filter=Q(is_paid=False)),
+    )
+    # SQLite sums decimals as floats; round large totals back to cents
+    stats = {
+        CUSTOMERS: Customer.objects.count(),
+        METERS: Meter.objects.count(),
+        BILLED: round(bills["billed"] or ZERO, 2),
+        DUE: round(bills["due"] or ZERO, 2),
+        UNPAID_BILLS: bills["unpaid"],
+        COLLECTED: round(Payment.objects.aggregate(total=Sum("amount"))["total"] or ZERO, 2),
+    }
+    for day, count in (
+        MeterReading.objects.values("reading_date")
+        .annotate(count=Count("pk"))
+        .values_list("reading_date", "count")
+    ):
+        stats[readings_key(day)] = count
+    return stats
+
+
+def recompute_stats(dry_run=False):
+    """
+    Rebuild the counters from the source tables.
+
+    Returns ``(name, stored, actual)`` for every counter that had drifted
+    (``stored`` is None for a missing counter). Unless ``dry_run`` is set the
+    counters are corrected.
+    """
+    actual = {name: Decimal(value) for name, value in actual_stats().items()}
+    stored = dict(StatCounter.objects.values_list("name", "value"))
+
+    drift = []
+    for name in sorted(actual.keys() | stored.keys()):
+        value = actual.get(name, ZERO)
+        if name not in stored:
+            if value:
+                drift.append((name, None, value))
+        elif stored[name] != value:
+            drift.append((name, stored[name], value))
+
+    if not dry_run and drift:
+        now = timezone.now()
+        with transaction.atomic():
+            # Per-day reading counters that dropped to zero are removed
+            StatCounter.objects.filter(
+                name__startswith=READINGS_PREFIX
+            ).exclude(name__in=actual).delete()
+            StatCounter.objects.bulk_create(
+                [
+                    StatCounter(name=name, value=value, updated_at=now)
+                    for name, _, value in drift
+                    if name in actual
+                ],
+                update_conflicts=True,
+                unique_fields=["name"],
+                update_fields=["value", "updated_at"],
+            )
+    return drift
+
+
+def bill_summary(bills):
+    """
+    Billed, paid and outstanding totals and paid/unpaid counts of ``bills``
+    in one query; each bill's payments are summed by a correlated subquery
+    so no rows are loaded into Python.
+    """
+    paid = (
+        Payment.objects.filter(bill=OuterRef("pk"))
+        .order_by()
+        .values("bill")
+        .annotate(total=Sum("amount"))
+        .values("total")
+    )
+    money = DecimalField(max_digits=16, decimal_places=2)
+    summary = bills.order_by().aggregate(
+        total_billed=Coalesce(Sum("amount_due"), ZERO, output_field=money),
+        total_paid=Coalesce(Sum(Subquery(paid, output_field=money)), ZERO, output_field=money),
+        count_paid=Count("pk", filter=Q(is_paid=True)),
+        count_unpaid=Count("pk", filter=Q(is_paid=False)),
+    )
+    for key in ("total_billed", "total_paid"):
+        summary[key] = summary[key].quantize(ZERO)
+    summary["outstanding"] = summary["total_billed"] - summary["total_paid"]
+    return summary
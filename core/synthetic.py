@@ -0,0 +1,206 @@
+"""
+Synthetic datasets for load testing.
+
+``generate_dataset`` creates customers and meters with ``bulk_create``, then
+feeds monthly readings through ``ingest_readings`` and payments through
+``record_payments``. The generated bills, ledgers, dashboard counters and
+rollups are therefore exactly what the bulk paths produce for real uploads.
+Consumption follows a per-household base use with a seasonal swing and noise.
+Most customers pay in full, some partially (the rest carries into the next
+bill) and some not at all. The same seed always gives the same dataset.
+"""
+import math
+import random
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching
+from .ingestion import ingest_readings
+from .models import Bill, Customer, CustomerLedger, Meter, Tariff, TariffBlock
+from .payments import record_payments
+from .rollups import bills_dirty
+from .stats import CUSTOMERS, METERS, apply_stat_deltas
+
+ZONES = ("North", "South", "East", "West", "Central")
+READING_DAYS = 28  # readings are spread over the first four weeks of a month
+DUE_DAYS = 14
+
+# Lifeline, normal and commercial blocks; the second tariff applies half way
+TARIFF_BANDS = (
+    ("Lifeline", Decimal("0.00"), Decimal("6.00"), Decimal("53.00")),
+    ("Normal", Decimal("6.00"), Decimal("60.00"), Decimal("87.50")),
+    ("Commercial", Decimal("60.00"), None, Decimal("112.25")),
+)
+STANDING_CHARGE = Decimal("150.00")
+TARIFF_INCREASE = Decimal("1.08")
+
+
+@dataclass
+class DatasetResult:
+    customers: int = 0
+    readings: int = 0
+    payments: int = 0
+    elapsed: float = 0.0
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def create_tariffs(start, months):
+    """A block tariff from ``start`` and a dearer one half way through the period."""
+    for offset, factor in ((0, Decimal("1")), (max(months // 2, 1), TARIFF_INCREASE)):
+        tariff = Tariff.objects.create(
+            effective_date=_add_months(start, offset),
+            rate_per_unit=TARIFF_BANDS[1][3] * factor,
+            standing_charge=STANDING_CHARGE,
+        )
+        TariffBlock.objects.bulk_create([
+            TariffBlock(
+                tariff=tariff, name=name, lower_bound=lower, upper_bound=upper,
+                rate_per_unit=(rate * factor).quantize(Decimal("0.01")),
+            )
+            for name, lower, upper, rate in TARIFF_BANDS
+        ])
+
+
+def generate_dataset(customers=1000, months=12, seed=42, prefix="SYN", start=None,
+                     batch_size=2000, progress=None):
+    """
+    Generate ``customers`` customers with ``months`` months of readings and
+    payments, ending with the current month. House numbers and meter serials
+    start with ``prefix``, which must not be in use yet. ``progress`` is
+    called as ``progress(month, months)`` after each month.
+    """
+    if Customer.objects.filter(house_number__startswith=f"{prefix}-").exists():
+        raise ValueError(f"customers with prefix {prefix!r} already exist")
+
+    rng = random.Random(seed)
+    result = DatasetResult()
+    started = time.perf_counter()
+    today = timezone.localdate()
+    start = start or _add_months(today.replace(day=1), 1 - months)
+    if not Tariff.objects.exists():
+        create_tariffs(start, months)
+
+    meters = _create_customers(customers, prefix, rng, batch_size)
+    result.customers = len(meters)
+
+    # Per meter: base monthly use, how the customer pays, meter reading so far
+    households = [
+        (
+            serial,
+            rng.lognormvariate(math.log(14), 0.6),
+            rng.choices(("full", "partial", "none"), weights=(70, 22, 8))[0],
+            Decimal(rng.randint(0, 500)),
+        )
+        for serial in meters
+    ]
+    reference = 0
+    for month in range(months):
+        first = _add_months(start, month)
+        if first > today:
+            break
+        # Consumption peaks in the dry season (February)
+        season = 1 + 0.3 * math.cos(2 * math.pi * (first.month - 2) / 12)
+
+        rows, days = [], {}
+        for line, (serial, base, behaviour, value) in enumerate(households):
+            day = first + timedelta(days=line % READING_DAYS)
+            if day > today:
+                continue
+            vacant = rng.random() < 0.02
+            used = 0 if vacant else max(base * season * rng.gauss(1, 0.15), 0)
+            value += Decimal(used).quantize(Decimal("0.01"))
+            households[line] = (serial, base, behaviour, value)
+            rows.append((line, serial, day, value))
+            days[line] = day
+
+        with transaction.atomic():
+            ingested = ingest_readings(
+                rows, due_days=DUE_DAYS, batch_size=batch_size, bill=True
+            )
+            reading_days = {ingested.ids[line]: day for line, day in days.items()}
+            _date_bills(reading_days)
+            result.readings += ingested.created
+
+            lines = {pk: line for line, pk in ingested.ids.items()}
+            payments = []
+            for bill_id, reading_id, amount_due in Bill.objects.filter(
+                reading_id__in=reading_days, amount_due__gt=0
+            ).order_by("pk").values_list("pk", "reading_id", "amount_due"):
+                behaviour = households[lines[reading_id]][2]
+                if behaviour == "none" or (behaviour == "partial" and rng.random() < 0.3):
+                    continue
+                if behaviour == "partial":
+                    amount_due = (amount_due * Decimal(rng.uniform(0.3, 0.9))).quantize(
+                        Decimal("0.01")
+                    )
+                paid_on = reading_days[reading_id] + timedelta(days=rng.randint(0, DUE_DAYS + 7))
+                if paid_on > today or amount_due <= 0:
+                    continue
+                reference += 1
+                payments.append(
+                    (reference, bill_id, amount_due, f"{prefix}-P{reference:08d}", paid_on)
+                )
+            for index in range(0, len(payments), batch_size):
+                result.payments += len(record_payments(payments[index:index + batch_size]).ids)
+
+        if progress:
+            progress(month + 1, months)
+
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def _create_customers(count, prefix, rng, batch_size):
+    """Create customers with their meters; returns the meter serials in order."""
+    customers = Customer.objects.bulk_create(
+        [
+            Customer(
+                name=f"Customer {n:06d}",
+                house_number=f"{prefix}-{n:06d}",
+                address=f"Plot {rng.randint(1, 999)}, {rng.choice(ZONES)} Estate",
+                phone_number=f"07{rng.randint(0, 99_999_999):08d}",
+                zone=rng.choice(ZONES),
+            )
+            for n in range(1, count + 1)
+        ],
+        batch_size=batch_size,
+    )
+    meters = Meter.objects.bulk_create(
+        [
+            Meter(customer=customer, serial_number=f"{prefix}-M{n:06d}")
+            for n, customer in enumerate(customers, start=1)
+        ],
+        batch_size=batch_size,
+    )
+    # bulk_create skips the receivers that create ledgers and count customers
+    CustomerLedger.objects.bulk_create(
+        [CustomerLedger(customer=customer) for customer in customers], batch_size=batch_size
+    )
+    apply_stat_deltas({CUSTOMERS: len(customers), METERS: len(meters)})
+    caching.invalidate(caching.CUSTOMERS, caching.METERS)
+    caching.invalidate_customers(customer.pk for customer in customers)
+    return [meter.serial_number for meter in meters]
+
+
+def _date_bills(reading_days):
+    """
+    Bills are issued on the day the reading is recorded; backdate the
+    generated ones to their reading date.
+    """
+    by_day = {}
+    for reading_id, day in reading_days.items():
+        by_day.setdefault(day, []).append(reading_id)
+    for day, reading_ids in by_day.items():
+        Bill.objects.filter(reading_id__in=reading_ids).update(
+            issue_date=day, due_date=day + timedelta(days=DUE_DAYS)
+        )
+    bills_dirty(Bill.objects.filter(reading_id__in=reading_days).values_list("pk", flat=True))
@@ -0,0 +1,114 @@
+"""
+Effective-dated tariff resolution.
+
+The tariff timeline is small and changes rarely, so it is loaded once into a
+sorted list and searched with ``bisect``: finding the tariff in force on a
+date is O(log n) and costs no query once the cache is warm. The ``Tariff``
+save/delete signals drop the copy and replace the shared ``tariffs`` version
+token (core.caching). Every lookup compares that token with the one its copy
+was loaded under, so other web and billing worker processes reload on their
+next lookup when they share the cache backend; a copy is also never kept
+longer than ``TARIFF_CACHE_SECONDS``.
+"""
+import time
+from collections import defaultdict
+from bisect import bisect_right
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .caching import invalidate, version
+from .models import Tariff
+
+TARIFFS = "tariffs"
+
+
+class TariffResolver:
+    """Sorted, in-memory copy of the tariff timeline."""
+
+    def __init__(self):
+        self._timeline = None  # (version, loaded_at, effective dates, tariffs)
+
+    def invalidate(self):
+        """Drop this copy and, through the shared version, every other process's."""
+        self._timeline = None
+        invalidate(TARIFFS)
+
+    def refresh(self):
+        """Drop this process's copy only; the next lookup reloads it."""
+        self._timeline = None
+
+    def _load(self):
+        max_age = getattr(settings, "TARIFF_CACHE_SECONDS", 300)
+        current = version(TARIFFS)
+        timeline = self._timeline
+        if (
+            timeline is None
+            or timeline[0] != current
+            or time.monotonic() - timeline[1] > max_age
+        ):
+            tariffs = list(
+                Tariff.objects.prefetch_related("blocks").order_by("effective_date", "pk")
+            )
+            timeline = (current, time.monotonic(), [t.effective_date for t in tariffs], tariffs)
+            self._timeline = timeline
+        return timeline[2], timeline[3]
+
+    @staticmethod
+    def _find(dates, tariffs, day):
+        if isinstance(day, datetime):
+            day = timezone.localdate(day) if timezone.is_aware(day) else day.date()
+        if not tariffs:
+            raise ValidationError("No tariff defined.")
+        index = bisect_right(dates, day) - 1
+        return tariffs[max(index, 0)]
+
+    def tariff_for(self, day):
+        """
+        Return the tariff in force on ``day``. Days before the first tariff
+        fall back to the earliest one.
+        """
+        return self._find(*self._load(), day)
+
+    def finder(self):
+        """``tariff_for`` over one copy of the timeline, for rating many readings."""
+        dates, tariffs = self._load()
+        return lambda day: self._find(dates, tariffs, day)
+
+    def latest(self):
+        _, tariffs = self._load()
+        if not tariffs:
+            raise ValidationError("No tariff defined.")
+        return tariffs[-1]
+
+
+tariff_resolver = TariffResolver()
+
+
+def tariff_for(day):
+    """Return the tariff in force on ``day``."""
+    return tariff_resolver.tariff_for(day)
+
+
+def rate_readings(readings, tariff=None):
+    """
+    Charges for ``(reading_date, units_consumed)`` pairs, in order. Readings
+    are grouped by the tariff in force on their date (or all rated at
+    ``tariff``) and each group is rated in a single vectorized pass.
+    """
+    if tariff is not None:
+        return tariff.charges_for([units for _, units in readings])
+
+    groups = defaultdict(list)
+    find = tariff_resolver.finder()  # one version check for the whole batch
+    for index, (reading_date, units) in enumerate(readings):
+        groups[find(reading_date)].append((index, units))
+
+    charges = [None] * sum(len(group) for group in groups.values())
+    for group_tariff, group in groups.items():
+        rated = group_tariff.charges_for([units for _, units in group])
+        for (index, _), charge in zip(group, rated):
+            charges[index] = charge
+    return charges
@@ -1,3 +1,1346 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import re
+import warnings
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from .api import idempotent
+from .benchmarks import BENCHMARKS, compare_results, run_benchmarks
+from .billing_cycle import plan_cycle, work_cycle
+from .consumption import _recompute_orm, _recompute_sql, _supports_update_from
+from .ingestion import ingest_readings
+from .jobs import claim_jobs, run_job, work
+from .ledger import rebuild_ledgers
+from .metrics import budget_for, registry
+from .models import (
+    Bill, BillingCycle, BillingJob, BillingShard, Customer, CustomerLedger, CustomerMonthRollup,
+    DailyRollup, Meter, MeterReading, MeterUsageMonth, Notification, Payment, Tariff, User,
+    ZoneMonthRollup,
+)
+from .notifications import Transport, dispatch, generate_reminders
+from .pagination import keyset_paginate
+from .rating import _fits_int64, _hundredths, _scaled_bands, charge_for, rate_cycle
+from .rerating import rerate_bills
+from .rollups import rebuild_rollups
+from .routers import ReplicaRouter, read_alias, use_replica
+from .search import matching_customers, prefix_filter
+from .statements import import_statement, parse_statement
+from .stats import bill_summary, dashboard_stats, recompute_stats
+from .synthetic import generate_dataset
+from .tariffs import TariffResolver, rate_readings
+from .usage import usage_series
+
+
+# -------------------------
+# Query plan helpers
+# -------------------------
+# A bare "SCAN core_bill" reads the whole table; "SCAN ... USING INDEX" walks
+# an index in order (and stops at the LIMIT), which is what pagination wants.
+SQLITE_TABLE_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+SQLITE_INDEX = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+
+def _seq_scans(node):
+    if node.get("Node Type") == "Seq Scan":
+        yield node["Relation Name"]
+    for child in node.get("Plans", []):
+        yield from _seq_scans(child)
+
+
+def _index_scans(node):
+    if "Index Name" in node:
+        yield node["Index Name"]
+    for child in node.get("Plans", []):
+        yield from _index_scans(child)
+
+
+def _postgresql_plan(cursor, sql, params=()):
+    # Test tables are tiny; make the planner pick an index whenever one applies
+    cursor.execute("SET LOCAL enable_seqscan = off")
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def full_table_scans(sql):
+    """Names of the tables ``sql`` reads with a full table scan."""
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            return {
+                match.group(1)
+                for *_, detail in cursor.fetchall()
+                if (match := SQLITE_TABLE_SCAN.match(detail))
+            }
+        if connection.vendor == "postgresql":
+            return set(_seq_scans(_postgresql_plan(cursor, sql)))
+    return set()
+
+
+def plan_indexes(queryset):
+    """Names of the indexes the plan of ``queryset`` reads."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return {
+                match.group(1)
+                for *_, detail in cursor.fetchall()
+                for match in SQLITE_INDEX.finditer(detail)
+            }
+        if connection.vendor == "postgresql":
+            return set(_index_scans(_postgresql_plan(cursor, sql, params)))
+    return set()
+
+
+# -------------------------
+# Query plan regression tests
+# -------------------------
+class QueryPlanTests(TestCase):
+    """The queries behind the hot views must be served by indexes."""
+
+    # Whole-table aggregates with no WHERE clause, where a scan is the plan
+    ALLOWED_SCANS = {
+        "dashboard": set(),  # reads core.stats counters
+        "billing_list": {
+            "core_bill",  # total billed when no filter is applied
+        },
+        # All-time totals read the (small) rollup tables, never the source tables
+        "reports_analysis": {
+            "core_dailyrollup", "core_zonemonthrollup", "core_customermonthrollup",
+        },
+        "payments_list": set(),
+        "autocomplete": set(),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("clerk", password="secret")
+        Tariff.objects.create(rate_per_unit=Decimal("2.50"), effective_date=date(2024, 1, 1))
+        for i in range(5):
+            customer = Customer.objects.create(
+                name=f"Customer {i}", house_number=f"H{i}", address="Main Street"
+            )
+            meter = Meter.objects.create(customer=customer, serial_number=f"SN{i}")
+            for month in (1, 2, 3):
+                MeterReading.objects.create(
+                    meter=meter, reading_date=date(2024, month, 1), value=Decimal(10 * month)
+                )
+        for i, bill in enumerate(Bill.objects.all()[:4]):
+            Payment.objects.create(bill=bill, amount=Decimal("5.00"), reference_number=f"REF{i}")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def assertNoFullTableScans(self, view, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        selects = [q["sql"] for q in queries if q["sql"].lstrip().upper().startswith("SELECT")]
+        self.assertTrue(selects)
+        allowed = self.ALLOWED_SCANS[view]
+        for sql in selects:
+            with self.subTest(sql=sql):
+                self.assertLessEqual(full_table_scans(sql), allowed)
+
+    def test_dashboard(self):
+        self.assertNoFullTableScans("dashboard", reverse("dashboard"))
+
+    def test_billing_list(self):
+        self.assertNoFullTableScans("billing_list", reverse("billing_list"))
+
+    def test_billing_list_filtered(self):
+        url = reverse("billing_list") + "?status=unpaid&start_date=2020-01-01&end_date=2030-12-31"
+        self.assertNoFullTableScans("billing_list", url)
+
+    def test_billing_list_search(self):
+        url = reverse("billing_list") + "?search=Customer+1&start_date=2020-01-01"
+        self.assertNoFullTableScans("billing_list", url)
+
+    def test_reports_analysis(self):
+        self.assertNoFullTableScans("reports_analysis", reverse("reports_analysis"))
+
+    def test_payments_list(self):
+        self.assertNoFullTableScans("payments_list", reverse("payments_list"))
+
+    def test_autocomplete(self):
+        for name in ("customers", "meters", "readings", "bills"):
+            for query in ("", "?q=customer", "?q=sn1", "?q=h"):
+                url = reverse(f"autocomplete_{name}") + query
+                self.assertNoFullTableScans("autocomplete", url)
+
+    def test_hot_lookups_keep_their_indexes(self):
+        customers = Customer.objects.all()
+        for index, queryset in (
+            ("bill_issue_date_id_idx", Bill.objects.order_by("-issue_date", "-id")[:20]),
+            ("payment_date_id_idx", Payment.objects.order_by("-payment_date", "-id")[:20]),
+            ("reading_date_idx", MeterReading.objects.filter(reading_date__gte=date(2024, 2, 1))),
+            ("customer_name_idx", customers.order_by("name")[:20]),
+            ("customer_name_lower_idx", prefix_filter(customers, "name", "cust")),
+            ("customer_house_lower_idx", prefix_filter(customers, "house_number", "h")),
+            ("meter_serial_lower_idx", prefix_filter(Meter.objects.all(), "serial_number", "sn")),
+        ):
+            with self.subTest(index=index):
+                self.assertIn(index, plan_indexes(queryset))
+
+    def test_bill_summary_is_one_query(self):
+        bills = Bill.objects.filter(is_paid=False)
+        with self.assertNumQueries(1):
+            summary = bill_summary(bills)
+        paid = sum(payment.amount for bill in bills for payment in bill.payments.all())
+        self.assertEqual(summary["total_paid"], paid)
+        self.assertEqual(summary["total_billed"], sum(bill.amount_due for bill in bills))
+        self.assertEqual(summary["count_unpaid"], bills.count())
+        self.assertEqual(summary["count_paid"], 0)
+
+    def test_deep_pages(self):
+        for view, model, keys in (
+            ("billing_list", Bill, ("issue_date", "id")),
+            ("payments_list", Payment, ("payment_date", "id")),
+        ):
+            page = keyset_paginate(model.objects.all(), keys, per_page=2)
+            url = f"{reverse(view)}?per_page=2&cursor={page.next_cursor}"
+            self.assertNoFullTableScans(view, url)
+
+
+# -------------------------
+# Query budget tests
+# -------------------------
+class QueryBudgetMixin:
+    """``assertWithinQueryBudget`` fails a view that runs more queries than it declares."""
+
+    def assertWithinQueryBudget(self, url, method="get"):
+        match = resolve(url.split("?")[0])
+        budget = budget_for(match.func, method.upper())
+        self.assertIsNotNone(budget, f"{match.view_name} declares no query budget")
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url)
+        self.assertLess(response.status_code, 400)
+        self.assertLessEqual(
+            len(queries), budget,
+            f"{match.view_name} ran {len(queries)} queries (budget {budget}):\n"
+            + "\n".join(query["sql"] for query in queries),
+        )
+        return response
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Budgets hold with many rows, so an N+1 anywhere on a page fails."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("clerk", password="secret", is_staff=True)
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        for i in range(8):
+            customer = Customer.objects.create(name=f"C{i}", house_number=f"H{i}", address="x")
+            meter = Meter.objects.create(customer=customer, serial_number=f"M{i}")
+            for month in (1, 2):
+                reading = MeterReading.objects.create(
+                    meter=meter, reading_date=date(2024, month, 1), value=10 * month
+                )
+                Payment.objects.create(
+                    bill=reading.bill, amount=Decimal("1.00"), reference_number=f"R{i}-{month}"
+                )
+        cls.customer = Customer.objects.first()
+        cls.bill = Bill.objects.first()
+        cls.payment = Payment.objects.first()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_views_stay_within_budget(self):
+        meter = self.customer.meter
+        for url in (
+            reverse("dashboard"),
+            reverse("customers"),
+            reverse("customer_detail", args=[self.customer.pk]),
+            reverse("customer_edit", args=[self.customer.pk]),
+            reverse("meters"),
+            reverse("water_management"),
+            reverse("meter_add"),
+            reverse("meter_detail", args=[meter.pk]),
+            reverse("meter_edit", args=[meter.pk]),
+            reverse("add_meter_reading"),
+            reverse("bill_add"),
+            reverse("bill_edit", args=[self.bill.pk]),
+            reverse("payment_add"),
+            reverse("payment_edit", args=[self.payment.pk]),
+            reverse("billing_list"),
+            reverse("payments_list"),
+            reverse("reports_analysis"),
+            reverse("api_bills"),
+            reverse("api_payments"),
+            reverse("autocomplete_meters") + "?q=h1",
+            reverse("autocomplete_bills") + "?q=1",
+            reverse("api_live_dashboard"),
+            reverse("api_live_customer", args=[self.customer.pk]),
+            reverse("api_live_meter_readings", args=[meter.pk]),
+            reverse("api_live_bill", args=[self.bill.pk]),
+        ):
+            with self.subTest(url=url):
+                self.assertWithinQueryBudget(url)
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse("customers"))
+        body = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn('water_view_requests_total{view="customers",method="GET",status="200"}', body)
+        self.assertIn('water_view_queries_total{view="customers"}', body)
+
+
+class LiveApiTests(TestCase):
+    """The polled endpoints answer 304 until their data changes, also when served async."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("wall", password="secret")
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        customer = Customer.objects.create(name="Ann", house_number="A1", address="x")
+        meter = Meter.objects.create(customer=customer, serial_number="M1")
+        cls.reading = MeterReading.objects.create(
+            meter=meter, reading_date=date(2024, 1, 1), value=Decimal("10")
+        )
+
+    async def test_etag_and_async_metrics(self):
+        await self.async_client.aforce_login(self.user)
+        bill = await Bill.objects.aget(reading=self.reading)
+        url = reverse("api_live_bill", args=[bill.pk])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.json()["outstanding"], "20.00")
+        etag = response["ETag"]
+
+        cached = await self.async_client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b"")
+
+        await Payment.objects.acreate(bill=bill, amount=Decimal("5.00"), reference_number="P1")
+        changed = await self.async_client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()["paid"], "5.00")
+        # Queries of the async ORM are counted by the metrics middleware (the
+        # user and the bill; the session comes from the cache)
+        self.assertEqual(registry.totals["api_live_bill"]["max_queries"], 2)
+
+        missing = await self.async_client.get(reverse("api_live_customer", args=[0]))
+        self.assertEqual(missing.status_code, 404)
+
+
+class PageCacheTests(TestCase):
+    """Warm pages only look the user up, and every write path invalidates them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("clerk", password="secret")
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        cls.customer = Customer.objects.create(name="Ann", house_number="A1", address="x")
+        meter = Meter.objects.create(customer=cls.customer, serial_number="M1")
+        MeterReading.objects.create(meter=meter, reading_date=date(2024, 1, 1), value=10)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def page(self, name, *args):
+        return self.client.get(reverse(name, args=args)).content.decode()
+
+    def test_warm_pages_and_invalidation(self):
+        detail = ("customer_detail", self.customer.pk)
+        hits = registry.cache["customer_detail"][0]
+        for view in (("customers",), ("meters",), ("water_management",), detail):
+            self.page(*view)
+            with self.subTest(view=view[0]), self.assertNumQueries(1):  # the user
+                self.page(*view)
+        self.assertEqual(registry.cache["customer_detail"][0], hits + 1)
+
+        self.customer.name = "Ann Otieno"
+        self.customer.save()
+        self.assertIn("Ann Otieno", self.page("customers"))
+        self.assertIn("Ann Otieno", self.page("meters"))
+
+        bill = self.customer.bills.get()
+        Payment.objects.create(bill=bill, amount=Decimal("5.00"), reference_number="P1")
+        self.assertIn("Payment ID:", self.page(*detail))
+
+        # Bulk ingestion skips the signals; its rollup keys invalidate the customer
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_readings([(1, "M1", date(2024, 2, 1), Decimal("25"))])
+        self.assertIn("Feb. 1, 2024", self.page("water_management"))
+        self.assertEqual(self.page(*detail).count("Bill #"), 2)
+
+
+class AutocompleteTests(TestCase):
+    """Form selects render only the chosen option; the rest come from the search endpoints."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("clerk", password="secret")
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        for name, house in (("Ann Otieno", "B-12"), ("Anna Wanjiru", "B-7"), ("Brian", "C-1")):
+            customer = Customer.objects.create(name=name, house_number=house, address="x")
+            meter = Meter.objects.create(customer=customer, serial_number=f"SN-{house}")
+            MeterReading.objects.create(meter=meter, reading_date=date(2024, 1, 1), value=10)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def search(self, name, q):
+        response = self.client.get(reverse(f"autocomplete_{name}"), {"q": q})
+        return [row["text"] for row in response.json()["results"]]
+
+    def test_prefix_search(self):
+        self.assertEqual(
+            self.search("customers", "ann"), ["Ann Otieno (B-12)", "Anna Wanjiru (B-7)"]
+        )
+        self.assertEqual(self.search("customers", "b-1"), ["Ann Otieno (B-12)"])
+        self.assertEqual(self.search("customers", "ot"), [])  # short terms match prefixes
+        self.assertEqual(self.search("meters", "sn-c"), ["Meter SN-C-1 - Brian"])
+        self.assertEqual(len(self.search("readings", "an")), 2)
+        bill = Bill.objects.get(customer__name="Brian")
+        self.assertEqual(self.search("bills", f"#{bill.pk}")[0], str(bill))
+
+    def test_substring_search(self):
+        self.assertEqual(self.search("customers", "tieno"), ["Ann Otieno (B-12)"])
+        self.assertEqual(self.search("customers", "wanjiru ann"), ["Anna Wanjiru (B-7)"])
+        # Words too short for trigrams narrow the match instead of being dropped
+        self.assertEqual(self.search("customers", "ann o"), ["Ann Otieno (B-12)"])
+        self.assertEqual(
+            list(matching_customers("anna w")), [Customer.objects.get(house_number="B-7")]
+        )
+        self.assertEqual(self.search("meters", "c-1"), ["Meter SN-C-1 - Brian"])
+        # The index follows changes to customers and meters, bulk ones included
+        Customer.objects.filter(name="Brian").update(phone_number="0722123456")
+        Meter.objects.filter(serial_number="SN-B-7").update(serial_number="XY-990")
+        self.assertEqual(self.search("customers", "2123"), ["Brian (C-1)"])
+        self.assertEqual(self.search("customers", "y-99"), ["Anna Wanjiru (B-7)"])
+        self.assertEqual(matching_customers("SN-B-7").count(), 0)
+        response = self.client.get(reverse("billing_list"), {"search": "tieno"})
+        self.assertEqual(
+            [bill.customer.name for bill in response.context["page_obj"]], ["Ann Otieno"]
+        )
+
+    def test_select_renders_only_the_chosen_option(self):
+        bill = Bill.objects.get(customer__name="Brian")
+        html = self.client.get(reverse("bill_edit", args=[bill.pk])).content.decode()
+        self.assertIn('data-autocomplete-url="/api/autocomplete/readings/"', html)
+        self.assertIn(f'<option value="{bill.reading_id}" selected>', html)
+        self.assertNotIn("Ann Otieno", html)
+        self.assertIn("core/js/autocomplete.js", html)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    """Only reads that opt in go to the replica, and only when there is one."""
+
+    def test_routing(self):
+        router = ReplicaRouter()
+        with use_replica():
+            self.assertIsNone(router.db_for_read(Bill))
+        self.assertEqual(read_alias(), "default")
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # overriding DATABASES warns
+            with self.settings(DATABASES={**settings.DATABASES, "replica": {}}):
+                self.assertIsNone(router.db_for_read(Bill))
+                with use_replica():
+                    self.assertEqual(router.db_for_read(Bill), "replica")
+                    self.assertEqual(router.db_for_write(Bill), "default")
+                self.assertFalse(router.allow_migrate("replica", "core"))
+
+
+# -------------------------
+# Rating tests
+# -------------------------
+def decimal_charge(units, bands, standing_charge):
+    """Reference charge, computed on Decimals with Python's round()."""
+    total = Decimal(0)
+    for lower, upper, rate in bands:
+        width = (units if upper is None else min(units, upper)) - lower
+        if width > 0:
+            total += width * rate
+    return round(total, 2) + standing_charge
+
+
+class RatingTests(SimpleTestCase):
+    """Integer rating must round exactly like round() on Decimals."""
+
+    bands = [
+        (Decimal("0"), Decimal("10.00"), Decimal("0.10")),
+        (Decimal("10.00"), Decimal("30.00"), Decimal("0.35")),
+        (Decimal("30.00"), None, Decimal("1.25")),
+    ]
+    standing = Decimal("1.50")
+
+    def check(self, units):
+        expected = [decimal_charge(u, self.bands, self.standing) for u in units]
+        self.assertEqual([charge_for(u, self.bands, self.standing) for u in units], expected)
+        self.assertEqual(rate_cycle(units, self.bands, self.standing), expected)
+        with mock.patch("core.rating.np", None):
+            self.assertEqual(rate_cycle(units, self.bands, self.standing), expected)
+
+    def test_half_even_rounding(self):
+        # Steps of 0.05 units at 0.10 land on exact half cents in the first band
+        self.check([Decimal(n).scaleb(-2) for n in range(0, 4000, 5)])
+
+    def test_int64_overflow_falls_back_to_python_integers(self):
+        units = [Decimal("12.34"), Decimal("9" * 15 + ".99")]
+        self.assertFalse(_fits_int64([_hundredths(u) for u in units], _scaled_bands(self.bands)))
+        self.check(units)
+
+    def test_benchmark_rating_cross_checks(self):
+        out = io.StringIO()
+        call_command("benchmark_rating", readings=2000, check=500, stdout=out)
+        self.assertIn("Charges match Decimal rounding.", out.getvalue())
+
+
+# -------------------------
+# Ingestion tests
+# -------------------------
+class IngestionTests(TestCase):
+    """A batch must produce the readings and bills of saving its rows one by one."""
+
+    def setUp(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        Tariff.objects.create(rate_per_unit=Decimal("3.00"), effective_date=date(2024, 4, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            for side in "AB":
+                for n in (1, 2):
+                    customer = Customer.objects.create(
+                        name=f"{side}{n}", house_number=f"{side}{n}", address="x"
+                    )
+                    Meter.objects.create(customer=customer, serial_number=f"{side}-M{n}")
+                meter = Meter.objects.get(serial_number=f"{side}-M1")
+                for day, value in ((date(2024, 1, 1), 10), (date(2024, 3, 1), 30)):
+                    MeterReading.objects.create(meter=meter, reading_date=day, value=value)
+                first = Bill.objects.get(reading__meter=meter, reading__reading_date__month=1)
+                Payment.objects.create(bill=first, amount=first.amount_due, reference_number=side)
+
+    def rows(self, side):
+        return [
+            (1, f"{side}-M1", date(2024, 2, 1), "18"),  # backdated
+            (2, f"{side}-M1", date(2024, 3, 1), "31"),  # already stored
+            (3, f"{side}-M1", date(2024, 4, 1), "41"),
+            (4, f"{side}-M1", date(2024, 4, 1), "45"),  # duplicate in the batch
+            (5, f"{side}-M1", date(2024, 5, 1), "44"),
+            (6, f"{side}-M2", date(2024, 3, 15), "7"),  # first reading
+            (7, f"{side}-M2", date(2024, 4, 15), "9"),
+        ]
+
+    def bills(self, side):
+        return list(
+            Bill.objects.filter(customer__name__startswith=side)
+            .order_by("reading__meter__serial_number", "reading__reading_date")
+            .values_list(
+                "reading__reading_date", "reading__units_consumed",
+                "charge", "amount_due", "is_paid",
+            )
+        )
+
+    def test_batch_matches_per_row_saves(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            result = ingest_readings(self.rows("A"))
+        self.assertEqual(result.created, 5)
+        self.assertEqual([line for line, _ in result.errors], [2, 4])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for _, serial_number, reading_date, value in self.rows("B"):
+                meter = Meter.objects.get(serial_number=serial_number)
+                if not meter.readings.filter(reading_date=reading_date).exists():
+                    MeterReading.objects.create(
+                        meter=meter, reading_date=reading_date, value=Decimal(value)
+                    )
+
+        self.assertEqual(len(self.bills("A")), 7)
+        self.assertEqual(self.bills("A"), self.bills("B"))
+        self.assertEqual(rebuild_ledgers(dry_run=True), [])
+        self.assertEqual(recompute_stats(dry_run=True), [])
+
+
+# -------------------------
+# Consumption tests
+# -------------------------
+class ConsumptionTests(TestCase):
+    """The UPDATE ... FROM statement must agree with the portable fallback."""
+
+    def test_update_from_matches_orm_after_backdated_insert(self):
+        customer = Customer.objects.create(name="Ann", house_number="A1", address="x")
+        first = Meter.objects.create(customer=customer, serial_number="M1")
+        other = Customer.objects.create(name="Ben", house_number="B1", address="x")
+        second = Meter.objects.create(customer=other, serial_number="M2")
+        MeterReading.objects.bulk_create([
+            MeterReading(meter=first, reading_date=date(2024, 1, 1), value=10, units_consumed=99),
+            MeterReading(meter=first, reading_date=date(2024, 3, 1), value=30, units_consumed=20),
+            MeterReading(meter=first, reading_date=date(2024, 4, 1), value=25, units_consumed=0),
+            MeterReading(meter=second, reading_date=date(2024, 2, 1), value=9, units_consumed=9),
+            # Backdated, written without its signals
+            MeterReading(meter=first, reading_date=date(2024, 2, 1), value=Decimal("17.5")),
+        ])
+        if not _supports_update_from():
+            self.skipTest("UPDATE ... FROM is not available")
+
+        def run(recompute):
+            with transaction.atomic():
+                changed = recompute([first.pk, second.pk], date(2024, 2, 1), None)
+                units = list(
+                    MeterReading.objects.order_by("meter_id", "reading_date")
+                    .values_list("units_consumed", flat=True)
+                )
+                transaction.set_rollback(True)
+            return sorted(changed), units
+
+        changed, units = run(_recompute_sql)
+        self.assertEqual((changed, units), run(_recompute_orm))
+        self.assertEqual(len(changed), 2)
+        # The reading before the start date keeps its (wrong) value
+        self.assertEqual(units, [Decimal(n) for n in ("99", "7.5", "12.5", "0", "9")])
+
+
+# -------------------------
+# Ledger tests
+# -------------------------
+class LedgerTests(TestCase):
+    """Ledgers follow bills and payments; reconcile_balances repairs drifted ones."""
+
+    def test_ledger_follows_bills_and_payments(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            customer = Customer.objects.create(name="Ann", house_number="A1", address="x")
+            meter = Meter.objects.create(customer=customer, serial_number="M1")
+            reading = MeterReading.objects.create(
+                meter=meter, reading_date=date(2024, 1, 1), value=10
+            )
+            payment = Payment.objects.create(
+                bill=reading.bill, amount=Decimal("5.00"), reference_number="P1"
+            )
+            payment.amount = Decimal("8.00")
+            payment.save()
+            Payment.objects.create(
+                bill=reading.bill, amount=Decimal("2.00"), reference_number="P2"
+            ).delete()
+        ledger = CustomerLedger.objects.get(customer=customer)
+        self.assertEqual(ledger.total_billed, Decimal("20.00"))
+        self.assertEqual(ledger.total_paid, Decimal("8.00"))
+        self.assertEqual(Customer.objects.get().balance, Decimal("12.00"))
+        self.assertEqual(rebuild_ledgers(dry_run=True), [])
+
+    def test_reconcile_balances_repairs_drift(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in (1, 2, 3):
+                customer = Customer.objects.create(name=f"C{n}", house_number=f"H{n}", address="x")
+                meter = Meter.objects.create(customer=customer, serial_number=f"M{n}")
+                reading = MeterReading.objects.create(
+                    meter=meter, reading_date=date(2024, 1, 1), value=10 * n
+                )
+            Payment.objects.create(bill=reading.bill, amount=Decimal("5.00"), reference_number="P")
+        first, second, third = Customer.objects.order_by("pk")
+        CustomerLedger.objects.filter(customer=first).update(total_paid=Decimal("7.00"))
+        CustomerLedger.objects.filter(customer=second).delete()
+
+        out = io.StringIO()
+        call_command("reconcile_balances", dry_run=True, stdout=out)
+        self.assertIn(f"customer {first.pk}: ledger 13.00, actual 20.00", out.getvalue())
+        self.assertIn(f"customer {second.pk}: ledger missing, actual 40.00", out.getvalue())
+        self.assertIn("2 ledger(s) have drifted", out.getvalue())
+        self.assertEqual(len(rebuild_ledgers(dry_run=True)), 2)  # dry run changed nothing
+
+        call_command("reconcile_balances", stdout=out)
+        self.assertIn("Corrected 2 ledger(s)", out.getvalue())
+        self.assertEqual(rebuild_ledgers(dry_run=True), [])
+        self.assertEqual(
+            [customer.balance for customer in (first, second, third)],
+            [Decimal("20.00"), Decimal("40.00"), Decimal("55.00")],
+        )
+
+
+# -------------------------
+# Re-rating tests
+# -------------------------
+class RerateTests(TestCase):
+    """A tariff change moves unpaid bills by their charge difference only."""
+
+    def setUp(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in (1, 2, 3):
+                customer = Customer.objects.create(name=f"C{n}", house_number=f"H{n}", address="x")
+                meter = Meter.objects.create(customer=customer, serial_number=f"M{n}")
+                reading = MeterReading.objects.create(
+                    meter=meter, reading_date=date(2024, 2, 1), value=10 * n
+                )
+            Payment.objects.create(bill=reading.bill, amount=Decimal("60.00"), reference_number="P")
+
+    def bills(self):
+        return list(Bill.objects.order_by("pk").values_list("charge", "amount_due", "is_paid"))
+
+    def test_tariff_change_rerates_unpaid_bills(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Tariff.objects.create(rate_per_unit=Decimal("3.00"), effective_date=date(2024, 1, 15))
+        self.assertEqual(self.bills(), [
+            (Decimal("30.00"), Decimal("30.00"), False),
+            (Decimal("60.00"), Decimal("60.00"), False),
+            (Decimal("60.00"), Decimal("60.00"), True),  # paid bills keep their charge
+        ])
+        self.assertEqual(rebuild_ledgers(dry_run=True), [])
+
+    def test_dry_run_reports_in_chunks(self):
+        [tariff] = Tariff.objects.bulk_create([
+            Tariff(rate_per_unit=Decimal("2.50"), effective_date=date(2024, 1, 15))
+        ])
+        before = self.bills()
+        progress = []
+        result = rerate_bills(
+            tariff=tariff, dry_run=True, chunk_size=1,
+            progress=lambda done, total: progress.append((done, total)),
+        )
+        self.assertEqual((result.bills, result.changed), (2, 2))
+        self.assertEqual(result.revenue_delta, Decimal("15.00"))
+        self.assertEqual(progress, [(1, 2), (2, 2)])
+        self.assertEqual(self.bills(), before)
+
+
+# -------------------------
+# Export tests
+# -------------------------
+class ExportTests(TestCase):
+    """Exports are streamed from the views and from export_data."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("clerk", password="secret")
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        for n in (1, 2, 3):
+            customer = Customer.objects.create(name=f"C{n}", house_number=f"H{n}", address="x")
+            meter = Meter.objects.create(customer=customer, serial_number=f"M{n}")
+            MeterReading.objects.create(meter=meter, reading_date=date(2024, 1, n), value=n)
+
+    def test_csv_is_streamed(self):
+        self.client.force_login(self.user)
+        with mock.patch("core.exports.FLUSH_SIZE", 1):
+            response = self.client.get(reverse("export_data", args=["bills"]))
+            blocks = list(response.streaming_content)
+        self.assertEqual(len(blocks), 4)  # the header, then every row as it is read
+        self.assertTrue(blocks[0].startswith(b"Bill,Customer,"))
+        self.assertIn('filename="bills-', response["Content-Disposition"])
+
+        out = io.StringIO()
+        call_command("export_data", "bills", status="unpaid", stdout=out)
+        self.assertEqual(out.getvalue(), b"".join(blocks).decode())
+
+    def test_unknown_format_is_rejected(self):
+        self.client.force_login(self.user)
+        url = reverse("export_data", args=["bills"])
+        response = self.client.get(url, {"format": 'csv"\r\nSet-Cookie: x=1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("Content-Disposition", response)
+
+
+# -------------------------
+# Dashboard statistics tests
+# -------------------------
+class DashboardStatsTests(TestCase):
+    """Signal deltas must keep the counters equal to a full recompute."""
+
+    def setUp(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        self.customer = Customer.objects.create(name="Ann", house_number="A1", address="x")
+        self.meter = Meter.objects.create(customer=self.customer, serial_number="M1")
+        self.first = MeterReading.objects.create(
+            meter=self.meter, reading_date=date(2024, 1, 1), value=Decimal("10")
+        )
+        self.second = MeterReading.objects.create(
+            meter=self.meter, reading_date=date(2024, 2, 1), value=Decimal("25")
+        )
+
+    def assertNoDrift(self):
+        self.assertEqual(recompute_stats(dry_run=True), [])
+
+    def test_counters_follow_changes(self):
+        stats = dashboard_stats(date(2024, 2, 1))
+        self.assertEqual(stats["total_customers"], 1)
+        self.assertEqual(stats["readings_today"], 1)
+        self.assertEqual(stats["unpaid_bills"], 2)
+        self.assertNoDrift()
+
+        payment = Payment.objects.create(
+            bill=self.first.bill, amount=Decimal("20.00"), reference_number="P1"
+        )
+        self.assertNoDrift()
+        payment.amount = Decimal("5.00")
+        payment.save()
+        self.assertNoDrift()
+
+        self.second.reading_date = date(2024, 3, 1)
+        self.second.value = Decimal("40")
+        self.second.save()
+        self.assertNoDrift()
+
+        Tariff.objects.create(rate_per_unit=Decimal("3.00"), effective_date=date(2024, 2, 15))
+        rerate_bills()
+        self.assertNoDrift()
+
+        self.first.delete()
+        self.customer.delete()
+        self.assertNoDrift()
+        self.assertEqual(dashboard_stats()["total_customers"], 0)
+
+    def updated_counters(self, queries):
+        return [
+            re.search(r"WHERE .*\"name\" = '([^']+)'", query["sql"]).group(1)
+            for query in queries
+            if query["sql"].startswith('UPDATE "core_statcounter"')
+        ]
+
+    def test_counters_are_locked_in_name_order(self):
+        with CaptureQueriesContext(connection) as queries:
+            MeterReading.objects.create(
+                meter=self.meter, reading_date=date(2024, 3, 1), value=Decimal("30")
+            )
+        # A missing counter is updated again once created
+        names = self.updated_counters(queries)
+        self.assertEqual(names, sorted(names))
+        self.assertIn("readings:2024-03-01", names)
+
+        other = Customer.objects.create(name="Bob", house_number="B1", address="y")
+        Meter.objects.create(customer=other, serial_number="M2")
+        with CaptureQueriesContext(connection) as queries:
+            ingest_readings(
+                [(1, "M2", date(2024, 4, 1), "35"), (2, "M2", date(2024, 5, 1), "40")], bill=True
+            )
+        names = self.updated_counters(queries)
+        self.assertEqual(names, sorted(names))
+        self.assertIn("readings:2024-05-01", names)
+        self.assertIn("unpaid_bills", names)
+        self.assertNoDrift()
+
+    def test_recompute_corrects_drift(self):
+        Bill.objects.update(amount_due=Decimal("0.00"))
+        drift = recompute_stats()
+        self.assertEqual({name for name, _, _ in drift}, {"billed", "due"})
+        self.assertNoDrift()
+
+
+# -------------------------
+# Keyset pagination tests
+# -------------------------
+class KeysetPaginationTests(TestCase):
+    """Walking the cursors must visit every row once, in order, both ways."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Tariff.objects.create(rate_per_unit=Decimal("1.00"), effective_date=date(2024, 1, 1))
+        for i in range(7):
+            customer = Customer.objects.create(
+                name=f"Customer {i % 3}", house_number=f"H{i}", address="x"
+            )
+            meter = Meter.objects.create(customer=customer, serial_number=f"SN{i}")
+            for month in (1, 2, 3):
+                MeterReading.objects.create(
+                    meter=meter, reading_date=date(2024, month, 1), value=Decimal(10 * month)
+                )
+        # Plenty of ties on the leading key
+        Bill.objects.filter(pk__lte=10).update(issue_date=date(2024, 1, 1))
+
+    def walk(self, queryset, keys, descending):
+        pages, page = [], keyset_paginate(queryset, keys, per_page=4, descending=descending)
+        pages.append([row.pk for row in page])
+        while page.has_next:
+            page = keyset_paginate(queryset, keys, page.next_cursor, 4, descending=descending)
+            pages.append([row.pk for row in page])
+
+        backwards = []
+        while page.has_previous:
+            page = keyset_paginate(queryset, keys, page.previous_cursor, 4, descending=descending)
+            backwards.append([row.pk for row in page])
+        return pages, backwards
+
+    def test_descending(self):
+        pages, backwards = self.walk(Bill.objects.all(), ("issue_date", "id"), True)
+        expected = list(Bill.objects.order_by("-issue_date", "-id").values_list("pk", flat=True))
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual(backwards, pages[-2::-1])
+
+    def test_ascending(self):
+        pages, backwards = self.walk(Customer.objects.all(), ("name", "id"), False)
+        expected = list(Customer.objects.order_by("name", "id").values_list("pk", flat=True))
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual(backwards, pages[-2::-1])
+
+
+# -------------------------
+# Billing job queue tests
+# -------------------------
+@override_settings(BILLING_ASYNC=True)
+class BillingJobTests(TestCase):
+    """Queued billing work must end up where the inline path would."""
+
+    def setUp(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        customer = Customer.objects.create(name="Ann", house_number="A1", address="x")
+        self.meter = Meter.objects.create(customer=customer, serial_number="M1")
+
+    def test_jobs_are_deduplicated_and_processed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            reading = MeterReading.objects.create(
+                meter=self.meter, reading_date=date(2024, 1, 1), value=Decimal("10")
+            )
+            reading.value = Decimal("12")
+            reading.save()
+        self.assertFalse(Bill.objects.exists())
+        self.assertEqual(BillingJob.objects.filter(status=BillingJob.PENDING).count(), 1)
+
+        self.assertEqual(work(once=True), (1, 0))
+        bill = Bill.objects.get(reading=reading)
+        self.assertEqual(bill.charge, Decimal("24.00"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Payment.objects.create(bill=bill, amount=Decimal("24.00"), reference_number="P1")
+        work(once=True)
+        bill.refresh_from_db()
+        self.assertTrue(bill.is_paid)
+
+    def test_rerate_job_reloads_the_tariffs(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            reading = MeterReading.objects.create(
+                meter=self.meter, reading_date=date(2024, 1, 1), value=Decimal("12")
+            )
+        work(once=True)
+        # Changed behind this process's back: no signal, no shared invalidation
+        Tariff.objects.update(rate_per_unit=Decimal("3.00"))
+        BillingJob.objects.create(kind=BillingJob.RERATE)
+        work(once=True)
+        self.assertEqual(Bill.objects.get(reading=reading).charge, Decimal("36.00"))
+
+    def test_failed_jobs_are_retried(self):
+        job = BillingJob.objects.create(kind="unknown")
+        [claimed] = claim_jobs("test-worker")
+        self.assertFalse(run_job(claimed))
+        job.refresh_from_db()
+        self.assertEqual(job.status, BillingJob.PENDING)
+        self.assertGreater(job.run_after, job.created_at)
+        self.assertIn("KeyError", job.last_error)
+
+
+# -------------------------
+# Billing cycle tests
+# -------------------------
+@override_settings(BILLING_ON_READING=False)
+class BillingCycleTests(TestCase):
+    """Readings are billed by the monthly cycle, which resumes where it stopped."""
+
+    def test_cycle_bills_the_period_and_resumes(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2026, 1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(1, 4):
+                customer = Customer.objects.create(name=f"C{n}", house_number=f"H{n}", address="x")
+                meter = Meter.objects.create(customer=customer, serial_number=f"M{n}")
+                MeterReading.objects.create(
+                    meter=meter, reading_date=date(2026, 9, 28), value=Decimal("10")
+                )
+                MeterReading.objects.create(
+                    meter=meter, reading_date=date(2026, 10, n), value=Decimal(10 + n)
+                )
+        self.assertFalse(Bill.objects.exists())
+
+        cycle = plan_cycle(date(2026, 10, 1), shards=2)
+        self.assertEqual(list(cycle.shards.values_list("customers", flat=True)), [2, 1])
+        with self.captureOnCommitCallbacks(execute=True):
+            work_cycle(cycle.pk, stop=Bill.objects.exists)  # interrupted after one shard
+        self.assertEqual(Bill.objects.count(), 2)
+
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("run_billing_cycle", period="2026-10", processes=1, stdout=out)
+        self.assertIn("1 of 2 shard(s) to run", out.getvalue())
+        self.assertEqual(
+            sorted(Bill.objects.values_list("charge", flat=True)),
+            [Decimal("2.00"), Decimal("4.00"), Decimal("6.00")],
+        )
+        self.assertFalse(BillingShard.objects.exclude(status=BillingShard.DONE).exists())
+        self.assertIsNotNone(BillingCycle.objects.get().finished_at)
+        self.assertEqual(rebuild_ledgers(dry_run=True), [])
+        self.assertEqual(recompute_stats(dry_run=True), [])
+
+        call_command("run_billing_cycle", period="2026-10", processes=1, stdout=out)
+        self.assertEqual(Bill.objects.count(), 3)
+
+
+# -------------------------
+# Notification tests
+# -------------------------
+class ListTransport(Transport):
+    """Records what it sends; customers without a phone number fail."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, notification):
+        if not notification.customer.phone_number:
+            raise ValueError("no phone number")
+        self.sent.append(notification.pk)
+
+
+class NotificationDispatchTests(TestCase):
+    """Reminders are generated once; failed sends are recorded on the row."""
+
+    def setUp(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        for number, phone in (("A1", "0700000001"), ("A2", None)):
+            customer = Customer.objects.create(
+                name=number, house_number=number, address="x", phone_number=phone
+            )
+            meter = Meter.objects.create(customer=customer, serial_number=number)
+            MeterReading.objects.create(meter=meter, reading_date=date(2024, 1, 1), value=10)
+
+    def test_reminders_are_generated_once_and_dispatched(self):
+        today = Bill.objects.first().due_date + timedelta(days=1)
+        self.assertEqual(generate_reminders(today), 2)
+        self.assertEqual(generate_reminders(today), 0)
+
+        transport = ListTransport()
+        result = dispatch(transport, batch_size=1, concurrency=2)
+        self.assertEqual((result.sent, result.failed), (1, 1))
+        self.assertEqual(Notification.objects.filter(is_sent=True).count(), 1)
+        failed = Notification.objects.get(is_sent=False)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn("no phone number", failed.last_error)
+        # The failure is not retried until its claim expires
+        self.assertEqual(dispatch(transport).failed, 0)
+
+
+# -------------------------
+# Batch API tests
+# -------------------------
+class BatchApiTests(TestCase):
+    """Batch endpoints report every item and replay idempotent retries."""
+
+    def setUp(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        customer = Customer.objects.create(name="Ann", house_number="A1", address="x")
+        Meter.objects.create(customer=customer, serial_number="M1")
+        User.objects.create_user("device", password="secret")
+        self.auth = "Basic " + base64.b64encode(b"device:secret").decode()
+
+    def post(self, url, data, **headers):
+        return self.client.post(
+            url, json.dumps(data), content_type="application/json",
+            HTTP_AUTHORIZATION=self.auth, **headers,
+        )
+
+    def test_readings_batch_is_idempotent(self):
+        readings = {"readings": [
+            {"serial_number": "M1", "reading_date": "2024-01-01", "value": "10"},
+            {"serial_number": "M9", "reading_date": "2024-01-01", "value": "10"},
+        ]}
+        response = self.post(reverse("api_readings_batch"), readings, HTTP_IDEMPOTENCY_KEY="abc")
+        results = response.json()["results"]
+        self.assertEqual([r["status"] for r in results], ["created", "error"])
+        self.assertEqual(results[1]["error"], "unknown meter M9")
+
+        retry = self.post(reverse("api_readings_batch"), readings, HTTP_IDEMPOTENCY_KEY="abc")
+        self.assertEqual(retry.json(), response.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(MeterReading.objects.count(), 1)
+
+        readings["readings"].pop()
+        reused = self.post(reverse("api_readings_batch"), readings, HTTP_IDEMPOTENCY_KEY="abc")
+        self.assertEqual(reused.status_code, 422)
+
+    def test_readings_batch_without_tariff(self):
+        Tariff.objects.all().delete()
+        readings = {"readings": [
+            {"serial_number": "M1", "reading_date": "2024-01-01", "value": "10"},
+        ]}
+        response = self.post(reverse("api_readings_batch"), readings)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json(), {"error": "No tariff defined."})
+        self.assertFalse(MeterReading.objects.exists())
+
+    def test_idempotent_reraises_errors_of_the_view(self):
+        def view(request):
+            raise IntegrityError("not the key")
+
+        request = RequestFactory().post("/", HTTP_IDEMPOTENCY_KEY="abc")
+        request.user = User.objects.get()
+        with self.assertRaisesMessage(IntegrityError, "not the key"):
+            idempotent(view)(request)
+
+    def test_payments_batch_updates_bills(self):
+        reading = MeterReading.objects.create(
+            meter=Meter.objects.get(), reading_date=date(2024, 1, 1), value=Decimal("10")
+        )
+        payments = {"payments": [
+            {"bill_id": reading.bill.pk, "amount": "20.00", "reference_number": "R1"},
+            {"bill_id": reading.bill.pk, "amount": "5.00", "reference_number": "R1"},
+        ]}
+        results = self.post(reverse("api_payments_batch"), payments).json()["results"]
+        self.assertEqual([r["status"] for r in results], ["created", "error"])
+        self.assertTrue(Bill.objects.get().is_paid)
+        self.assertEqual(recompute_stats(dry_run=True), [])
+
+    def test_session_requires_csrf_token(self):
+        self.client = self.client_class(enforce_csrf_checks=True)
+        self.client.login(username="device", password="secret")
+        response = self.client.post(
+            reverse("api_payments_batch"), "{}", content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+# -------------------------
+# Statement import tests
+# -------------------------
+class StatementImportTests(TestCase):
+    """Statement lines are matched to bills once; the rest are suspended or rejected."""
+
+    def setUp(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        customer = Customer.objects.create(name="Ann", house_number="A1", address="x")
+        meter = Meter.objects.create(customer=customer, serial_number="M1")
+        for day, value in ((1, 10), (2, 15)):
+            MeterReading.objects.create(meter=meter, reading_date=date(2024, day, 1), value=value)
+        self.first, self.second = Bill.objects.order_by("pk")
+
+    def import_csv(self, text):
+        return import_statement(parse_statement(io.StringIO(text)))
+
+    def test_lines_are_matched_deduplicated_and_suspended(self):
+        statement = (
+            "reference,date,amount,account\n"
+            "T1,2024-03-01,20.00,a1\n"
+            f"T2,2024-03-01,10.00,BILL-{self.second.pk}\n"
+            "T3,2024-03-01,5.00,B9\n"
+        )
+        result = self.import_csv(statement)
+        self.assertEqual((result.imported, result.duplicates), (2, 0))
+        self.assertEqual([line for line, _, _ in result.suspense], [4])
+        self.assertEqual(
+            dict(Payment.objects.values_list("reference_number", "bill_id")),
+            {"T1": self.first.pk, "T2": self.second.pk},
+        )
+        self.first.refresh_from_db()
+        self.assertTrue(self.first.is_paid)
+
+        again = self.import_csv(statement)
+        self.assertEqual((again.imported, again.duplicates), (0, 2))
+        self.assertEqual(Payment.objects.count(), 2)
+        self.assertEqual(recompute_stats(dry_run=True), [])
+
+    def test_rejected_lines_are_not_allocated(self):
+        result = self.import_csv(
+            "reference,date,amount,account\n"
+            "T1,2024-03-01,abc,A1\n"
+            ",2024-03-01,20.00,A1\n"
+            "T3,2024-03-01,20.00,A1\n"
+        )
+        self.assertEqual(
+            [reason for _, reason, _ in result.suspense],
+            ["invalid amount 'abc'", "missing reference_number"],
+        )
+        self.assertEqual(Payment.objects.get().bill_id, self.first.pk)
+
+
+class RollupTests(TestCase):
+    """Incrementally refreshed rollups must match a rebuild from scratch."""
+
+    def snapshot(self):
+        return [
+            sorted(model.objects.values_list(
+                *fields, "units", "readings", "billed", "bills", "collected", "payments"
+            ))
+            for model, fields in (
+                (CustomerMonthRollup, ("customer_id", "zone", "month")),
+                (ZoneMonthRollup, ("zone", "month")),
+                (DailyRollup, ("day",)),
+            )
+        ] + [
+            sorted(
+                (meter_id, month, units, readings, sorted(days.items()))
+                for meter_id, month, units, readings, days in MeterUsageMonth.objects.values_list(
+                    "meter_id", "month", "units", "readings", "days"
+                )
+            )
+        ]
+
+    def assertNoDrift(self):
+        incremental = self.snapshot()
+        rebuild_rollups()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_rollups_follow_changes(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            customer = Customer.objects.create(
+                name="Ann", house_number="A1", address="x", zone="North"
+            )
+            meter = Meter.objects.create(customer=customer, serial_number="M1")
+            for month, value in ((1, 10), (2, 25)):
+                MeterReading.objects.create(
+                    meter=meter, reading_date=date(2024, month, 5), value=value
+                )
+        self.assertEqual(ZoneMonthRollup.objects.get(month=date(2024, 2, 1)).units, 15)
+        self.assertNoDrift()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            # Backdated: re-rates February through the consumption engine
+            MeterReading.objects.create(meter=meter, reading_date=date(2024, 1, 20), value=20)
+            Payment.objects.create(
+                bill=Bill.objects.first(), amount=Decimal("5.00"), reference_number="P1"
+            )
+            customer.zone = "South"
+            customer.save()
+        self.assertFalse(ZoneMonthRollup.objects.filter(zone="North").exists())
+        self.assertNoDrift()
+
+    def test_single_rows_apply_deltas(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            customers = [
+                Customer.objects.create(name=name, house_number=name, address="x", zone="North")
+                for name in ("Ann", "Bob")
+            ]
+            for n, customer in enumerate(customers):
+                meter = Meter.objects.create(customer=customer, serial_number=f"M{n}")
+                for month, value in ((1, 10), (2, 25), (3, 30)):
+                    MeterReading.objects.create(
+                        meter=meter, reading_date=date(2024, month, 5), value=value + n
+                    )
+            payment = Payment.objects.create(
+                bill=Bill.objects.first(), amount=Decimal("5.00"), reference_number="P1"
+            )
+        self.assertNoDrift()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            payment.amount = Decimal("7.50")
+            payment.save()
+            reading = MeterReading.objects.get(meter__serial_number="M0", reading_date__month=3)
+            reading.reading_date = date(2024, 4, 1)  # the last reading: no later one to fix
+            reading.save()
+        self.assertNoDrift()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            payment.delete()
+            reading.delete()
+            customers[1].delete()
+        # Both March readings are gone: the emptied buckets are deleted
+        self.assertFalse(DailyRollup.objects.filter(day=date(2024, 3, 5)).exists())
+        self.assertFalse(ZoneMonthRollup.objects.filter(month=date(2024, 3, 1)).exists())
+        self.assertNoDrift()
+
+    def test_usage_series(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        customer = Customer.objects.create(name="Ann", house_number="A1", address="x")
+        meter = Meter.objects.create(customer=customer, serial_number="M1")
+        start = date(2024, 1, 25)
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_readings(
+                (day, "M1", start + timedelta(days=day), Decimal(day * 2)) for day in range(14)
+            )
+        self.assertEqual(MeterUsageMonth.objects.filter(meter=meter).count(), 2)
+        self.assertNoDrift()
+
+        end = start + timedelta(days=13)
+        weekly = usage_series(meter.pk, start, end, "week")
+        self.assertEqual(
+            [row["period"] for row in weekly],
+            [date(2024, 1, 22), date(2024, 1, 29), date(2024, 2, 5)],
+        )
+        self.assertEqual(sum(row["units"] for row in weekly), Decimal("26.00"))
+        monthly = usage_series(meter.pk, start, end, "month")
+        self.assertEqual([(row["units"], row["readings"]) for row in monthly], [(12, 7), (14, 7)])
+        self.assertEqual(len(usage_series(meter.pk, start, end)), 14)  # daily by default
+        with self.assertRaises(ValueError):
+            usage_series(meter.pk, date(2000, 1, 1), end, "day")
+
+        self.client.force_login(User.objects.create_user("clerk", password="secret"))
+        response = self.client.get(
+            reverse("api_meter_usage", args=[meter.pk]),
+            {"start": "2024-01-01", "end": "2024-02-29", "interval": "month"},
+        )
+        self.assertEqual(response.json()["series"][1], {
+            "period": "2024-02-01", "units": "14.00", "readings": 7,
+        })
+
+
+class RollupWriteCostTests(TransactionTestCase):
+    """In autocommit a single row adds deltas to its rollup buckets once, not per receiver."""
+
+    def test_single_row_query_ceilings(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        customer = Customer.objects.create(name="Ann", house_number="A1", address="x")
+        meter = Meter.objects.create(customer=customer, serial_number="M1")
+        MeterReading.objects.create(meter=meter, reading_date=date(2024, 1, 1), value=10)
+        with CaptureQueriesContext(connection) as queries:
+            reading = MeterReading.objects.create(
+                meter=meter, reading_date=date(2024, 2, 1), value=20
+            )
+        # Consumption, billing, ledger, counters, then one upsert per rollup table
+        self.assertLessEqual(len(queries), 26)
+        daily = DailyRollup.objects.get(day=date(2024, 2, 1))
+        self.assertEqual((daily.units, daily.readings), (Decimal("10.00"), 1))
+
+        with CaptureQueriesContext(connection) as queries:
+            Payment.objects.create(bill=reading.bill, amount=Decimal("5.00"), reference_number="P")
+        self.assertLessEqual(len(queries), 12)
+        self.assertEqual(DailyRollup.objects.get(day=reading.bill.issue_date).payments, 1)
+
+
+class TariffResolverTests(TestCase):
+    """Warm lookups are free, and a tariff change reaches every process's copy."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_warm_lookup_and_shared_invalidation(self):
+        Tariff.objects.create(rate_per_unit=Decimal("2.00"), effective_date=date(2024, 1, 1))
+        worker = TariffResolver()  # another process's copy
+        self.assertEqual(worker.tariff_for(date(2024, 6, 1)).rate_per_unit, Decimal("2.00"))
+        rate_readings([(date(2024, 6, 1), Decimal("3"))])
+        with self.assertNumQueries(0):
+            worker.tariff_for(date(2024, 7, 1))
+            rate_readings([(date(2024, 7, 1), Decimal("3"))])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Tariff.objects.create(rate_per_unit=Decimal("3.00"), effective_date=date(2024, 7, 1))
+        self.assertEqual(worker.tariff_for(date(2024, 7, 1)).rate_per_unit, Decimal("3.00"))
+        self.assertEqual(rate_readings([(date(2024, 7, 1), Decimal("3"))]), [Decimal("9.00")])
+
+
+# -------------------------
+# Synthetic data tests
+# -------------------------
+class SyntheticDataTests(TestCase):
+    """Generated datasets must be consistent, and the benchmarks must run on them."""
+
+    def test_generate_and_benchmark(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            result = generate_dataset(customers=12, months=3, seed=7)
+        self.assertEqual(result.customers, 12)
+        self.assertEqual(MeterReading.objects.count(), result.readings)
+        self.assertEqual(Bill.objects.count(), result.readings)
+        self.assertEqual(Payment.objects.count(), result.payments)
+        self.assertEqual(Tariff.objects.count(), 2)
+        self.assertEqual(recompute_stats(dry_run=True), [])
+        self.assertEqual(rebuild_ledgers(dry_run=True), [])
+        with self.assertRaises(ValueError):
+            generate_dataset(customers=1, months=1)
+
+        readings = MeterReading.objects.count()
+        results = run_benchmarks(repeat=1, sample=3)
+        self.assertEqual(set(results["benchmarks"]), set(BENCHMARKS))
+        self.assertEqual(results["benchmarks"]["customer_balance"]["queries"], 6)
+        self.assertEqual(MeterReading.objects.count(), readings)  # writes rolled back
+        self.assertEqual(compare_results(results, results), [])
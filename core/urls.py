@@ -1,7 +1,8 @@
 # core/urls.py
 from django.urls import path
 from django.contrib.auth.views import LoginView, LogoutView
-from . import views
+from . import api, live, views
+from .metrics import metrics_view
 
 urlpatterns = [
     # Dashboard
@@ -48,6 +49,34 @@ urlpatterns = [
     path("billing-payments/", views.billing_payments_gateway, name="billing_payments"),
     path("billing/", views.billing_list, name="billing_list"),
     path("payments/", views.payments_list, name="payments_list"),
+    path("exports/<str:name>/", views.export_data, name="export_data"),
+
+    # JSON API (keyset paginated)
+    path("api/bills/", api.bills_api, name="api_bills"),
+    path("api/payments/", api.payments_api, name="api_payments"),
+    path("api/customers/", api.customers_api, name="api_customers"),
+    path("api/meters/", api.meters_api, name="api_meters"),
+    path("api/meters/<int:meter_id>/usage/", api.meter_usage_api, name="api_meter_usage"),
+    # Async, ETag-validated endpoints for pollers (wall display, mobile app)
+    path("api/live/dashboard/", live.dashboard_live, name="api_live_dashboard"),
+    path("api/live/customers/<int:customer_id>/", live.customer_live, name="api_live_customer"),
+    path(
+        "api/live/meters/<int:meter_id>/readings/", live.meter_readings_live,
+        name="api_live_meter_readings",
+    ),
+    path("api/live/bills/<int:bill_id>/", live.bill_live, name="api_live_bill"),
+    # Search-as-you-type for the form selects
+    path(
+        "api/autocomplete/customers/", api.customers_autocomplete, name="autocomplete_customers"
+    ),
+    path("api/autocomplete/meters/", api.meters_autocomplete, name="autocomplete_meters"),
+    path("api/autocomplete/readings/", api.readings_autocomplete, name="autocomplete_readings"),
+    path("api/autocomplete/bills/", api.bills_autocomplete, name="autocomplete_bills"),
+    path("api/readings/batch/", api.readings_batch_api, name="api_readings_batch"),
+    path("api/payments/batch/", api.payments_batch_api, name="api_payments_batch"),
+
+    # Instrumentation (Prometheus text format)
+    path("metrics/", metrics_view, name="metrics"),
 
     # Authentication
     path("login/", LoginView.as_view(template_name="core/login.html"), name="login"),
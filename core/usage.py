@@ -0,0 +1,214 @@
+"""
+Per-meter consumption time series.
+
+Readings are bucketed into one ``MeterUsageMonth`` row per meter and month,
+holding the units consumed on each day of the month. A window of any length
+is then read from a few rows per meter (twelve for a year of daily smart-meter
+readings) and summed into day, week or month periods in Python.
+
+The buckets follow the report rollups: a single reading adds its units to its
+day with ``apply_usage_deltas``, and since a meter belongs to exactly one
+customer, the ``(customer, day)`` keys that ``core.rollups`` marks dirty name
+the meter months to recompute as well.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from .models import Meter, MeterReading, MeterUsageMonth
+
+ZERO = Decimal("0.00")
+CENT = Decimal("0.01")
+INTERVALS = ("day", "week", "month")
+MAX_POINTS = 1000
+CHUNK_SIZE = 2000
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _bucket(meter_id, month, readings):
+    """A ``MeterUsageMonth`` from ``(reading_date, units_consumed)`` pairs."""
+    days = {}
+    for reading_date, units in readings:
+        days[str(reading_date.day)] = str(units or ZERO)
+    return MeterUsageMonth(
+        meter_id=meter_id,
+        month=month,
+        units=sum((Decimal(units) for units in days.values()), ZERO),
+        readings=len(days),
+        days=days,
+    )
+
+
+def _save(buckets):
+    MeterUsageMonth.objects.bulk_create(
+        buckets,
+        update_conflicts=True,
+        unique_fields=["meter", "month"],
+        update_fields=["units", "readings", "days"],
+        batch_size=1000,
+    )
+
+
+# -------------------------
+# Maintenance
+# -------------------------
+def refresh_usage(months):
+    """Recompute the buckets of ``{customer_id: {month, ...}}`` (months as first days)."""
+    meters = dict(Meter.objects.filter(customer_id__in=months).values_list("customer_id", "pk"))
+    wanted = {
+        (meters[customer_id], month)
+        for customer_id, customer_months in months.items()
+        if customer_id in meters
+        for month in customer_months
+    }
+    if not wanted:
+        return
+    first = min(month for _, month in wanted)
+    last = _next_month(max(month for _, month in wanted)) - timedelta(days=1)
+
+    readings = defaultdict(list)
+    for meter_id, reading_date, units in MeterReading.objects.filter(
+        meter_id__in={meter_id for meter_id, _ in wanted},
+        reading_date__gte=first,
+        reading_date__lte=last,
+    ).values_list("meter_id", "reading_date", "units_consumed"):
+        key = (meter_id, _month_start(reading_date))
+        if key in wanted:
+            readings[key].append((reading_date, units))
+
+    _save([_bucket(meter_id, month, rows) for (meter_id, month), rows in readings.items()])
+    empty = defaultdict(list)
+    for meter_id, month in wanted - set(readings):
+        empty[month].append(meter_id)
+    for month, meter_ids in empty.items():
+        MeterUsageMonth.objects.filter(meter_id__in=meter_ids, month=month).delete()
+
+
+def apply_usage_deltas(deltas):
+    """
+    Add ``{(meter_id, day): {"units": ..., "readings": ...}}`` to the buckets.
+    ``readings`` is 1 or -1 when the meter's reading of that day was added or
+    removed, and 0 (or absent) when only its units changed.
+    """
+    if not deltas:
+        return
+    stored = {
+        (bucket.meter_id, bucket.month): bucket
+        for bucket in MeterUsageMonth.objects.filter(
+            meter_id__in={meter_id for meter_id, _ in deltas},
+            month__in={_month_start(day) for _, day in deltas},
+        )
+    }
+    touched = {}
+    for (meter_id, day), values in deltas.items():
+        key = (meter_id, _month_start(day))
+        bucket = stored.get(key) or MeterUsageMonth(meter_id=meter_id, month=key[1], days={})
+        readings = values.get("readings", 0)
+        if readings < 0:
+            bucket.days.pop(str(day.day), None)
+        elif readings > 0 or str(day.day) in bucket.days:
+            units = Decimal(bucket.days.get(str(day.day), ZERO)) + values.get("units", ZERO)
+            bucket.days[str(day.day)] = str(units.quantize(CENT))
+        else:
+            continue  # nothing was counted on that day
+        stored[key] = touched[key] = bucket
+
+    for bucket in touched.values():
+        bucket.units = sum((Decimal(units) for units in bucket.days.values()), ZERO)
+        bucket.readings = len(bucket.days)
+    _save([bucket for bucket in touched.values() if bucket.days])
+    empty = [bucket.pk for bucket in touched.values() if not bucket.days and bucket.pk]
+    if empty:
+        MeterUsageMonth.objects.filter(pk__in=empty).delete()
+
+
+def rebuild_usage():
+    """Recompute every bucket from the readings. Returns the number of buckets."""
+    MeterUsageMonth.objects.all().delete()
+    buckets, key, rows = [], None, []
+    for meter_id, reading_date, units in (
+        MeterReading.objects.order_by("meter_id", "reading_date")
+        .values_list("meter_id", "reading_date", "units_consumed")
+        .iterator(chunk_size=CHUNK_SIZE)
+    ):
+        if (meter_id, _month_start(reading_date)) != key:
+            if rows:
+                buckets.append(_bucket(*key, rows))
+            key, rows = (meter_id, _month_start(reading_date)), []
+            if len(buckets) >= CHUNK_SIZE:
+                _save(buckets)
+                buckets = []
+        rows.append((reading_date, units))
+    if rows:
+        buckets.append(_bucket(*key, rows))
+    _save(buckets)
+    return MeterUsageMonth.objects.count()
+
+
+# -------------------------
+# Reading series
+# -------------------------
+def default_interval(start, end):
+    """Daily up to three months, weekly up to two years, monthly beyond."""
+    days = (end - start).days
+    return "day" if days <= 92 else "week" if days <= 731 else "month"
+
+
+def period_start(day, interval):
+    if interval == "week":
+        return day - timedelta(days=day.weekday())  # Monday
+    if interval == "month":
+        return _month_start(day)
+    return day
+
+
+def _next_period(start, interval):
+    if interval == "week":
+        return start + timedelta(days=7)
+    if interval == "month":
+        return _next_month(start)
+    return start + timedelta(days=1)
+
+
+def usage_series(meter_id, start, end, interval=None):
+    """
+    Units consumed by a meter per ``interval`` from ``start`` to ``end``
+    (inclusive), as ``[{"period", "units", "readings"}]`` with every period
+    of the window present. Units count on the date of the reading that
+    recorded them. Raises ValueError for an unknown interval or a window
+    with more than ``MAX_POINTS`` periods.
+    """
+    interval = interval or default_interval(start, end)
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+    if end < start:
+        raise ValueError("end is before start")
+    periods = []
+    period = period_start(start, interval)
+    while period <= end:
+        periods.append(period)
+        if len(periods) > MAX_POINTS:
+            raise ValueError(f"more than {MAX_POINTS} {interval}s; use a longer interval")
+        period = _next_period(period, interval)
+
+    totals = {period: [ZERO, 0] for period in periods}
+    for month, days in MeterUsageMonth.objects.filter(
+        meter_id=meter_id, month__gte=_month_start(start), month__lte=end
+    ).values_list("month", "days"):
+        for day, units in days.items():
+            reading_date = month.replace(day=int(day))
+            if start <= reading_date <= end:
+                total = totals[period_start(reading_date, interval)]
+                total[0] += Decimal(units)
+                total[1] += 1
+    return [
+        {"period": period, "units": units, "readings": count}
+        for period, (units, count) in totals.items()
+    ]
@@ -6,62 +6,62 @@ from decimal import Decimal
 from django.utils import timezone
 from .forms import CustomerForm, MeterForm, BillForm, PaymentForm
 from django.contrib import messages
-from django.core.paginator import Paginator
 from .forms import MeterReadingForm
 from django.urls import reverse
+from django.http import FileResponse, Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.template.loader import render_to_string
+import tempfile
 
 
 from .models import Customer, Meter, MeterReading, Bill, Payment, Notification, Tariff
-
+from .caching import CUSTOMERS, METERS, READINGS, cached, customer_scope
+from .exports import EXPORTS, FORMATS, iter_csv, write_xlsx, xlsx_available
+from .filters import date_param, filter_bills, filter_payments
+from .metrics import query_budget
+from .pagination import paginate_request
+from .rollups import report_data
+from .routers import read_replica
+from .stats import bill_summary, dashboard_stats
+
+LATEST_READINGS = 12
+RECENT_READINGS = 10
 
 @login_required
+@query_budget(3)
+@read_replica
 def dashboard(request):
-    """Main dashboard: show high-level stats"""
-    total_customers = Customer.objects.count()
-    total_meters = Meter.objects.count()
-    unpaid_bills = Bill.objects.filter(is_paid=False).count()
-
-    total_billed = Bill.objects.aggregate(
-        total=Coalesce(Sum("amount_due"), Decimal("0.00"))
-    )["total"]
-
-    total_due = Bill.objects.filter(is_paid=False).aggregate(
-        total=Coalesce(Sum("amount_due"), Decimal("0.00"))
-    )["total"]
-
-    total_collected = Payment.objects.aggregate(
-        total=Coalesce(Sum("amount"), Decimal("0.00"))
-    )["total"]
-
-    readings_today = MeterReading.objects.filter(
-        reading_date=timezone.now().date()
-    ).count()
-
-    context = {
-        "total_customers": total_customers,
-        "total_meters": total_meters,
-        "unpaid_bills": unpaid_bills,
-        "total_billed": total_billed,
-        "total_due": total_due,
-        "total_collected": total_collected,
-        "readings_today": readings_today,
-    }
+    """Main dashboard: show high-level stats (kept up to date by core.stats)"""
+    context = dashboard_stats()
     return render(request, "core/dashboard.html", context)
 
 
 @login_required
+@query_budget(2)
 def customers_meters(request):
     """Gateway page for Customers & Meters"""
     return render(request, "core/customers_meters.html")
 
+def _cached_cards(request, name, scope, template, queryset, keys):
+    """A page of ``queryset`` rendered as cards, cached until ``scope`` changes."""
+    def build():
+        page_obj = paginate_request(request, queryset, keys, descending=False)
+        # Rendered without the request: the cards are shared by every user
+        return render_to_string(template, {name: page_obj, "page_obj": page_obj})
+    return cached(f"{name}_cards", [scope], build, vary=request.GET.urlencode())
+
+
 @login_required
+@query_budget(3)
 def customers(request):
     """List all customers as clickable cards"""
-    all_customers = Customer.objects.all()
-    context = {"customers": all_customers}
-    return render(request, "core/customers.html", context)
+    cards = _cached_cards(
+        request, "customers", CUSTOMERS, "core/customer_cards.html",
+        Customer.objects.all(), ("name", "id"),
+    )
+    return render(request, "core/customers.html", {"cards": cards})
 
 @login_required
+@query_budget(2)
 def customer_add(request):
     """Add a new customer"""
     if request.method == "POST":
@@ -78,13 +78,24 @@ def customer_add(request):
 
 
 @login_required
+@query_budget(5)
 def customer_detail(request, customer_id):
-    """View details for a single customer"""
-    customer = Customer.objects.get(id=customer_id)
-    context = {"customer": customer}
+    """View details for a single customer (cached until they or their bills change)"""
+    def build():
+        customer = get_object_or_404(
+            Customer.objects.select_related("ledger", "meter"), id=customer_id
+        )
+        bills = list(customer.bills.order_by("-issue_date", "-id"))
+        payments = list(
+            Payment.objects.filter(bill__customer=customer).order_by("-payment_date", "-id")
+        )
+        return {"customer": customer, "bills": bills, "payments": payments}
+
+    context = cached("customer_detail", [customer_scope(customer_id)], build)
     return render(request, "core/customer_detail.html", context)
 
 @login_required
+@query_budget(3)
 def customer_edit(request, id):
     customer = get_object_or_404(Customer, pk=id)
 
@@ -106,6 +117,7 @@ def customer_edit(request, id):
 
 
 @login_required
+@query_budget(3)
 def customer_delete(request, id):
     customer = get_object_or_404(Customer, id=id)
     
@@ -116,17 +128,21 @@ def customer_delete(request, id):
     return render(request, "core/customer_confirm_delete.html", {"customer": customer})
 
 @login_required
+@query_budget(3)
 def meters_list(request):
     """Display all meters"""
-    meters = Meter.objects.select_related('customer').all()
-    context = {"meters": meters}
-    return render(request, "core/meters.html", context)
+    cards = _cached_cards(
+        request, "meters", METERS, "core/meter_cards.html",
+        Meter.objects.select_related('customer'), ("serial_number", "id"),
+    )
+    return render(request, "core/meters.html", {"cards": cards})
 
 @login_required
+@query_budget(4)
 def meter_detail(request, meter_id):
-    """Display details of a specific meter and its readings"""
-    meter = Meter.objects.select_related('customer').get(id=meter_id)
-    readings = meter.readings.all()  # latest readings already ordered by -reading_date
+    """Display details of a specific meter; usage is charted from api_meter_usage"""
+    meter = get_object_or_404(Meter.objects.select_related("customer"), id=meter_id)
+    readings = meter.readings.order_by("-reading_date")[:LATEST_READINGS]
     context = {
         "meter": meter,
         "readings": readings,
@@ -135,6 +151,7 @@ def meter_detail(request, meter_id):
 
 
 @login_required
+@query_budget(2)
 def meter_add(request):
     if request.method == "POST":
         form = MeterForm(request.POST)
@@ -146,6 +163,7 @@ def meter_add(request):
     return render(request, "core/meter_form.html", {"form": form, "title": "Add Meter"})
 
 @login_required
+@query_budget(4)
 def meter_edit(request, meter_id):
     meter = get_object_or_404(Meter, pk=meter_id)
     if request.method == "POST":
@@ -158,6 +176,7 @@ def meter_edit(request, meter_id):
     return render(request, "core/meter_form.html", {"form": form, "title": "Edit Meter"})
 
 @login_required
+@query_budget(4)
 def meter_delete(request, meter_id):
     meter = get_object_or_404(Meter, pk=meter_id)
     if request.method == "POST":
@@ -191,6 +210,7 @@ def billing_payments(request):
 # ------------------ BILL VIEWS ------------------
 
 @login_required
+@query_budget(2)
 def bill_add(request):
     if request.method == "POST":
         form = BillForm(request.POST)
@@ -211,6 +231,7 @@ def bill_add(request):
 
 
 @login_required
+@query_budget(5)
 def bill_edit(request, bill_id):
     bill = get_object_or_404(Bill, pk=bill_id)
     if request.method == "POST":
@@ -226,6 +247,7 @@ def bill_edit(request, bill_id):
 
 
 @login_required
+@query_budget(4)
 def bill_delete(request, bill_id):
     bill = get_object_or_404(Bill, pk=bill_id)
     if request.method == "POST":
@@ -237,6 +259,7 @@ def bill_delete(request, bill_id):
 # ------------------ PAYMENT VIEWS ------------------
 
 @login_required
+@query_budget(2)
 def payment_add(request):
     if request.method == "POST":
         form = PaymentForm(request.POST)
@@ -251,6 +274,7 @@ def payment_add(request):
 
 
 @login_required
+@query_budget(4)
 def payment_edit(request, payment_id):
     payment = get_object_or_404(Payment, pk=payment_id)
     if request.method == "POST":
@@ -265,6 +289,7 @@ def payment_edit(request, payment_id):
 
 
 @login_required
+@query_budget(5)
 def payment_delete(request, payment_id):
     payment = get_object_or_404(Payment, pk=payment_id)
     if request.method == "POST":
@@ -280,49 +305,60 @@ def payment_delete(request, payment_id):
 # ======================
 
 @login_required
+@query_budget(4)
 def water_management(request):
-    meters = Meter.objects.select_related("customer")
-    recent_readings = MeterReading.objects.select_related("meter")[:10]
-    customers = Customer.objects.all()
-
-    context = {
-        "meters": meters,
-        "recent_readings": recent_readings,
-        "customers": customers,
-    }
+    """Customer and meter totals with the latest readings"""
+    def build():
+        stats = dashboard_stats()
+        return {
+            "total_customers": stats["total_customers"],
+            "total_meters": stats["total_meters"],
+            "readings_today": stats["readings_today"],
+            "recent_readings": list(
+                MeterReading.objects.select_related("meter__customer")
+                .order_by("-reading_date", "-id")[:RECENT_READINGS]
+            ),
+        }
+
+    context = cached(
+        "water_management", [CUSTOMERS, METERS, READINGS], build,
+        vary=str(timezone.localdate()),  # readings_today
+    )
     return render(request, "categories/water_management.html", context)
 
 
 
 
 @login_required
+@query_budget(6)
+@read_replica
 def reports_analysis(request):
-    total_consumption = MeterReading.objects.aggregate(
-        total=Coalesce(Sum("units_consumed"), Decimal("0.00"))
-    )["total"]
-
-    revenue = Payment.objects.aggregate(
-        total=Coalesce(Sum("amount"), Decimal("0.00"))
-    )["total"]
-
-    top_customers = (
-        Customer.objects.annotate(total_due=Sum("bills__amount_due"))
-        .order_by("-total_due")[:5]
-    )
+    start = date_param(request.GET, "start_date")
+    end = date_param(request.GET, "end_date")
+    report = report_data(start, end)
 
     context = {
-        "total_consumption": total_consumption,
-        "revenue": revenue,
-        "top_customers": top_customers,
+        "total_consumption": report["totals"]["units"],
+        "revenue": report["totals"]["collected"],
+        "billed": report["totals"]["billed"],
+        "readings": report["totals"]["readings"],
+        "top_customers": report["top_customers"],
+        "zones": report["zones"],
+        "trend": [
+            {key: str(row[key]) for key in ("period", "units", "billed", "collected")}
+            for row in report["trend"]
+        ],
+        "start_date": start,
+        "end_date": end,
     }
-    return render(request, "categories/reports_analysis.html", context)
+    return render(request, "core/reports_analysis.html", context)
 
 
 @login_required
 def system_settings(request):
     users = Customer.objects.count()
     notifications = Notification.objects.select_related("customer")[:10]
-    pending_notifications = notifications.filter(is_sent=False).count()
+    pending_notifications = Notification.objects.filter(is_sent=False).count()
 
     context = {
         "users": users,
@@ -338,6 +374,7 @@ def system_settings(request):
 # Billing & Payments Gateway
 # -------------------------
 @login_required
+@query_budget(2)
 def billing_payments_gateway(request):
     return render(request, "core/billing_payments_gateway.html")
 
@@ -346,65 +383,26 @@ def billing_payments_gateway(request):
 # Bills List
 # -------------------------
 @login_required
+@query_budget(4)
 def billing_list(request):
-    # Base queryset
-    bills = Bill.objects.select_related("customer", "reading").prefetch_related("payments").order_by("-issue_date")
+    if "export" in request.GET:
+        return _export_response(request, "bills")
 
-    # --- Filters ---
+    bills = filter_bills(request.GET, Bill.objects.select_related("customer"))
     status = request.GET.get("status")
     search = request.GET.get("search")
     start_date = request.GET.get("start_date")
     end_date = request.GET.get("end_date")
 
-    if status == "paid":
-        bills = bills.filter(is_paid=True)
-    elif status == "unpaid":
-        bills = bills.filter(is_paid=False)
-
-    if search:
-        bills = bills.filter(
-            Q(customer__name__icontains=search) |
-            Q(customer__house_number__icontains=search)
-        )
-
-    if start_date and end_date:
-        bills = bills.filter(issue_date__range=[start_date, end_date])
-
-    # --- Summary stats ---
-    total_billed = bills.aggregate(total=Sum("amount_due"))["total"] or 0
-    total_paid = sum([sum(p.amount for p in b.payments.all()) for b in bills])
-    outstanding = total_billed - total_paid
-    count_paid = bills.filter(is_paid=True).count()
-    count_unpaid = bills.filter(is_paid=False).count()
+    # --- Summary stats (one aggregate query) ---
+    summary = bill_summary(bills)
 
-    # --- Pagination ---
-    paginator = Paginator(bills, 20)  # 20 bills per page
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
-
-    # --- Export CSV if requested ---
-    if "export" in request.GET:
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = 'attachment; filename="bills.csv"'
-        writer = csv.writer(response)
-        writer.writerow(["Customer", "Issue Date", "Due Date", "Amount Due", "Status"])
-        for bill in bills:
-            writer.writerow([
-                bill.customer.name,
-                bill.issue_date,
-                bill.due_date,
-                bill.amount_due,
-                "Paid" if bill.is_paid else "Unpaid"
-            ])
-        return response
+    # --- Pagination (keyset on the bill_issue_date_id_idx index) ---
+    page_obj = paginate_request(request, bills, ("issue_date", "id"))
 
     context = {
         "page_obj": page_obj,
-        "total_billed": total_billed,
-        "total_paid": total_paid,
-        "outstanding": outstanding,
-        "count_paid": count_paid,
-        "count_unpaid": count_unpaid,
+        **summary,
         "status": status,
         "search": search,
         "start_date": start_date,
@@ -417,20 +415,68 @@ def billing_list(request):
 # Payments List
 # -------------------------
 @login_required
+@query_budget(3)
 def payments_list(request):
-    payments = Payment.objects.select_related("bill", "bill__customer").order_by("-payment_date")
-    
+    if "export" in request.GET:
+        return _export_response(request, "payments")
+
+    payments = filter_payments(
+        request.GET, Payment.objects.select_related("bill", "bill__customer")
+    )
+    page_obj = paginate_request(request, payments, ("payment_date", "id"))
+
     context = {
-        "payments": payments,
+        "payments": page_obj,
+        "page_obj": page_obj,
     }
     return render(request, "core/payments_list.html", context)
 
 
+# -------------------------
+# Exports
+# -------------------------
+EXPORT_RETURN_URLS = {
+    "bills": "billing_list",
+    "payments": "payments_list",
+    "readings": "meters",
+}
+
+
+def _export_response(request, name):
+    """Stream export ``name`` filtered by the request's query string."""
+    export = EXPORTS[name]
+    fmt = request.GET.get("format", "csv")
+    if fmt not in FORMATS:  # it ends up in the Content-Disposition header
+        return HttpResponseBadRequest("Unknown export format.")
+    filename = f"{name}-{timezone.localdate():%Y%m%d}.{fmt}"
+
+    if fmt == "xlsx":
+        if not xlsx_available():
+            messages.error(request, "XLSX export is not available on this server.")
+            return redirect(EXPORT_RETURN_URLS[name])
+        workbook = tempfile.TemporaryFile()
+        write_xlsx(export, request.GET, workbook)
+        workbook.seek(0)
+        return FileResponse(workbook, as_attachment=True, filename=filename)
+
+    response = StreamingHttpResponse(iter_csv(export, request.GET), content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+def export_data(request, name):
+    if name not in EXPORTS:
+        raise Http404("Unknown export.")
+    return _export_response(request, name)
+
+
 
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from .forms import MeterReadingForm
 
+@query_budget(2)
 def add_meter_reading(request):
     if request.method == "POST":
         form = MeterReadingForm(request.POST)
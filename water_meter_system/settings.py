@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,6 +46,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.metrics.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -74,12 +78,106 @@ WSGI_APPLICATION = 'water_meter_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite unless DB_ENGINE=postgresql (then DB_NAME, DB_USER, DB_PASSWORD,
+# DB_HOST and DB_PORT). DB_REPLICA_HOST adds a read replica that the
+# dashboard, reports and exports read from (core.routers).
+DB_ENGINE = os.environ.get("DB_ENGINE", "sqlite")
+
+
+def _postgresql(host):
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get("DB_NAME", "water_meter_system"),
+        'USER': os.environ.get("DB_USER", ""),
+        'PASSWORD': os.environ.get("DB_PASSWORD", ""),
+        'HOST': host,
+        'PORT': os.environ.get("DB_PORT", ""),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    if os.environ.get("DB_POOL", "") == "1":
+        # psycopg 3 connection pool (pip install "psycopg[pool]")
+        database['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get("DB_POOL_MIN_SIZE", "2")),
+            'max_size': int(os.environ.get("DB_POOL_MAX_SIZE", "10")),
+        }
+    else:
+        # Persistent connections, reused for DB_CONN_MAX_AGE seconds
+        database['CONN_MAX_AGE'] = int(os.environ.get("DB_CONN_MAX_AGE", "60"))
+    return database
+
+
+if DB_ENGINE == "postgresql":
+    DATABASES = {'default': _postgresql(os.environ.get("DB_HOST", ""))}
+    if os.environ.get("DB_REPLICA_HOST"):
+        DATABASES['replica'] = {
+            **_postgresql(os.environ["DB_REPLICA_HOST"]),
+            'TEST': {'MIRROR': 'default'},
+        }
+elif DB_ENGINE == "sqlite":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get("DB_NAME") or BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Billing workers write concurrently: take the write lock up front
+                # and wait for it, instead of failing with "database is locked"
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+                # Readers no longer block the writer (and vice versa) with the
+                # write-ahead log, and NORMAL only syncs it at checkpoints
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unsupported DB_ENGINE {DB_ENGINE!r}")
+
+DATABASE_ROUTERS = ["core.routers.ReplicaRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# Holds sessions and the cached pages of core.caching. CACHE_BACKEND is
+# "locmem" (per process), "file" (a directory shared by the processes of one
+# host) or "redis" (any Redis-compatible server; needs the redis package),
+# with CACHE_LOCATION overriding the directory or URL. Invalidations (of pages
+# and of the tariff timeline) only reach the processes sharing the cache, so
+# run more than one process on "file" or "redis".
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "locmem")
+
+if CACHE_BACKEND == "locmem":
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'water-meter-system',
+    }}
+elif CACHE_BACKEND == "file":
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get("CACHE_LOCATION") or BASE_DIR / '.cache',
+    }}
+elif CACHE_BACKEND == "redis":
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get("CACHE_LOCATION", "redis://127.0.0.1:6379/1"),
+    }}
+else:
+    raise ImproperlyConfigured(f"Unsupported CACHE_BACKEND {CACHE_BACKEND!r}")
+
+CACHES['default']['KEY_PREFIX'] = 'water'
+if CACHE_BACKEND != "redis":
+    # Room for a version token per customer besides the cached pages
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.environ.get("CACHE_MAX_ENTRIES", "20000")),
     }
-}
+
+# Sessions are read from the cache and only fall back to the database on a miss
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# How long a cached page fragment is kept (core.caching); invalidation makes
+# changed ones unreachable before that.
+PAGE_CACHE_SECONDS = int(os.environ.get("PAGE_CACHE_SECONDS", "600"))
 
 
 # Password validation
@@ -133,3 +231,19 @@ LOGIN_URL = "login"
 LOGIN_REDIRECT_URL = "dashboard"
 LOGOUT_REDIRECT_URL = "login"
 
+
+# Billing side effects (bill generation, status updates, re-rating) run on the
+# job queue processed by `manage.py billing_worker` instead of inside requests.
+BILLING_ASYNC = os.environ.get("BILLING_ASYNC", "") == "1"
+
+# Bill each reading as it is saved. Set BILLING_ON_READING=0 to store readings
+# unbilled and issue the month's bills with `manage.py run_billing_cycle`.
+BILLING_ON_READING = os.environ.get("BILLING_ON_READING", "1") == "1"
+
+# Largest number of readings or payments accepted by one batch API request.
+API_BATCH_LIMIT = 1000
+
+# Request instrumentation (core.metrics): queries slower than this are logged,
+# and /metrics/ answers these addresses (and staff users).
+METRICS_SLOW_QUERY_MS = 100
+METRICS_ALLOWED_IPS = ("127.0.0.1", "::1")